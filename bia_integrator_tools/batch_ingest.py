@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel, BaseSettings
+from bia_integrator_core.models import BIAStudy
+
+from .biostudies_ingest import ingest_biostudies_accession, ingest_biostudies_accession_in_batches
+from .empiar import ingest_empiar_accession
+
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_INGEST_STATE_FPATH = Path.home()/".cache"/"bia-integrator"/"ingest-batch"/"state.json"
+
+
+class BatchIngestSettings(BaseSettings):
+    ingest_workers: int = 4
+    biostudies_accessions_per_minute: float = 60.0
+    empiar_accessions_per_minute: float = 6.0
+
+    class Config:
+        env_file = '.env'
+
+
+class RateLimiter:
+    """Space out calls to acquire so that no more than rate_per_minute of them
+    return in any minute. Thread safe; a rate of zero or less means no limit."""
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AccessionStatus(BaseModel):
+    status: str
+    n_files: int = 0
+    seconds: float = 0.0
+    error: Optional[str]
+
+
+class BatchIngestState(BaseModel):
+    accessions: Dict[str, AccessionStatus] = {}
+
+
+class BatchIngestReport(BaseModel):
+    done: List[str] = []
+    failed: Dict[str, str] = {}
+    skipped: List[str] = []
+    n_files: int = 0
+    seconds: float = 0.0
+
+    @property
+    def accessions_per_minute(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return 60 * len(self.done) / self.seconds
+
+    @property
+    def files_per_second(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.n_files / self.seconds
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.done)} ingested, {len(self.failed)} failed, {len(self.skipped)} skipped "
+            f"in {self.seconds:.1f}s: {self.accessions_per_minute:.2f} accessions/min, "
+            f"{self.files_per_second:.1f} files/sec ({self.n_files} files)"
+        )
+
+
+def load_batch_state(state_fpath: Path) -> BatchIngestState:
+
+    if state_fpath.exists():
+        return BatchIngestState.parse_file(state_fpath)
+
+    return BatchIngestState()
+
+
+def save_batch_state(state: BatchIngestState, state_fpath: Path):
+
+    state_fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = state_fpath.with_suffix(".tmp")
+    tmp_fpath.write_text(state.json())
+    os.replace(tmp_fpath, state_fpath)
+
+
+def accession_source(accession_id: str) -> str:
+    """Which archive an accession belongs to, "empiar" or "biostudies"."""
+
+    if accession_id.upper().startswith("EMPIAR-"):
+        return "empiar"
+
+    return "biostudies"
+
+
+def ingest_accession(accession_id: str, batch_size: Optional[int] = None) -> BIAStudy:
+    """Ingest a BioStudies or EMPIAR accession. If batch_size is given, BioStudies
+    file references are converted in checkpointed batches of that size."""
+
+    if accession_source(accession_id) == "empiar":
+        return ingest_empiar_accession(accession_id)
+
+    if batch_size:
+        return ingest_biostudies_accession_in_batches(accession_id, batch_size=batch_size)
+
+    return ingest_biostudies_accession(accession_id)
+
+
+def ingest_batch(
+        accession_ids: List[str],
+        state_fpath: Optional[Path] = None,
+        ingest: Callable[[str], BIAStudy] = ingest_accession,
+        settings: Optional[BatchIngestSettings] = None,
+        retry_failed: bool = True
+    ) -> BatchIngestReport:
+    """Ingest many BioStudies and EMPIAR accessions on a pool of worker threads,
+    starting no more accessions per minute from each archive than its configured
+    rate.
+
+    The status of each accession is recorded in a state file as soon as it
+    finishes, and accessions already ingested are skipped, so rerunning after an
+    interruption only does the remaining work. Failed accessions are retried
+    unless retry_failed is False."""
+
+    settings = settings or BatchIngestSettings()
+    state_fpath = state_fpath or BATCH_INGEST_STATE_FPATH
+    state = load_batch_state(state_fpath)
+    state_lock = threading.Lock()
+    rate_limiters = {
+        "biostudies": RateLimiter(settings.biostudies_accessions_per_minute),
+        "empiar": RateLimiter(settings.empiar_accessions_per_minute)
+    }
+
+    report = BatchIngestReport()
+    to_ingest = []
+    for accession_id in dict.fromkeys(accession_ids):
+        previous = state.accessions.get(accession_id)
+        if previous and (previous.status == "done" or not retry_failed):
+            report.skipped.append(accession_id)
+        else:
+            to_ingest.append(accession_id)
+
+    logger.info(f"Ingesting {len(to_ingest)} accessions, skipping {len(report.skipped)} already processed")
+
+    def run(accession_id: str) -> AccessionStatus:
+        rate_limiters[accession_source(accession_id)].acquire()
+        start = time.monotonic()
+        try:
+            bia_study = ingest(accession_id)
+            status = AccessionStatus(
+                status="done",
+                n_files=len(bia_study.file_references),
+                seconds=time.monotonic() - start
+            )
+        except Exception as e:
+            logger.exception(f"Failed to ingest {accession_id}")
+            status = AccessionStatus(
+                status="failed",
+                seconds=time.monotonic() - start,
+                error=f"{type(e).__name__}: {e}"
+            )
+
+        with state_lock:
+            state.accessions[accession_id] = status
+            save_batch_state(state, state_fpath)
+
+        return status
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=settings.ingest_workers) as executor:
+        futures = {executor.submit(run, accession_id): accession_id for accession_id in to_ingest}
+        for n, future in enumerate(as_completed(futures), start=1):
+            accession_id = futures[future]
+            status = future.result()
+            if status.status == "done":
+                report.done.append(accession_id)
+                report.n_files += status.n_files
+            else:
+                report.failed[accession_id] = status.error
+            report.seconds = time.monotonic() - start
+            logger.info(f"[{n}/{len(to_ingest)}] {accession_id} {status.status} in {status.seconds:.1f}s; {report}")
+
+    report.seconds = time.monotonic() - start
+
+    return report
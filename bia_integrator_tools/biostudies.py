@@ -1,10 +1,19 @@
+import gc
+import re
+import json
+import codecs
 import logging
 import pathlib
 import datetime
-from typing import List, Union, Optional
+import itertools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union, Optional, Iterable, Iterator, TextIO
 
-import requests
-from pydantic import BaseModel, parse_raw_as
+from pydantic import BaseModel
+
+from .http_client import get_http_client
+from .http_cache import iter_url_content
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +26,25 @@ FLIST_URI_TEMPLATE = (
 FILE_URI_TEMPLATE = (
     "https://www.ebi.ac.uk/biostudies/files/{accession_id}/{relpath}"
 )
+SEARCH_URL_TEMPLATE = "https://www.ebi.ac.uk/biostudies/api/v1/{collection}/search"
+FLIST_CHUNK_SIZE = 1024 * 1024
+
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+ARRAY_DELIMITERS = ", \t\n\r]"
+
+
+class _TextCollector(list):
+    """Minimal text "file" that collects written strings, to be joined once."""
+
+    write = list.append
+
+
+def _as_tsv(model, *args) -> str:
+
+    collector = _TextCollector()
+    model.write_tsv(collector, *args)
+
+    return "".join(collector)
 
 
 class AttributeDetail(BaseModel):
@@ -31,13 +59,14 @@ class Attribute(BaseModel):
     nmqual: List[AttributeDetail] = []
     valqual: List[AttributeDetail] = []
 
-    def as_tsv(self):
+    def write_tsv(self, fh: TextIO):
         if self.reference:
-            tsv_rep = f"<{self.name}>\t{self.value}\n"
+            fh.write(f"<{self.name}>\t{self.value}\n")
         else:
-            tsv_rep = f"{self.name}\t{self.value}\n"
+            fh.write(f"{self.name}\t{self.value}\n")
 
-        return tsv_rep
+    def as_tsv(self):
+        return _as_tsv(self)
 
 # File List
 
@@ -52,12 +81,13 @@ class Link(BaseModel):
     url: str
     attributes: List[Attribute] = []
 
-    def as_tsv(self):
-        tsv_rep = "\n"
-        tsv_rep += f"Link\t{self.url}\n"
-        tsv_rep += "".join([attr.as_tsv() for attr in self.attributes])
+    def write_tsv(self, fh: TextIO):
+        fh.write(f"\nLink\t{self.url}\n")
+        for attr in self.attributes:
+            attr.write_tsv(fh)
 
-        return tsv_rep
+    def as_tsv(self):
+        return _as_tsv(self)
 
 
 class Section(BaseModel):
@@ -69,25 +99,25 @@ class Section(BaseModel):
     links: List[Link] = []
     files: List[Union[File, List[File]]] = []
 
-    def as_tsv(self, parent_accno=None):
-        tsv_rep = "\n"
-
+    def write_tsv(self, fh: TextIO, parent_accno=None):
         accno_str = self.accno if self.accno else ""
         if parent_accno:
-            tsv_rep += f"{self.type}\t{accno_str}\t{parent_accno}"
+            fh.write(f"\n{self.type}\t{accno_str}\t{parent_accno}\n")
         else:
             if self.accno:
-                tsv_rep += f"{self.type}\t{accno_str}"
+                fh.write(f"\n{self.type}\t{accno_str}\n")
             else:
-                tsv_rep += f"{self.type}"
-
-        tsv_rep += "\n"
+                fh.write(f"\n{self.type}\n")
 
-        tsv_rep += "".join([attr.as_tsv() for attr in self.attributes])
-        tsv_rep += "".join([link.as_tsv() for link in self.links])
-        tsv_rep += "".join([section.as_tsv(self.accno) for section in self.subsections])
+        for attr in self.attributes:
+            attr.write_tsv(fh)
+        for link in self.links:
+            link.write_tsv(fh)
+        for section in iter_subsections(self):
+            section.write_tsv(fh, self.accno)
 
-        return tsv_rep
+    def as_tsv(self, parent_accno=None):
+        return _as_tsv(self, parent_accno)
 
 
 class Submission(BaseModel):
@@ -95,18 +125,115 @@ class Submission(BaseModel):
     section: Section
     attributes: List[Attribute]
 
-    def as_tsv(self) -> str:
-        tsv_rep = f"Submission"
+    def write_tsv(self, fh: TextIO):
+        """Write the submission in PageTab TSV format to the text file object fh."""
+
         if self.accno:
-            tsv_rep += f"\t{self.accno}"
-        tsv_rep += "\n"
+            fh.write(f"Submission\t{self.accno}\n")
+        else:
+            fh.write("Submission\n")
 
-        tsv_rep += "".join([attr.as_tsv() for attr in self.attributes])
-        tsv_rep += self.section.as_tsv()
+        for attr in self.attributes:
+            attr.write_tsv(fh)
+        self.section.write_tsv(fh)
 
-        return tsv_rep
+    def as_tsv(self) -> str:
+        return _as_tsv(self)
+
+
+# Trusted construction
+#
+# These build the same object tree as parse_obj, but without validation: values
+# are assigned directly as Model.construct does, and unlike construct, nested
+# models are built too. Only use them on input known to be valid (e.g. responses
+# from the BioStudies API), since no type coercion or checks are done and missing
+# required fields are not detected.
+
+
+def _trusted_constructor(model, converters: dict):
+
+    fields = [
+        (name, converters.get(name), field.default)
+        for name, field in model.__fields__.items()
+    ]
+
+    def construct(obj: dict):
+        values = {}
+        fields_set = set()
+        for name, convert, default in fields:
+            if name in obj:
+                values[name] = convert(obj[name]) if convert else obj[name]
+                fields_set.add(name)
+            elif isinstance(default, list):
+                values[name] = list(default)
+            else:
+                values[name] = default
 
+        instance = model.__new__(model)
+        object.__setattr__(instance, "__dict__", values)
+        object.__setattr__(instance, "__fields_set__", fields_set)
 
+        return instance
+
+    return construct
+
+
+def _each(construct_item):
+
+    return lambda items: [construct_item(item) for item in items]
+
+
+def _one_or_each(construct_item):
+
+    def construct(item):
+        if isinstance(item, list):
+            return [construct_item(list_item) for list_item in item]
+        return construct_item(item)
+
+    return construct
+
+
+attribute_detail_from_obj_trusted = _trusted_constructor(AttributeDetail, {})
+
+attribute_from_obj_trusted = _trusted_constructor(Attribute, {
+    "nmqual": _each(attribute_detail_from_obj_trusted),
+    "valqual": _each(attribute_detail_from_obj_trusted)
+})
+
+file_from_obj_trusted = _trusted_constructor(File, {
+    "path": pathlib.Path,
+    "attributes": _each(attribute_from_obj_trusted)
+})
+
+link_from_obj_trusted = _trusted_constructor(Link, {
+    "attributes": _each(attribute_from_obj_trusted)
+})
+
+section_from_obj_trusted = _trusted_constructor(Section, {
+    "attributes": _each(attribute_from_obj_trusted),
+    "subsections": _each(_one_or_each(lambda obj: section_from_obj_trusted(obj))),
+    "links": _each(link_from_obj_trusted),
+    "files": _each(_one_or_each(file_from_obj_trusted))
+})
+
+_submission_from_obj_trusted = _trusted_constructor(Submission, {
+    "section": section_from_obj_trusted,
+    "attributes": _each(attribute_from_obj_trusted)
+})
+
+
+def submission_from_obj_trusted(obj: dict) -> Submission:
+    """Build a Submission from already parsed JSON without validation."""
+
+    # None of the objects created here can form reference cycles, so pause the
+    # cyclic garbage collector, which otherwise repeatedly rescans the growing tree
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _submission_from_obj_trusted(obj)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
 
 # API search classes
@@ -136,56 +263,224 @@ class QueryResult(BaseModel):
 # API functions
 
 
-def load_submission(accession_id: str) -> Submission:
+def load_submission(accession_id: str, trusted: bool = False) -> Submission:
+    """Fetch and parse the submission with the given accession. If trusted is set,
+    build the models without validation (see submission_from_obj_trusted)."""
 
     url = STUDY_URL_TEMPLATE.format(accession=accession_id)
     logger.info(f"Fetching submission from {url}")
-    r = requests.get(url)
-
-    assert r.status_code == 200
+    content = b"".join(iter_url_content(url))
 
-    submission = Submission.parse_raw(r.content)
+    if trusted:
+        submission = submission_from_obj_trusted(json.loads(content))
+    else:
+        submission = Submission.parse_raw(content)
 
     return submission
 
 
+def search_studies(
+        collection: str,
+        page: int = 1,
+        page_size: int = 100,
+        sort_by: str = "release_date",
+        sort_order: str = "descending",
+        search_url_template: str = SEARCH_URL_TEMPLATE
+    ) -> QueryResult:
+    """Fetch one page of studies in the given collection from the search API. Search
+    results are not cached, since they change as studies are released."""
+
+    url = search_url_template.format(collection=collection)
+    params = {
+        "page": page,
+        "pageSize": page_size,
+        "sortBy": sort_by,
+        "sortOrder": sort_order
+    }
+    logger.info(f"Searching {url} (page {page})")
+    r = get_http_client().get(url, params=params)
+    assert r.status_code == 200, f"Search failed with status {r.status_code}"
+
+    return QueryResult.parse_raw(r.content)
+
+
 def attributes_to_dict(attributes: List[Attribute]) -> dict:
 
     return {attr.name: attr.value for attr in attributes}
 
 
-def find_file_lists_in_section(section, flists) -> list:
+def iter_subsections(section: Section) -> Iterator[Section]:
+    """Iterate over the direct subsections of a section, flattening any that are
+    grouped into lists."""
+
+    for subsection in section.subsections:
+        if isinstance(subsection, List):
+            yield from subsection
+        else:
+            yield subsection
 
-    attr_dict = attributes_to_dict(section.attributes)
 
-    if "File List" in attr_dict:
-        flists.append(attr_dict["File List"])
+class SubmissionIndex:
+    """Index of a submission's sections, built in a single pass over the section
+    tree, giving direct access to each section's attributes as a dict, to sections
+    grouped by type and to the names of all file lists."""
 
-    for subsection in section.subsections:
-        find_file_lists_in_section(subsection, flists)
+    def __init__(self, submission: Submission):
+        self.submission = submission
+        self.submission_attributes = attributes_to_dict(submission.attributes)
+        self.sections_by_type: Dict[str, List[Section]] = defaultdict(list)
+        self.file_list_fnames: List[str] = []
+        self._section_attributes: Dict[int, dict] = {}
+
+        self._index_section(submission.section)
+
+        self.study_attributes = self.attributes(submission.section)
+        self.subsections_by_type: Dict[str, List[Section]] = defaultdict(list)
+        for subsection in iter_subsections(submission.section):
+            self.subsections_by_type[subsection.type].append(subsection)
+
+    def _index_section(self, section: Section):
+        attr_dict = attributes_to_dict(section.attributes)
+        self._section_attributes[id(section)] = attr_dict
+        self.sections_by_type[section.type].append(section)
+
+        if "File List" in attr_dict:
+            self.file_list_fnames.append(attr_dict["File List"])
+
+        for subsection in iter_subsections(section):
+            self._index_section(subsection)
+
+    def attributes(self, section: Section) -> dict:
+        """Attributes of a section in the indexed submission, as a dict."""
+
+        return self._section_attributes[id(section)]
+
+    def sections_of_type(self, *types: str) -> List[Section]:
+        """All sections anywhere in the tree with one of the given types."""
+
+        return [section for type in types for section in self.sections_by_type.get(type, [])]
+
+    def subsections_of_type(self, *types: str) -> List[Section]:
+        """Direct subsections of the study section with one of the given types."""
+
+        return [section for type in types for section in self.subsections_by_type.get(type, [])]
+
+
+def iter_file_list_fnames(section: Section) -> Iterator[str]:
+    """Names of the file lists of a section and its subsections, in the same order
+    as SubmissionIndex.file_list_fnames."""
+
+    for attr in reversed(section.attributes):
+        if attr.name == "File List":
+            yield attr.value
+            break
+
+    for subsection in iter_subsections(section):
+        yield from iter_file_list_fnames(subsection)
 
 
-    return flists
+def find_file_lists_in_submission(submission: Submission) -> List[str]:
 
+    return list(iter_file_list_fnames(submission.section))
 
-def find_file_lists_in_submission(submission: Submission):
 
-    return find_file_lists_in_section(submission.section, [])
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    """Incrementally decode a JSON array from an iterable of byte chunks, yielding
+    each element as soon as it has been completely read, so that only one element
+    and one chunk need to be held in memory at a time."""
 
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunk_iter = iter(chunks)
+    buffer = ""
+    pos = 0
+    exhausted = False
 
-def flist_from_flist_fname(accession_id: str, flist_fname: str):
+    def read_more() -> bool:
+        nonlocal buffer, pos, exhausted
+        if exhausted:
+            return False
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[pos:] + text_decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        return True
+
+    pos = WHITESPACE_RE.match(buffer, pos).end()
+    while pos == len(buffer):
+        if not read_more():
+            raise ValueError("Expected a JSON array, got an empty document")
+        pos = WHITESPACE_RE.match(buffer, pos).end()
+
+    if buffer[pos] != "[":
+        raise ValueError(f"Expected a JSON array, got {buffer[pos:pos+20]!r}")
+    pos += 1
+
+    # Elements must be separated by exactly one comma, with none before the first
+    # or after the last
+    n_elements = 0
+    expect_element = True
+    while True:
+        pos = WHITESPACE_RE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if not read_more():
+                raise ValueError("Unterminated JSON array")
+            continue
+
+        if buffer[pos] == "]":
+            if expect_element and n_elements:
+                raise json.JSONDecodeError("Expecting value", buffer, pos)
+            return
+        if not expect_element:
+            if buffer[pos] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            pos += 1
+            expect_element = True
+            continue
+        if buffer[pos] == ",":
+            raise json.JSONDecodeError("Expecting value", buffer, pos)
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if not read_more():
+                raise
+            continue
+
+        # A number at the end of the buffered text may have been cut short
+        # (e.g. "2." of "2.5"), so only accept an element followed by a delimiter
+        if (end == len(buffer) or buffer[end] not in ARRAY_DELIMITERS) and read_more():
+            continue
+
+        pos = end
+        n_elements += 1
+        expect_element = False
+        yield element
+
+
+def iter_flist_records(accession_id: str, flist_fname: str) -> Iterator[dict]:
+    """Stream the raw (unvalidated) records of a file list."""
 
     flist_url = FLIST_URI_TEMPLATE.format(
         accession_id=accession_id, flist_fname=flist_fname
     )
 
-    r = requests.get(flist_url)
     logger.info(f"Fetching file list from {flist_url}")
-    assert r.status_code == 200
+    yield from iter_json_array(iter_url_content(flist_url, chunk_size=FLIST_CHUNK_SIZE))
+
+
+def iter_flist_from_flist_fname(accession_id: str, flist_fname: str) -> Iterator[File]:
 
-    fl = parse_raw_as(List[File], r.content)
+    for record in iter_flist_records(accession_id, flist_fname):
+        yield File.parse_obj(record)
 
-    return fl
+
+def flist_from_flist_fname(accession_id: str, flist_fname: str) -> List[File]:
+
+    return list(iter_flist_from_flist_fname(accession_id, flist_fname))
 
 
 def file_uri(accession_id: str, file: File):
@@ -196,12 +491,37 @@ def file_uri(accession_id: str, file: File):
     )
 
 
-def find_files_in_submission_file_lists(submission: Submission) -> List[File]:
+def find_files_in_submission_file_lists(submission: Submission, max_workers: int = 8) -> List[File]:
+    """Fetch all of the file lists in a submission, up to max_workers at a time, and
+    return their contents concatenated in the order the lists appear."""
 
     file_list_fnames = find_file_lists_in_submission(submission)
-    file_lists = [flist_from_flist_fname(submission.accno, fname) for fname in file_list_fnames]
 
-    return sum(file_lists, [])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_lists = executor.map(
+            lambda fname: flist_from_flist_fname(submission.accno, fname),
+            file_list_fnames
+        )
+        all_files = list(itertools.chain.from_iterable(file_lists))
+
+    return all_files
+
+
+def iter_files_in_section(section: Section) -> Iterator[File]:
+    """Iterate over the files attached directly to a section and its subsections."""
+
+    for file in section.files:
+        if isinstance(file, List):
+            yield from file
+        else:
+            yield file
+
+    for subsection in section.subsections:
+        if isinstance(subsection, List):
+            for list_subsection in subsection:
+                yield from iter_files_in_section(list_subsection)
+        else:
+            yield from iter_files_in_section(subsection)
 
 
 def find_files_in_submission(submission: Submission) -> List[File]:
@@ -209,18 +529,17 @@ def find_files_in_submission(submission: Submission) -> List[File]:
     the submission and as file lists."""
     
     all_files = find_files_in_submission_file_lists(submission)
-    
-    def descend_and_find_files(section, files_list=[]):
-        
-        for file in section.files:
-            if isinstance(file, List):
-                files_list += file
-            else:
-                files_list.append(file)
-            
-        for subsection in section.subsections:
-            descend_and_find_files(subsection, files_list)
-            
-    descend_and_find_files(submission.section, all_files)
-    
-    return all_files
\ No newline at end of file
+    all_files.extend(iter_files_in_section(submission.section))
+
+    return all_files
+
+
+def iter_files_in_submission(submission: Submission) -> Iterator[File]:
+    """Iterate over all of the files in a submission, in the same order as
+    find_files_in_submission, streaming file lists one record at a time rather
+    than loading them whole."""
+
+    for fname in find_file_lists_in_submission(submission):
+        yield from iter_flist_from_flist_fname(submission.accno, fname)
+
+    yield from iter_files_in_section(submission.section)
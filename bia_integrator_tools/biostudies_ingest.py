@@ -0,0 +1,443 @@
+import os
+import gzip
+import shutil
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+from bia_integrator_core.models import BIAStudy, FileReference, Author
+from bia_integrator_core.interface import persist_study, get_study, get_all_study_identifiers
+
+from .identifiers import file_to_id, file_ids_for_paths_and_sizes, persist_fileref_index
+from .file_table import FileTable, file_table_from_submission, iter_file_tables_from_submission
+from .biostudies import (
+    File,
+    Submission,
+    Section,
+    SubmissionIndex,
+    attributes_to_dict,
+    file_uri,
+    find_file_lists_in_submission
+)
+from .submission_sources import SubmissionSource, HTTPSubmissionSource, LocalMirrorSubmissionSource
+
+
+logger = logging.getLogger(__name__)
+
+
+INGEST_CHECKPOINT_DIRPATH = Path.home()/".cache"/"bia-integrator"/"ingest-checkpoints"
+INGESTED_VERSIONS_DIRPATH = Path.home()/".cache"/"bia-integrator"/"ingested-versions"
+
+
+def bst_file_to_file_reference(accession_id: str, bst_file: File, fileref_id: Optional[str] = None) -> FileReference:
+
+    fileref_id = fileref_id or file_to_id(accession_id, bst_file)
+    fileref_name = str(bst_file.path)
+    fileref_attributes = attributes_to_dict(bst_file.attributes)
+
+    fileref = FileReference(
+        id=fileref_id,
+        name=fileref_name,
+        uri=file_uri(accession_id, bst_file),
+        size_in_bytes=bst_file.size,
+        attributes=fileref_attributes
+    )
+
+    return fileref
+
+
+def filerefs_from_bst_submission(
+        submission: Submission,
+        index: Optional[SubmissionIndex] = None,
+        source: Optional[SubmissionSource] = None
+    ) -> List[FileReference]:
+
+    file_table = file_table_from_submission(submission, index, source)
+
+    logger.info(f"Creating references for {len(file_table)} files")
+    accession_id = submission.accno
+    fileref_ids = file_ids_for_paths_and_sizes(accession_id, file_table.iter_paths_and_sizes())
+    persist_fileref_index(accession_id, fileref_ids, file_table.iter_paths_and_sizes())
+
+    filerefs = [
+        bst_file_to_file_reference(accession_id, bst_file, fileref_id)
+        for bst_file, fileref_id in zip(file_table, fileref_ids)
+    ]
+
+    return filerefs
+
+
+def author_section_to_author(author_section: Section, index: SubmissionIndex) -> Author:
+
+    attributes_dict = index.attributes(author_section)
+    
+    return Author(name=attributes_dict['Name'])
+
+
+def find_authors_in_submission(index: SubmissionIndex):
+    
+    return [
+        author_section_to_author(section, index)
+        for section in index.subsections_of_type('Author', 'author')
+    ]
+
+
+def study_title_from_submission(index: SubmissionIndex) -> str:
+
+    study_title = index.submission_attributes.get("Title", None)
+    if not study_title:
+        study_title = index.study_attributes.get("Title", "Unknown")
+
+    return study_title
+
+
+def imaging_method_from_submission(index: SubmissionIndex) -> str:
+
+    study_components = index.subsections_of_type('Study Component')
+
+    if len(study_components):
+        study_component_attr_dict = index.attributes(study_components[0])
+        imaging_method = study_component_attr_dict.get('Imaging Method', "Unknown")
+    else:
+        imaging_method = "Unknown"
+
+    return imaging_method
+
+
+def study_metadata_from_submission(index: SubmissionIndex) -> dict:
+    """Study level BIAStudy fields (everything except file references)."""
+
+    return dict(
+        title=study_title_from_submission(index),
+        authors=find_authors_in_submission(index),
+        release_date=index.submission_attributes['ReleaseDate'],
+        description=index.study_attributes['Description'],
+        organism=index.study_attributes.get('Organism', "Unknown"),
+        imaging_type=imaging_method_from_submission(index)
+    )
+
+
+def bst_submission_to_bia_study(submission: Submission, source: Optional[SubmissionSource] = None) -> BIAStudy:
+
+    accession_id = submission.accno
+    index = SubmissionIndex(submission)
+    filerefs_list = filerefs_from_bst_submission(submission, index, source)
+    filerefs_dict = {fileref.id: fileref for fileref in filerefs_list}
+
+    bia_study = BIAStudy(
+        accession_id=accession_id,
+        file_references=filerefs_dict,
+        **study_metadata_from_submission(index)
+    )
+
+    return bia_study
+
+
+class StudyChangeSummary(BaseModel):
+    accession_id: str
+    added: int = 0
+    removed: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    metadata_changed: List[str] = []
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.removed or self.changed or self.metadata_changed)
+
+    def __str__(self) -> str:
+        metadata = ", ".join(self.metadata_changed) or "none"
+        return (
+            f"{self.accession_id}: {self.added} file references added, {self.removed} removed, "
+            f"{self.changed} changed, {self.unchanged} unchanged; metadata changed: {metadata}"
+        )
+
+
+def diff_file_table_against_study(
+        bia_study: BIAStudy,
+        file_table: FileTable,
+        fileref_ids: List[str]
+    ) -> Tuple[StudyChangeSummary, Dict[str, FileReference], List[str]]:
+    """Compare freshly computed file references (as a FileTable and its IDs) against
+    those stored for a study. Since IDs are derived from path and size, only new
+    or possibly changed rows are turned into FileReference objects.
+
+    Returns the summary, the added or changed file references by ID, and the IDs
+    of removed file references."""
+
+    accession_id = bia_study.accession_id
+    stored_filerefs = bia_study.file_references
+    summary = StudyChangeSummary(accession_id=accession_id)
+    updated_filerefs = {}
+
+    for n, fileref_id in enumerate(fileref_ids):
+        stored_fileref = stored_filerefs.get(fileref_id)
+        if stored_fileref is None:
+            summary.added += 1
+        elif stored_fileref.attributes != file_table.attributes_dict(n):
+            summary.changed += 1
+        else:
+            summary.unchanged += 1
+            continue
+
+        updated_filerefs[fileref_id] = bst_file_to_file_reference(accession_id, file_table[n], fileref_id)
+
+    fresh_ids = set(fileref_ids)
+    removed_ids = [fileref_id for fileref_id in stored_filerefs if fileref_id not in fresh_ids]
+    summary.removed = len(removed_ids)
+
+    return summary, updated_filerefs, removed_ids
+
+
+class IngestedVersion(BaseModel):
+    """Version of a submission (see SubmissionSource.submission_version) as last
+    ingested, with the file lists it had."""
+
+    accession_id: str
+    version: str
+    flist_fnames: List[str]
+
+
+def ingested_version_fpath(accession_id: str) -> Path:
+
+    return INGESTED_VERSIONS_DIRPATH/f"{accession_id}.json"
+
+
+def load_ingested_version(accession_id: str) -> Optional[IngestedVersion]:
+
+    fpath = ingested_version_fpath(accession_id)
+    if not fpath.exists():
+        return None
+
+    return IngestedVersion.parse_file(fpath)
+
+
+def record_ingested_version(accession_id: str, version: Optional[str], flist_fnames: List[str]):
+    """Record the version of a submission just ingested, or forget any recorded
+    version if it is not known."""
+
+    fpath = ingested_version_fpath(accession_id)
+    if version is None:
+        fpath.unlink(missing_ok=True)
+        return
+
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    ingested_version = IngestedVersion(accession_id=accession_id, version=version, flist_fnames=flist_fnames)
+    _write_atomically(fpath, ingested_version.json().encode("utf-8"))
+
+
+def reingest_biostudies_accession(accession_id: str, source: Optional[SubmissionSource] = None) -> StudyChangeSummary:
+    """Re-ingest a study, comparing the fresh submission against the stored study
+    and applying only the differences. Nothing is written if nothing changed.
+    Studies not yet stored are ingested in full.
+
+    If the submission and its file lists have the same version as when they were
+    last ingested (one HEAD request each, see SubmissionSource.submission_version),
+    nothing is downloaded at all."""
+
+    if accession_id not in get_all_study_identifiers():
+        logger.info(f"{accession_id} has not been ingested before, ingesting in full")
+        ingest_biostudies_accession(accession_id, source)
+        bia_study = get_study(accession_id)
+        return StudyChangeSummary(accession_id=accession_id, added=len(bia_study.file_references))
+
+    source = source or HTTPSubmissionSource()
+
+    ingested_version = load_ingested_version(accession_id)
+    if ingested_version is not None:
+        version = source.submission_version(accession_id, ingested_version.flist_fnames)
+        if version == ingested_version.version:
+            bia_study = get_study(accession_id)
+            summary = StudyChangeSummary(accession_id=accession_id, unchanged=len(bia_study.file_references))
+            logger.info(f"{accession_id} is unchanged since it was last ingested")
+            return summary
+
+    submission = source.load_submission(accession_id)
+    index = SubmissionIndex(submission)
+    version = source.submission_version(accession_id, index.file_list_fnames)
+    file_table = file_table_from_submission(submission, index, source)
+    fileref_ids = file_ids_for_paths_and_sizes(accession_id, file_table.iter_paths_and_sizes())
+
+    bia_study = get_study(accession_id)
+    summary, updated_filerefs, removed_ids = diff_file_table_against_study(bia_study, file_table, fileref_ids)
+
+    metadata = study_metadata_from_submission(index)
+    fresh_metadata = BIAStudy(accession_id=accession_id, file_references={}, **metadata)
+    for field in metadata:
+        if getattr(bia_study, field) != getattr(fresh_metadata, field):
+            summary.metadata_changed.append(field)
+            setattr(bia_study, field, getattr(fresh_metadata, field))
+
+    logger.info(str(summary))
+    if summary.has_changes:
+        for fileref_id in removed_ids:
+            del bia_study.file_references[fileref_id]
+        bia_study.file_references.update(updated_filerefs)
+
+        persist_study(bia_study)
+        persist_fileref_index(accession_id, fileref_ids, file_table.iter_paths_and_sizes())
+
+    record_ingested_version(accession_id, version, index.file_list_fnames)
+
+    return summary
+
+
+def ingest_biostudies_accession(accession_id: str, source: Optional[SubmissionSource] = None) -> BIAStudy:
+    """Load the BioStudies submission with the given accession from source (by
+    default the BioStudies API), convert it to a BIAStudy and persist it."""
+
+    source = source or HTTPSubmissionSource()
+    bst_submission = source.load_submission(accession_id)
+    flist_fnames = find_file_lists_in_submission(bst_submission)
+    version = source.submission_version(accession_id, flist_fnames)
+    bia_study = bst_submission_to_bia_study(bst_submission, source)
+
+    persist_study(bia_study)
+    record_ingested_version(accession_id, version, flist_fnames)
+
+    return bia_study
+
+
+class IngestCheckpoint(BaseModel):
+    """Progress of a batched ingest: the number of files (in submission order)
+    already converted and written out in batches, for a given version of the
+    submission and its file lists (see SubmissionSource.submission_version)."""
+
+    accession_id: str
+    submission_version: Optional[str]
+    n_files: int = 0
+    n_batches: int = 0
+
+
+def _write_atomically(dst_fpath: Path, content: bytes):
+
+    tmp_fpath = dst_fpath.with_name(f"{dst_fpath.name}.tmp")
+    tmp_fpath.write_bytes(content)
+    os.replace(tmp_fpath, dst_fpath)
+
+
+def _iter_batch_filerefs(checkpoint_dirpath: Path, n_batches: int) -> Iterator[FileReference]:
+
+    for n in range(n_batches):
+        with gzip.open(checkpoint_dirpath/f"batch-{n:06d}.jsonl.gz", "rt") as fh:
+            for line in fh:
+                yield FileReference.parse_raw(line)
+
+
+def ingest_biostudies_accession_in_batches(
+        accession_id: str,
+        source: Optional[SubmissionSource] = None,
+        batch_size: int = 10000,
+        checkpoint_root: Optional[Path] = None
+    ) -> BIAStudy:
+    """Ingest a study, streaming its files and converting them to file references
+    batch_size at a time. Each batch is written (gzip compressed JSON lines) to a
+    checkpoint directory as soon as it is converted, followed by a checkpoint
+    recording progress, so that an interrupted ingest resumes after the last
+    complete batch rather than starting again. Once all files are converted the
+    study is persisted and the checkpoint removed.
+
+    Batching bounds memory while file lists are read and converted, but not when
+    the study is persisted: bia_integrator_core stores a study as one document,
+    so every file reference is loaded back to build it.
+
+    A checkpoint from a different version of the submission or its file lists,
+    or one whose version could not be determined, is discarded."""
+
+    source = source or HTTPSubmissionSource()
+    checkpoint_dirpath = (checkpoint_root or INGEST_CHECKPOINT_DIRPATH)/accession_id
+    checkpoint_fpath = checkpoint_dirpath/"checkpoint.json"
+
+    submission = source.load_submission(accession_id)
+    index = SubmissionIndex(submission)
+    version = source.submission_version(accession_id, index.file_list_fnames)
+
+    checkpoint = None
+    if checkpoint_fpath.exists():
+        checkpoint = IngestCheckpoint.parse_file(checkpoint_fpath)
+        if version is None or checkpoint.submission_version != version:
+            logger.info(f"Submission {accession_id} may have changed since checkpoint, starting again")
+            checkpoint = None
+        else:
+            logger.info(f"Resuming {accession_id} after {checkpoint.n_files} files ({checkpoint.n_batches} batches)")
+
+    if checkpoint is None:
+        shutil.rmtree(checkpoint_dirpath, ignore_errors=True)
+        checkpoint_dirpath.mkdir(parents=True)
+        checkpoint = IngestCheckpoint(accession_id=accession_id, submission_version=version)
+
+    file_tables = iter_file_tables_from_submission(submission, index, source, batch_size, skip=checkpoint.n_files)
+    for file_table in file_tables:
+        fileref_ids = file_ids_for_paths_and_sizes(accession_id, file_table.iter_paths_and_sizes())
+        lines = [
+            bst_file_to_file_reference(accession_id, bst_file, fileref_id).json()
+            for bst_file, fileref_id in zip(file_table, fileref_ids)
+        ]
+        batch_fpath = checkpoint_dirpath/f"batch-{checkpoint.n_batches:06d}.jsonl.gz"
+        _write_atomically(batch_fpath, gzip.compress("\n".join(lines).encode("utf-8"), compresslevel=1))
+
+        checkpoint.n_files += len(file_table)
+        checkpoint.n_batches += 1
+        _write_atomically(checkpoint_fpath, checkpoint.json().encode("utf-8"))
+        logger.info(f"Written batch {checkpoint.n_batches} of {accession_id} ({checkpoint.n_files} files so far)")
+
+    filerefs_dict = {
+        fileref.id: fileref
+        for fileref in _iter_batch_filerefs(checkpoint_dirpath, checkpoint.n_batches)
+    }
+    bia_study = BIAStudy(
+        accession_id=accession_id,
+        file_references=filerefs_dict,
+        **study_metadata_from_submission(index)
+    )
+    persist_study(bia_study)
+    persist_fileref_index(
+        accession_id,
+        filerefs_dict.keys(),
+        ((fileref.name, fileref.size_in_bytes) for fileref in filerefs_dict.values())
+    )
+
+    record_ingested_version(accession_id, version, index.file_list_fnames)
+
+    shutil.rmtree(checkpoint_dirpath)
+
+    return bia_study
+
+
+def _ingest_from_mirror(mirror_root: Path, accession_id: str) -> Optional[str]:
+
+    try:
+        ingest_biostudies_accession(accession_id, LocalMirrorSubmissionSource(mirror_root))
+    except Exception as e:
+        logger.exception(f"Failed to ingest {accession_id}")
+        return f"{type(e).__name__}: {e}"
+
+    return None
+
+
+def ingest_accessions_from_mirror(
+        mirror_root: Path,
+        accession_ids: Optional[List[str]] = None,
+        processes: Optional[int] = None
+    ) -> Dict[str, Optional[str]]:
+    """Ingest studies from a local mirror of BioStudies JSON across a pool of
+    processes. If no accessions are given, ingest everything in the mirror.
+
+    Returns a dict of accession to error message (None on success)."""
+
+    if not accession_ids:
+        accession_ids = LocalMirrorSubmissionSource(mirror_root).list_accessions()
+
+    logger.info(f"Ingesting {len(accession_ids)} studies from {mirror_root}")
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        errors = executor.map(
+            _ingest_from_mirror,
+            [mirror_root] * len(accession_ids),
+            accession_ids,
+            chunksize=4
+        )
+        results = dict(zip(accession_ids, errors))
+
+    return results
@@ -3,6 +3,9 @@ import logging
 logger = logging.getLogger("biaint")
 logging.basicConfig(level=logging.INFO)
 
+from pathlib import Path
+from typing import List, Optional
+
 import typer
 
 from bia_integrator_core.models import (
@@ -32,6 +35,16 @@ from bia_integrator_core.interface import (
 )
 from bia_integrator_core.integrator import load_and_annotate_study
 
+from bia_integrator_tools.biostudies import SEARCH_URL_TEMPLATE
+from bia_integrator_tools.biostudies_ingest import (
+    ingest_biostudies_accession,
+    reingest_biostudies_accession,
+    ingest_accessions_from_mirror
+)
+from bia_integrator_tools.sync import sync_studies
+from bia_integrator_tools.batch_ingest import BatchIngestSettings, ingest_accession, ingest_batch
+from bia_integrator_tools.identifiers import lookup_fileref
+
 
 app = typer.Typer()
 
@@ -56,6 +69,9 @@ app.add_typer(annotations_app, name="annotations")
 filerefs_app = typer.Typer()
 app.add_typer(filerefs_app, name="filerefs")
 
+ingest_app = typer.Typer()
+app.add_typer(ingest_app, name="ingest")
+
 
 @aliases_app.command("add")
 def add_alias(accession_id: str, image_id: str, name: str):
@@ -93,6 +109,18 @@ def list_filerefs(accession_id: str):
         print(fileref.id, fileref.name, fileref.size_in_bytes)
 
 
+@filerefs_app.command("lookup")
+def lookup_fileref_by_id(accession_id: str, fileref_id: str):
+    path_and_size = lookup_fileref(accession_id, fileref_id)
+
+    if path_and_size is None:
+        typer.echo(f"No file reference {fileref_id} in index for {accession_id}")
+        raise typer.Exit(code=1)
+
+    path, size = path_and_size
+    typer.echo(f"{fileref_id} {path} {size}")
+
+
 @images_app.command("list")
 def images_list(accession_id: str):
     images = get_images_for_study(accession_id)
@@ -132,6 +160,36 @@ def list():
     typer.echo('\n'.join(sorted(studies)))
 
 
+@studies_app.command("sync")
+def sync(
+        collection: str = "BioImages",
+        full: bool = typer.Option(False, help="Check every study, not just those released since the last sync"),
+        dry_run: bool = typer.Option(False, help="Report new and changed studies without ingesting them"),
+        diff: bool = typer.Option(True, help="Re-ingest changed studies by applying only their differences"),
+        state_file: Optional[Path] = typer.Option(None, help="Sync state file (default is per collection, under ~/.cache)"),
+        page_size: int = 100,
+        workers: int = 4,
+        search_url: str = SEARCH_URL_TEMPLATE
+    ):
+    report = sync_studies(
+        collection,
+        reingest_biostudies_accession if diff else ingest_biostudies_accession,
+        state_fpath=state_file,
+        full=full,
+        dry_run=dry_run,
+        page_size=page_size,
+        max_workers=workers,
+        search_url_template=search_url
+    )
+
+    typer.echo(f"New: {' '.join(report.new)}")
+    typer.echo(f"Changed: {' '.join(report.changed)}")
+    typer.echo(f"Unchanged: {report.unchanged}")
+    if report.failed:
+        typer.echo(f"Failed: {' '.join(report.failed)}")
+        raise typer.Exit(code=1)
+
+
 @annotations_app.command("list-studies")
 def list_study_annotations(accession_id: str):
     annotations = get_study_annotations(accession_id)
@@ -193,6 +251,56 @@ def register_image_representation(accession_id: str, image_id: str, type: str, s
     persist_image_representation(rep)
 
 
+@ingest_app.command("mirror")
+def ingest_mirror(
+        mirror_root: Path,
+        accession_ids: Optional[List[str]] = typer.Argument(None, help="Accessions to ingest (default is everything in the mirror)"),
+        processes: Optional[int] = typer.Option(None, help="Number of worker processes (default is one per CPU)")
+    ):
+    results = ingest_accessions_from_mirror(mirror_root, accession_ids, processes)
+
+    failed = {accession_id: error for accession_id, error in results.items() if error}
+    for accession_id, error in failed.items():
+        typer.echo(f"{accession_id}: {error}")
+    typer.echo(f"Ingested {len(results) - len(failed)} of {len(results)} studies")
+
+    if failed:
+        raise typer.Exit(code=1)
+
+
+@ingest_app.command("batch")
+def ingest_batch_command(
+        accession_ids: Optional[List[str]] = typer.Argument(None, help="BioStudies or EMPIAR accessions to ingest"),
+        accessions_file: Optional[Path] = typer.Option(None, help="File listing accessions to ingest, one per line"),
+        state_file: Optional[Path] = typer.Option(None, help="Batch state file (default is under ~/.cache)"),
+        workers: Optional[int] = typer.Option(None, help="Number of accessions to ingest at once"),
+        batch_size: Optional[int] = typer.Option(None, help="Convert BioStudies file references in checkpointed batches of this size"),
+        retry_failed: bool = typer.Option(True, help="Retry accessions that failed in a previous run")
+    ):
+    accession_ids = accession_ids or []
+    if accessions_file:
+        accession_ids += [line.strip() for line in accessions_file.read_text().splitlines() if line.strip()]
+
+    settings = BatchIngestSettings()
+    if workers:
+        settings.ingest_workers = workers
+
+    report = ingest_batch(
+        accession_ids,
+        state_fpath=state_file,
+        ingest=lambda accession_id: ingest_accession(accession_id, batch_size),
+        settings=settings,
+        retry_failed=retry_failed
+    )
+
+    for accession_id, error in report.failed.items():
+        typer.echo(f"{accession_id}: {error}")
+    typer.echo(str(report))
+
+    if report.failed:
+        raise typer.Exit(code=1)
+
+
 @collections_app.command("create")
 def create_collection(name: str, title: str, subtitle: str, accessions_list: str):
     collection = BIACollection(
@@ -0,0 +1,417 @@
+import os
+import gzip
+import time
+import pathlib
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Optional, Dict, List, Tuple
+
+from pydantic import BaseModel, BaseSettings
+from bia_integrator_core.models import FileReference, BIAStudy, Author
+from bia_integrator_core.interface import persist_study
+
+from .http_client import get_http_client
+from .identifiers import (
+    file_to_id,
+    file_ids_for_paths_and_sizes,
+    persist_fileref_index
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+EMPIAR_ENTRY_URI_TEMPLATE = "https://www.ebi.ac.uk/empiar/api/entry/{accession_no}"
+EMPIAR_LISTING_CACHE_DIRPATH = Path.home()/".cache"/"bia-integrator"/"empiar-listings"
+
+
+class EMPIARListingSettings(BaseSettings):
+    empiar_listing_backend: str = "ftp-cached"
+    # Seconds after which the cached listing is ignored and every directory listed
+    empiar_listing_cache_ttl: int = 7 * 24 * 3600
+    empiar_s3_endpoint_url: str = "https://hl.fire.sdo.ebi.ac.uk"
+    empiar_s3_bucket_name: str = "imaging-public"
+    empiar_s3_max_workers: int = 16
+    empiar_s3_fanout_depth: int = 2
+
+    class Config:
+        env_file = '.env'
+
+
+listing_settings = EMPIARListingSettings()
+
+
+class EMPIARFile(BaseModel):
+    path: pathlib.Path
+    size: int
+
+
+class EMPIARAuthor(BaseModel):
+
+    name: str
+    author_orcid: Optional[str]
+
+
+def parse_empiar_authors(raw_obj):
+    entry_dict = list(raw_obj.values())[0]
+    author_dictlist = entry_dict['authors']
+    authors = [EMPIARAuthor.parse_obj(entry['author']) for entry in author_dictlist]
+    return authors
+
+
+def empiar_file_to_id(accession_id: str, file: EMPIARFile) -> str:
+
+    return file_to_id(accession_id, file)
+
+
+def empiar_file_uri(accession_id, file: EMPIARFile) -> str:
+
+    base_uri = "https://ftp.ebi.ac.uk"
+    accession_no = accession_id.split("-")[1]
+    root_path = f"/empiar/world_availability/{accession_no}/data"
+
+    return f"{base_uri}{root_path}/{file.path}"
+
+
+def empiar_file_to_file_reference(accession_id: str, file: EMPIARFile, fileref_id: Optional[str] = None) -> FileReference:
+
+    fileref_id = fileref_id or empiar_file_to_id(accession_id, file)
+    fileref_name = str(file.path)
+
+    fileref = FileReference(
+        id=fileref_id,
+        name=fileref_name,
+        uri=empiar_file_uri(accession_id, file),
+        size_in_bytes=file.size,
+        attributes={}
+    )
+
+    return fileref
+
+
+def fsspec_stats_to_empiar_file(stats: Dict) -> EMPIARFile:
+    empiar_file = EMPIARFile(
+        path=stats['name'],
+        size=stats['size']
+    )
+
+    return empiar_file
+
+
+def empiar_files_by_fssspec(accession_no) -> List[EMPIARFile]:
+
+    import fsspec.implementations.ftp
+
+    ftpfs = fsspec.implementations.ftp.FTPFileSystem("ftp.ebi.ac.uk")
+
+    file_list = ftpfs.find(f'/empiar/world_availability/{accession_no}/data')
+    stats_list = [ftpfs.stat(fpath) for fpath in file_list]
+    empiar_files = [fsspec_stats_to_empiar_file(stats) for stats in stats_list]
+
+    return empiar_files
+
+
+def empiar_files_by_pyfilesystem(accession_no: str) -> List[EMPIARFile]:
+
+    from fs.ftpfs import FTPFS
+
+    ftp_fs = FTPFS('ftp.ebi.ac.uk')
+    root_path = f"/empiar/world_availability/{accession_no}/data"
+    walker = ftp_fs.walk(root_path)
+
+    empiar_files = []
+
+    for path, dirs, files in walker:
+        for file in files:
+            relpath = pathlib.Path(path).relative_to(root_path)
+            empiar_file = EMPIARFile(
+                path=relpath/file.name,
+                size=file.size
+            )
+            empiar_files.append(empiar_file)
+
+    return empiar_files
+
+
+class CachedDirectory(BaseModel):
+    """Direct contents of a directory, as of its last listing."""
+
+    modified: Optional[float]
+    files: List[Tuple[str, int]] = []
+    subdirs: List[str] = []
+
+
+class EMPIARListingCache(BaseModel):
+    """Listing of an EMPIAR entry, by directory path relative to its data
+    directory ("" for the data directory itself)."""
+
+    accession_no: str
+    # When every directory was last listed
+    fully_listed_at: Optional[float] = None
+    directories: Dict[str, CachedDirectory] = {}
+
+    def is_expired(self, ttl: float) -> bool:
+        return self.fully_listed_at is None or time.time() - self.fully_listed_at > ttl
+
+    def iter_files(self) -> Iterable[EMPIARFile]:
+        for relpath, directory in self.directories.items():
+            for name, size in directory.files:
+                yield EMPIARFile(path=pathlib.Path(relpath)/name, size=size)
+
+
+# (name, is_dir, size, modified timestamp or None) for each entry in a directory
+DirectoryEntry = Tuple[str, bool, int, Optional[float]]
+
+
+def listing_cache_fpath(accession_no: str) -> Path:
+
+    return EMPIAR_LISTING_CACHE_DIRPATH/f"{accession_no}.json.gz"
+
+
+def load_listing_cache(accession_no: str) -> EMPIARListingCache:
+
+    cache_fpath = listing_cache_fpath(accession_no)
+    if cache_fpath.exists():
+        with gzip.open(cache_fpath, "rt") as fh:
+            return EMPIARListingCache.parse_raw(fh.read())
+
+    return EMPIARListingCache(accession_no=accession_no)
+
+
+def save_listing_cache(cache: EMPIARListingCache):
+
+    cache_fpath = listing_cache_fpath(cache.accession_no)
+    cache_fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = cache_fpath.with_suffix(".tmp")
+    with gzip.open(tmp_fpath, "wt") as fh:
+        fh.write(cache.json())
+    os.replace(tmp_fpath, cache_fpath)
+
+
+def refresh_listing_cache(
+        cache: EMPIARListingCache,
+        scandir: Callable[[str], Iterable[DirectoryEntry]],
+        full: bool = False
+    ) -> Tuple[EMPIARListingCache, int]:
+    """Bring a listing up to date, calling scandir with the relative path of each
+    directory that needs listing.
+
+    The data directory is always listed. Below it, a directory whose modification
+    time (as given in its parent's listing) matches the cached one is taken from
+    the cache along with everything beneath it, without contacting the server.
+    A directory's modification time does not change when something deeper in its
+    subtree does, or when a file is rewritten in place, so this can miss changes;
+    use full to list every directory, which callers do once the listing is older
+    than the empiar_listing_cache_ttl setting.
+
+    Returns the refreshed listing and the number of directories listed."""
+
+    directories = {}
+    n_listed = 0
+    stack = [("", None)]
+
+    while stack:
+        relpath, modified = stack.pop()
+        cached = cache.directories.get(relpath)
+        if not full and cached and modified is not None and cached.modified == modified:
+            cached_stack = [relpath]
+            while cached_stack:
+                cached_relpath = cached_stack.pop()
+                cached_directory = cache.directories[cached_relpath]
+                directories[cached_relpath] = cached_directory
+                cached_stack.extend(
+                    str(pathlib.Path(cached_relpath)/name) for name in cached_directory.subdirs
+                    if str(pathlib.Path(cached_relpath)/name) in cache.directories
+                )
+            continue
+
+        directory = CachedDirectory(modified=modified)
+        for name, is_dir, size, entry_modified in scandir(relpath):
+            if is_dir:
+                directory.subdirs.append(name)
+                stack.append((str(pathlib.Path(relpath)/name), entry_modified))
+            else:
+                directory.files.append((name, size))
+        directories[relpath] = directory
+        n_listed += 1
+
+    return EMPIARListingCache(
+        accession_no=cache.accession_no,
+        fully_listed_at=time.time() if full else cache.fully_listed_at,
+        directories=directories
+    ), n_listed
+
+
+def empiar_files_by_cached_ftp(accession_no: str, full_refresh: bool = False) -> List[EMPIARFile]:
+    """List the files of an EMPIAR entry over FTP, reusing the listing cached on
+    disk by the previous run and only listing directories that have changed since
+    (see refresh_listing_cache). Every directory is listed if full_refresh is set
+    or the cached listing has expired."""
+
+    from fs.ftpfs import FTPFS
+
+    ftp_fs = FTPFS('ftp.ebi.ac.uk')
+    root_path = f"/empiar/world_availability/{accession_no}/data"
+
+    def scandir(relpath: str) -> Iterable[DirectoryEntry]:
+        for info in ftp_fs.scandir(f"{root_path}/{relpath}".rstrip("/"), namespaces=["details"]):
+            modified = info.modified.timestamp() if info.modified else None
+            yield info.name, info.is_dir, info.size, modified
+
+    cache = load_listing_cache(accession_no)
+    full = full_refresh or cache.is_expired(listing_settings.empiar_listing_cache_ttl)
+    cache, n_listed = refresh_listing_cache(cache, scandir, full)
+    save_listing_cache(cache)
+    logger.info(f"Listed {n_listed} of {len(cache.directories)} directories of EMPIAR entry {accession_no}")
+
+    return list(cache.iter_files())
+
+
+def empiar_s3_prefix(accession_no: str) -> str:
+
+    return f"world_availability/{accession_no}/data/"
+
+
+def _list_s3_prefix(client, bucket_name: str, prefix: str, delimiter: str = "") -> Tuple[List[dict], List[str]]:
+    """All objects and common prefixes under prefix, following continuation tokens."""
+
+    paginator = client.get_paginator("list_objects_v2")
+
+    objects, common_prefixes = [], []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter):
+        objects.extend(page.get("Contents", []))
+        common_prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+
+    return objects, common_prefixes
+
+
+def empiar_files_by_s3(accession_no: str, settings: Optional[EMPIARListingSettings] = None) -> List[EMPIARFile]:
+    """List the files of an EMPIAR entry from the S3 interface of FIRE, which needs
+    no credentials.
+
+    Directories are discovered with delimited listings down to
+    empiar_s3_fanout_depth levels below the data directory, then each prefix at
+    that depth is listed in full (1000 keys per request). All listings run in
+    parallel on a pool of empiar_s3_max_workers threads."""
+
+    from .io import get_s3_client
+
+    settings = settings or listing_settings
+    client = get_s3_client(
+        settings.empiar_s3_endpoint_url,
+        unsigned=True,
+        max_pool_connections=settings.empiar_s3_max_workers
+    )
+    bucket_name = settings.empiar_s3_bucket_name
+    root_prefix = empiar_s3_prefix(accession_no)
+
+    def list_prefix(prefix: str, depth: int):
+        delimiter = "/" if depth < settings.empiar_s3_fanout_depth else ""
+        objects, common_prefixes = _list_s3_prefix(client, bucket_name, prefix, delimiter)
+        return depth, objects, common_prefixes
+
+    objects = []
+    with ThreadPoolExecutor(max_workers=settings.empiar_s3_max_workers) as executor:
+        pending = {executor.submit(list_prefix, root_prefix, 0)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth, prefix_objects, common_prefixes = future.result()
+                objects.extend(prefix_objects)
+                pending.update(executor.submit(list_prefix, prefix, depth + 1) for prefix in common_prefixes)
+
+    empiar_files = [
+        EMPIARFile(path=obj["Key"][len(root_prefix):], size=obj["Size"])
+        for obj in objects
+        if not obj["Key"].endswith("/")
+    ]
+    empiar_files.sort(key=lambda empiar_file: str(empiar_file.path))
+    logger.info(f"Listed {len(empiar_files)} files under {bucket_name}/{root_prefix}")
+
+    return empiar_files
+
+
+EMPIAR_LISTING_BACKENDS = {
+    "ftp": empiar_files_by_pyfilesystem,
+    "ftp-cached": empiar_files_by_cached_ftp,
+    "fsspec": empiar_files_by_fssspec,
+    "s3": empiar_files_by_s3
+}
+
+
+def list_empiar_files(
+        accession_no: str,
+        backend: Optional[str] = None,
+        full_refresh: bool = False
+    ) -> List[EMPIARFile]:
+    """List the files of an EMPIAR entry with the named backend (one of
+    EMPIAR_LISTING_BACKENDS, by default the empiar_listing_backend setting).
+    full_refresh makes the ftp-cached backend list every directory; the other
+    backends always do."""
+
+    backend = backend or listing_settings.empiar_listing_backend
+    assert backend in EMPIAR_LISTING_BACKENDS, f"Unknown EMPIAR listing backend {backend}"
+
+    if backend == "ftp-cached":
+        return empiar_files_by_cached_ftp(accession_no, full_refresh)
+
+    return EMPIAR_LISTING_BACKENDS[backend](accession_no)
+
+
+def generate_filerefs_for_empiar_entry(
+        accession_no: str,
+        backend: Optional[str] = None,
+        full_refresh: bool = False
+    ) -> List[FileReference]:
+
+    empiar_files = list_empiar_files(accession_no, backend, full_refresh)
+
+    # IDs have always been generated from this misspelt accession, so it has to stay
+    # in the hash input; the index is kept under the real one, which lookups use
+    accession_id = f"EMPIAE-{accession_no}"
+    paths_and_sizes = [(str(empiar_file.path), empiar_file.size) for empiar_file in empiar_files]
+    fileref_ids = file_ids_for_paths_and_sizes(accession_id, paths_and_sizes)
+    persist_fileref_index(f"EMPIAR-{accession_no}", fileref_ids, paths_and_sizes)
+
+    filerefs = [
+        empiar_file_to_file_reference(accession_id, empiar_file, fileref_id)
+        for empiar_file, fileref_id in zip(empiar_files, fileref_ids)
+    ]
+
+    return filerefs
+
+
+def ingest_empiar_accession(
+        accession_id: str,
+        listing_backend: Optional[str] = None,
+        full_refresh: bool = False
+    ) -> BIAStudy:
+    """Generate a BIAStudy for an EMPIAR entry (e.g. EMPIAR-10002) from the EMPIAR
+    API and a listing of its files (by default from the FTP site), and persist it.
+    full_refresh lists every directory rather than reusing a cached listing."""
+
+    accession_no = accession_id.split("-")[1]
+    logger.info(f"Generating study for EMPIAR entry {accession_no}")
+    empiar_uri = EMPIAR_ENTRY_URI_TEMPLATE.format(accession_no=accession_no)
+
+    r = get_http_client().get(empiar_uri)
+    assert r.status_code == 200, f"Fetching {empiar_uri} failed with status {r.status_code}"
+    raw_data = r.json()
+    empiar_authors = parse_empiar_authors(raw_data)
+    filerefs = generate_filerefs_for_empiar_entry(accession_no, listing_backend, full_refresh)
+
+    bia_study = BIAStudy(
+        accession_id=accession_id,
+        release_date=raw_data[accession_id]['release_date'],
+        title=raw_data[accession_id]['title'],
+        description=raw_data[accession_id]['title'],
+        organism="Unknown",
+        imaging_type="Unknown",
+        file_references={fileref.id: fileref for fileref in filerefs},
+        authors = [Author.parse_obj(a.__dict__) for a in empiar_authors]
+    )
+
+    persist_study(bia_study)
+
+    return bia_study
@@ -0,0 +1,320 @@
+import pathlib
+import itertools
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from .biostudies import (
+    File,
+    Attribute,
+    Submission,
+    SubmissionIndex,
+    iter_files_in_section
+)
+from .submission_sources import SubmissionSource, HTTPSubmissionSource
+
+
+def path_suffix(path: str) -> str:
+    """Suffix of the final path component, with the same semantics as
+    pathlib.PurePath.suffix."""
+
+    name = path.rsplit("/", 1)[-1]
+    i = name.rfind(".")
+    if 0 < i < len(name) - 1:
+        return name[i:]
+
+    return ""
+
+
+class FileTable:
+    """Compact, column oriented table of files.
+
+    Paths are stored as offsets into a single UTF-8 buffer and sizes as an int64
+    array. File suffixes and attribute values are interned, each row holding an
+    integer code into a list of distinct values (-1 where a file does not have the
+    attribute). Slicing returns a view sharing the underlying buffers, and
+    filtering only copies the (small) index arrays. Individual rows are handed out
+    as File objects on demand.
+
+    Only attribute names and values are kept, not reference flags or qualifiers."""
+
+    def __init__(
+            self,
+            path_data: bytes,
+            path_starts: np.ndarray,
+            path_ends: np.ndarray,
+            sizes: np.ndarray,
+            suffix_codes: np.ndarray,
+            suffixes: List[str],
+            attribute_codes: Dict[str, np.ndarray],
+            attribute_values: Dict[str, List[Optional[str]]]
+        ):
+        self.path_data = path_data
+        self.path_starts = path_starts
+        self.path_ends = path_ends
+        self.sizes = sizes
+        self.suffix_codes = suffix_codes
+        self.suffixes = suffixes
+        self.attribute_codes = attribute_codes
+        self.attribute_values = attribute_values
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def _select(self, selection: Union[slice, np.ndarray]) -> "FileTable":
+        return FileTable(
+            path_data=self.path_data,
+            path_starts=self.path_starts[selection],
+            path_ends=self.path_ends[selection],
+            sizes=self.sizes[selection],
+            suffix_codes=self.suffix_codes[selection],
+            suffixes=self.suffixes,
+            attribute_codes={
+                name: codes[selection] for name, codes in self.attribute_codes.items()
+            },
+            attribute_values=self.attribute_values
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._select(key)
+
+        return self.file(key)
+
+    def __iter__(self) -> Iterator[File]:
+        for n in range(len(self)):
+            yield self.file(n)
+
+    def take(self, selection) -> "FileTable":
+        """Select rows by an array of indices or a boolean mask."""
+
+        return self._select(np.asarray(selection))
+
+    def path(self, n: int) -> str:
+        return self.path_data[self.path_starts[n]:self.path_ends[n]].decode("utf-8")
+
+    def attributes_dict(self, n: int) -> dict:
+        attributes = {}
+        for name, codes in self.attribute_codes.items():
+            code = codes[n]
+            if code >= 0:
+                attributes[name] = self.attribute_values[name][code]
+
+        return attributes
+
+    def file(self, n: int) -> File:
+        return File(
+            path=self.path(n),
+            size=int(self.sizes[n]),
+            attributes=[
+                Attribute(name=name, value=value)
+                for name, value in self.attributes_dict(n).items()
+            ]
+        )
+
+    def iter_paths_and_sizes(self) -> Iterator[Tuple[str, int]]:
+        for n in range(len(self)):
+            yield self.path(n), int(self.sizes[n])
+
+    @property
+    def total_size(self) -> int:
+        return int(self.sizes.sum())
+
+    def filter_by_extension(self, extensions: Iterable[str], case_sensitive: bool = False) -> "FileTable":
+        """Select files whose suffix (as pathlib.Path.suffix) is one of extensions."""
+
+        if case_sensitive:
+            wanted = set(extensions)
+            matching_codes = [n for n, suffix in enumerate(self.suffixes) if suffix in wanted]
+        else:
+            wanted = {extension.lower() for extension in extensions}
+            matching_codes = [n for n, suffix in enumerate(self.suffixes) if suffix.lower() in wanted]
+
+        return self.take(np.isin(self.suffix_codes, matching_codes))
+
+    def filter_by_attribute(self, name: str, value: Optional[str]) -> "FileTable":
+        """Select files with the given value for the named attribute."""
+
+        values = self.attribute_values.get(name, [])
+        if value not in values:
+            return self.take(np.zeros(len(self), dtype=bool))
+
+        return self.take(self.attribute_codes[name] == values.index(value))
+
+
+class FileTableBuilder:
+    """Accumulate files row by row into compact buffers, then build a FileTable."""
+
+    def __init__(self):
+        self._path_data = bytearray()
+        self._path_starts = array("q")
+        self._path_ends = array("q")
+        self._sizes = array("q")
+        self._suffix_codes = array("i")
+        self._suffix_index: Dict[str, int] = {}
+        self._attribute_codes: Dict[str, array] = {}
+        self._attribute_index: Dict[str, Dict[Optional[str], int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def add(self, path: str, size: int, attributes: Iterable[Tuple[str, Optional[str]]] = ()):
+
+        # Normalise in the same way as the pathlib.Path of a parsed File
+        path = str(pathlib.Path(path))
+        encoded_path = path.encode("utf-8")
+        self._path_starts.append(len(self._path_data))
+        self._path_data += encoded_path
+        self._path_ends.append(len(self._path_data))
+        self._sizes.append(size)
+
+        suffix = path_suffix(path)
+        self._suffix_codes.append(self._suffix_index.setdefault(suffix, len(self._suffix_index)))
+
+        row = dict(attributes)
+        for name in row:
+            if name not in self._attribute_codes:
+                self._attribute_codes[name] = array("i", [-1]) * (len(self) - 1)
+                self._attribute_index[name] = {}
+
+        for name, codes in self._attribute_codes.items():
+            if name in row:
+                value_index = self._attribute_index[name]
+                codes.append(value_index.setdefault(row[name], len(value_index)))
+            else:
+                codes.append(-1)
+
+    def add_file(self, file: File):
+        self.add(
+            str(file.path),
+            file.size,
+            ((attr.name, attr.value) for attr in file.attributes)
+        )
+
+    def add_record(self, record: dict):
+        """Add a raw file list record, without creating a File."""
+
+        self.add(
+            record["path"],
+            int(record["size"]),
+            ((attr["name"], attr.get("value")) for attr in record.get("attributes", []))
+        )
+
+    def build(self) -> FileTable:
+        return FileTable(
+            path_data=bytes(self._path_data),
+            path_starts=np.frombuffer(self._path_starts, dtype=np.int64),
+            path_ends=np.frombuffer(self._path_ends, dtype=np.int64),
+            sizes=np.frombuffer(self._sizes, dtype=np.int64),
+            suffix_codes=np.frombuffer(self._suffix_codes, dtype=np.int32),
+            suffixes=list(self._suffix_index),
+            attribute_codes={
+                name: np.frombuffer(codes, dtype=np.int32)
+                for name, codes in self._attribute_codes.items()
+            },
+            attribute_values={
+                name: list(value_index)
+                for name, value_index in self._attribute_index.items()
+            }
+        )
+
+
+def file_table_from_files(files: Iterable[File]) -> FileTable:
+
+    builder = FileTableBuilder()
+    for file in files:
+        builder.add_file(file)
+
+    return builder.build()
+
+
+def iter_submission_file_rows(
+        submission: Submission,
+        index: SubmissionIndex,
+        source: SubmissionSource,
+        max_workers: int = 8
+    ) -> Iterator[Union[dict, File]]:
+    """Iterate over the files of a submission in the same order as
+    find_files_in_submission: raw records from each file list, then the File
+    objects attached to sections.
+
+    File lists are fetched up to max_workers at a time, as in
+    find_files_in_submission_file_lists, with no more than max_workers lists held
+    in memory at once. With max_workers=1 each list is streamed record by record
+    instead."""
+
+    if max_workers == 1:
+        for fname in index.file_list_fnames:
+            yield from source.iter_flist_records(submission.accno, fname)
+    else:
+        def fetch_records(fname: str) -> List[dict]:
+            return list(source.iter_flist_records(submission.accno, fname))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for fname in index.file_list_fnames:
+                pending.append(executor.submit(fetch_records, fname))
+                if len(pending) == max_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    yield from iter_files_in_section(submission.section)
+
+
+def _add_row(builder: FileTableBuilder, row: Union[dict, File]):
+
+    if isinstance(row, dict):
+        builder.add_record(row)
+    else:
+        builder.add_file(row)
+
+
+def file_table_from_submission(
+        submission: Submission,
+        index: Optional[SubmissionIndex] = None,
+        source: Optional[SubmissionSource] = None,
+        max_workers: int = 8
+    ) -> FileTable:
+    """Build a FileTable of all of the files in a submission, in the same order as
+    find_files_in_submission, reading file lists from source (by default the
+    BioStudies API), max_workers at a time. File list records are added straight
+    into the table without creating intermediate File objects."""
+
+    index = index or SubmissionIndex(submission)
+    source = source or HTTPSubmissionSource()
+    builder = FileTableBuilder()
+
+    for row in iter_submission_file_rows(submission, index, source, max_workers):
+        _add_row(builder, row)
+
+    return builder.build()
+
+
+def iter_file_tables_from_submission(
+        submission: Submission,
+        index: Optional[SubmissionIndex] = None,
+        source: Optional[SubmissionSource] = None,
+        batch_size: int = 10000,
+        skip: int = 0
+    ) -> Iterator[FileTable]:
+    """The rows of file_table_from_submission, after the first skip, as a series of
+    FileTables of batch_size rows. File lists are streamed, so only one batch is
+    held in memory at a time."""
+
+    index = index or SubmissionIndex(submission)
+    source = source or HTTPSubmissionSource()
+    builder = FileTableBuilder()
+
+    rows = iter_submission_file_rows(submission, index, source, max_workers=1)
+    for row in itertools.islice(rows, skip, None):
+        _add_row(builder, row)
+        if len(builder) == batch_size:
+            yield builder.build()
+            builder = FileTableBuilder()
+
+    if len(builder):
+        yield builder.build()
@@ -0,0 +1,208 @@
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+from pydantic import BaseModel, BaseSettings
+
+from .http_client import HTTPClient, get_http_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPCacheSettings(BaseSettings):
+    http_cache_enabled: bool = True
+    http_cache_dirpath: Path = Path.home()/".cache"/"bia-integrator"/"http"
+    http_cache_max_bytes: int = 2 * 1024 ** 3
+    http_cache_ttl_seconds: int = 3600
+
+    class Config:
+        env_file = '.env'
+
+
+cache_settings = HTTPCacheSettings()
+
+
+class CacheEntry(BaseModel):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class HTTPCache:
+    """Persistent cache of GET response bodies, stored gzip compressed on disk.
+
+    Entries younger than the TTL are served without contacting the server. Older
+    entries are revalidated with a conditional request (If-None-Match /
+    If-Modified-Since), so an unchanged resource costs a single 304. When the
+    cache grows beyond its size limit, the least recently used entries are
+    evicted."""
+
+    # Eviction goes down to this fraction of the size limit, so that the next full
+    # scan is not needed again straight away
+    EVICT_TO_FRACTION = 0.9
+
+    def __init__(self, settings: Optional[HTTPCacheSettings] = None, client: Optional[HTTPClient] = None):
+        self.settings = settings or cache_settings
+        self.client = client or get_http_client()
+        self.dirpath = self.settings.http_cache_dirpath
+        self.dirpath.mkdir(exist_ok=True, parents=True)
+        self._evict_lock = threading.Lock()
+        # Running total of body sizes, from the last scan plus what this process
+        # has stored since; None until the first scan
+        self._total_bytes: Optional[int] = None
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.dirpath/f"{key}.gz", self.dirpath/f"{key}.json"
+
+    def _read_entry(self, entry_fpath: Path) -> Optional[CacheEntry]:
+        try:
+            return CacheEntry.parse_file(entry_fpath)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_atomically(self, dst_fpath: Path, content: str):
+        tmp_fpath = dst_fpath.with_name(f"{dst_fpath.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_fpath.write_text(content)
+        os.replace(tmp_fpath, dst_fpath)
+
+    def _revalidate(self, url: str):
+        body_fpath, entry_fpath = self._paths(url)
+        entry = self._read_entry(entry_fpath)
+
+        headers = {}
+        if entry and body_fpath.exists():
+            if time.time() - entry.stored_at < self.settings.http_cache_ttl_seconds:
+                return
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        with self.client.get(url, headers=headers, stream=True) as r:
+            if r.status_code == 304 and headers:
+                logger.info(f"Cached copy of {url} is unchanged")
+                entry.stored_at = time.time()
+                self._write_atomically(entry_fpath, entry.json())
+                return
+
+            assert r.status_code == 200, f"Fetching {url} failed with status {r.status_code}"
+
+            tmp_fpath = body_fpath.with_name(f"{body_fpath.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with gzip.open(tmp_fpath, "wb", compresslevel=6) as fh:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    fh.write(chunk)
+            stored_bytes = tmp_fpath.stat().st_size
+            try:
+                stored_bytes -= body_fpath.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_fpath, body_fpath)
+
+            entry = CacheEntry(
+                url=url,
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified"),
+                stored_at=time.time()
+            )
+            self._write_atomically(entry_fpath, entry.json())
+
+        self._record_stored(stored_bytes)
+
+    def open(self, url: str) -> IO[bytes]:
+        """Return a readable (decompressed) file object for the body of url,
+        fetching or revalidating it first if necessary."""
+
+        body_fpath, _ = self._paths(url)
+
+        for attempt in range(2):
+            self._revalidate(url)
+            try:
+                fh = gzip.open(body_fpath, "rb")
+            except FileNotFoundError:
+                # Evicted by another process between revalidation and opening
+                continue
+            os.utime(body_fpath)
+            return fh
+
+        raise FileNotFoundError(f"Cache entry for {url} disappeared while opening")
+
+    def iter_content(self, url: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+
+        with self.open(url) as fh:
+            while chunk := fh.read(chunk_size):
+                yield chunk
+
+    def _record_stored(self, n_bytes: int):
+        """Add n_bytes to the running total, and only scan the cache directory for
+        eviction when that may be over the size limit."""
+
+        with self._evict_lock:
+            if self._total_bytes is not None:
+                self._total_bytes += n_bytes
+                if self._total_bytes <= self.settings.http_cache_max_bytes:
+                    return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within its size
+        limit (down to EVICT_TO_FRACTION of it, if it was over)."""
+
+        with self._evict_lock:
+            bodies = []
+            for body_fpath in self.dirpath.glob("*.gz"):
+                try:
+                    stat = body_fpath.stat()
+                except FileNotFoundError:
+                    continue
+                bodies.append((stat.st_mtime, stat.st_size, body_fpath))
+
+            total_size = sum(size for _, size, _ in bodies)
+            if total_size > self.settings.http_cache_max_bytes:
+                target_size = self.EVICT_TO_FRACTION * self.settings.http_cache_max_bytes
+                for _, size, body_fpath in sorted(bodies):
+                    if total_size <= target_size:
+                        break
+                    logger.info(f"Evicting {body_fpath} from HTTP cache")
+                    body_fpath.unlink(missing_ok=True)
+                    body_fpath.with_suffix(".json").unlink(missing_ok=True)
+                    total_size -= size
+
+            self._total_bytes = total_size
+
+
+_cache: Optional[HTTPCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> HTTPCache:
+    """Return the process-wide HTTPCache, creating it on first use."""
+
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HTTPCache()
+
+    return _cache
+
+
+def iter_url_content(url: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Iterate over the body of the resource at url, going through the on-disk
+    cache unless it has been disabled in settings."""
+
+    if cache_settings.http_cache_enabled:
+        yield from get_http_cache().iter_content(url, chunk_size)
+    else:
+        with get_http_client().get(url, stream=True) as r:
+            assert r.status_code == 200, f"Fetching {url} failed with status {r.status_code}"
+            yield from r.iter_content(chunk_size=chunk_size)
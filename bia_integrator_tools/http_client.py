@@ -0,0 +1,147 @@
+import time
+import random
+import logging
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from pydantic import BaseModel, BaseSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HTTPSettings(BaseSettings):
+    http_pool_connections: int = 10
+    http_pool_maxsize: int = 16
+    http_connect_timeout: float = 10.0
+    http_read_timeout: float = 120.0
+    http_max_retries: int = 5
+    http_backoff_base: float = 0.5
+    http_backoff_max: float = 30.0
+
+    class Config:
+        env_file = '.env'
+
+
+class HostStats(BaseModel):
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        if not self.requests:
+            return 0.0
+        return self.total_seconds / self.requests
+
+
+class HTTPClient:
+    """Pooled, keep-alive HTTP client. Requests that fail with a connection error
+    or a transient status code are retried with jittered exponential backoff, and
+    request counts and latencies are recorded per host."""
+
+    def __init__(self, settings: Optional[HTTPSettings] = None):
+        self.settings = settings or HTTPSettings()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.settings.http_pool_connections,
+            pool_maxsize=self.settings.http_pool_maxsize,
+            max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stats: Dict[str, HostStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, host: str, elapsed: float, retry: bool = False, error: bool = False):
+        with self._stats_lock:
+            host_stats = self.stats.setdefault(host, HostStats())
+            host_stats.requests += 1
+            host_stats.total_seconds += elapsed
+            host_stats.retries += int(retry)
+            host_stats.errors += int(error)
+
+    def _backoff_seconds(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.settings.http_backoff_max)
+
+        ceiling = min(self.settings.http_backoff_max, self.settings.http_backoff_base * 2 ** attempt)
+
+        return random.uniform(0, ceiling)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Make a request, retrying transient failures. Keyword arguments are passed
+        through to requests.Session.request."""
+
+        kwargs.setdefault(
+            "timeout",
+            (self.settings.http_connect_timeout, self.settings.http_read_timeout)
+        )
+        host = urlparse(url).netloc
+        max_retries = self.settings.http_max_retries
+
+        for attempt in range(max_retries + 1):
+            start = time.monotonic()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(host, time.monotonic() - start, retry=attempt > 0, error=True)
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"{method} {url} failed ({e}), retrying")
+                r = None
+            else:
+                self._record(host, time.monotonic() - start, retry=attempt > 0)
+                if r.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                    return r
+                logger.warning(f"{method} {url} returned {r.status_code}, retrying")
+                r.close()
+
+            time.sleep(self._backoff_seconds(attempt, r))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def log_stats(self):
+        """Log a summary of requests made and time spent, per host."""
+
+        with self._stats_lock:
+            stats = {host: host_stats.copy() for host, host_stats in self.stats.items()}
+
+        for host, host_stats in sorted(stats.items(), key=lambda item: -item[1].total_seconds):
+            logger.info(
+                f"{host}: {host_stats.requests} requests ({host_stats.retries} retries, "
+                f"{host_stats.errors} errors), {host_stats.total_seconds:.2f}s total, "
+                f"{host_stats.mean_seconds * 1000:.1f}ms mean"
+            )
+
+
+_client: Optional[HTTPClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HTTPClient:
+    """Return the process-wide HTTPClient, creating it on first use."""
+
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HTTPClient()
+
+    return _client
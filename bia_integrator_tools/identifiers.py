@@ -1,9 +1,17 @@
 import uuid
+import sqlite3
 import hashlib
+import itertools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from .biostudies import File
 
 
+FILEREF_INDEX_DIRPATH = Path.home()/".cache"/"bia-integrator"/"fileref-index"
+
+
 def file_to_id(accession_id: str, file: File):
 
     hash_input = accession_id
@@ -16,6 +24,90 @@ def file_to_id(accession_id: str, file: File):
     return str(id_as_uuid)
 
 
+def path_and_size_to_id(accession_id: str, path: str, size: int) -> str:
+    """Same result as file_to_id, but from a path and size, and without going through
+    uuid.UUID: the version 4 and RFC 4122 variant bits are set on the digest bytes
+    directly."""
+
+    digest = bytearray(hashlib.md5(f"{accession_id}{path}{size}".encode("utf-8")).digest())
+    digest[6] = (digest[6] & 0x0f) | 0x40
+    digest[8] = (digest[8] & 0x3f) | 0x80
+    h = digest.hex()
+
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _ids_for_chunk(accession_id: str, chunk: List[Tuple[str, int]]) -> List[str]:
+
+    return [path_and_size_to_id(accession_id, path, size) for path, size in chunk]
+
+
+def _chunked(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
+
+
+def file_ids_for_paths_and_sizes(
+        accession_id: str,
+        paths_and_sizes: Iterable[Tuple[str, int]],
+        processes: Optional[int] = None,
+        chunk_size: int = 50000
+    ) -> List[str]:
+    """Generate file reference IDs for (path, size) pairs, in order. Inputs larger
+    than one chunk are split into chunks and processed across a pool of
+    processes."""
+
+    chunks = _chunked(paths_and_sizes, chunk_size)
+    first_chunk = next(chunks, [])
+    ids = _ids_for_chunk(accession_id, first_chunk)
+
+    if len(first_chunk) == chunk_size and processes != 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for chunk_ids in executor.map(_ids_for_chunk, itertools.repeat(accession_id), chunks):
+                ids.extend(chunk_ids)
+
+    return ids
+
+
+def fileref_index_fpath(accession_id: str) -> Path:
+
+    return FILEREF_INDEX_DIRPATH/f"{accession_id}.sqlite"
+
+
+def persist_fileref_index(accession_id: str, fileref_ids: Iterable[str], paths_and_sizes: Iterable[Tuple[str, int]]):
+    """Store the mapping of file reference ID to (path, size) for an accession,
+    replacing any existing index."""
+
+    index_fpath = fileref_index_fpath(accession_id)
+    index_fpath.parent.mkdir(exist_ok=True, parents=True)
+
+    with sqlite3.connect(index_fpath) as conn:
+        conn.execute("DROP TABLE IF EXISTS filerefs")
+        conn.execute("CREATE TABLE filerefs (id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL)")
+        conn.executemany(
+            "INSERT OR REPLACE INTO filerefs VALUES (?, ?, ?)",
+            ((fileref_id, path, size) for fileref_id, (path, size) in zip(fileref_ids, paths_and_sizes))
+        )
+    conn.close()
+
+
+def lookup_fileref(accession_id: str, fileref_id: str) -> Optional[Tuple[str, int]]:
+    """Find the (path, size) of a file reference from the persisted index, or None if
+    it is not in the index."""
+
+    index_fpath = fileref_index_fpath(accession_id)
+    if not index_fpath.exists():
+        return None
+
+    with sqlite3.connect(index_fpath) as conn:
+        row = conn.execute("SELECT path, size FROM filerefs WHERE id = ?", (fileref_id,)).fetchone()
+    conn.close()
+
+    return tuple(row) if row else None
+
+
 def test_bst_file_to_uuid():
 
     first_bst_file = File(path="file1.tif", size=123)
@@ -44,4 +136,29 @@ def test_bst_file_to_uuid():
     # Same accession, same filename, different size should produce different ids
     first_id = file_to_id(accession_id="foo1", file=second_bst_file)
     second_id = file_to_id(accession_id="foo1", file=third_bst_file)
-    assert first_id != second_id
\ No newline at end of file
+    assert first_id != second_id
+
+
+def test_batch_ids_match_file_to_id():
+
+    files = [File(path=f"dir/file{n}.tif", size=n * 1000) for n in range(20)]
+    paths_and_sizes = [(str(file.path), file.size) for file in files]
+
+    expected_ids = [file_to_id("foo1", file) for file in files]
+
+    assert file_ids_for_paths_and_sizes("foo1", paths_and_sizes) == expected_ids
+    assert file_ids_for_paths_and_sizes("foo1", paths_and_sizes, processes=2, chunk_size=3) == expected_ids
+
+
+def test_fileref_index_round_trip(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(f"{__name__}.FILEREF_INDEX_DIRPATH", tmp_path)
+
+    # EMPIAR IDs are generated from a misspelt accession, but indexed under the real one
+    paths_and_sizes = [("dir/file1.tif", 123), ("dir/file2.tif", 456)]
+    fileref_ids = file_ids_for_paths_and_sizes("EMPIAE-12345", paths_and_sizes)
+    persist_fileref_index("EMPIAR-12345", fileref_ids, paths_and_sizes)
+
+    assert lookup_fileref("EMPIAR-12345", fileref_ids[1]) == ("dir/file2.tif", 456)
+    assert lookup_fileref("EMPIAR-12345", "not-an-id") is None
+    assert lookup_fileref("EMPIAR-54321", fileref_ids[1]) is None
@@ -1,14 +1,31 @@
 from pathlib import Path
+import json
+import time
+import random
+import hashlib
 import logging
 import shutil
-import subprocess
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 import requests
-from pydantic import BaseSettings
+from botocore import UNSIGNED
+from botocore.config import Config
+from pydantic import BaseModel, BaseSettings
 from bia_integrator_core.models import FileReference
 
+from .zipindex import get_zip_index, group_members_into_spans, iter_span_members
+from .zarr_metadata import (
+    CONSOLIDATED_METADATA_FNAME,
+    consolidated_documents,
+    is_metadata_key,
+    write_consolidated_metadata
+)
+
     
 logger = logging.getLogger(__name__)
 
@@ -16,23 +33,145 @@ logger = logging.getLogger(__name__)
 class C2ZSettings(BaseSettings):
     endpoint_url: str = "https://uk1s3.embassy.ebi.ac.uk"
     bucket_name: str = "bia-integrator-data"
+    s3_max_pool_connections: int = 32
+    s3_upload_workers: int = 16
+    s3_upload_max_in_flight_bytes: int = 512 * 1024 ** 2
+    s3_upload_max_retries: int = 3
+    s3_multipart_threshold: int = 8 * 1024 ** 2
 
 
 c2zsettings = C2ZSettings()
 
 
+_s3_clients: Dict[Tuple, object] = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(
+        endpoint_url: Optional[str] = None,
+        aws_access_key_id: Optional[str] = None,
+        aws_secret_access_key: Optional[str] = None,
+        unsigned: bool = False,
+        max_pool_connections: Optional[int] = None
+    ):
+    """Return the process-wide S3 client for an endpoint and set of credentials
+    (by default the configured endpoint and boto3's usual credential chain),
+    creating it on first use. boto3 clients are thread safe, so one client and its
+    connection pool are shared by every caller."""
+
+    endpoint_url = endpoint_url or c2zsettings.endpoint_url
+    max_pool_connections = max_pool_connections or c2zsettings.s3_max_pool_connections
+    key = (endpoint_url, aws_access_key_id, aws_secret_access_key, unsigned, max_pool_connections)
+
+    with _s3_clients_lock:
+        if key not in _s3_clients:
+            config = Config(max_pool_connections=max_pool_connections)
+            if unsigned:
+                config = config.merge(Config(signature_version=UNSIGNED))
+            _s3_clients[key] = boto3.session.Session().client(
+                's3',
+                endpoint_url=endpoint_url,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                config=config
+            )
+
+        return _s3_clients[key]
+
+
+def is_consolidated_metadata(fpath: Path) -> bool:
+
+    return fpath.name == CONSOLIDATED_METADATA_FNAME
+
+
 def upload_dirpath_as_zarr_image_rep(src_dirpath, accession_id, image_id):
 
-    dst_prefix = f"{c2zsettings.bucket_name}/{accession_id}/{image_id}/{image_id}.zarr"
+    dst_prefix = f"{accession_id}/{image_id}/{image_id}.zarr"
     logger.info(f"Uploading with prefix {dst_prefix}")
-    cmd = f"aws --region us-east-1 --endpoint-url {c2zsettings.endpoint_url} s3 sync {src_dirpath}/ s3://{dst_prefix} --acl public-read"
-    subprocess.run(cmd, shell=True)
+    write_consolidated_metadata(Path(src_dirpath))
+    # Consolidated metadata goes last, once everything it describes is in place
+    result = sync_dirpath_to_s3(
+        Path(src_dirpath), dst_prefix, include=lambda fpath: not is_consolidated_metadata(fpath)
+    )
+    assert not result.failed, f"{result.failed} files failed to upload, e.g. {result.failures[0].src_fpath}: {result.failures[0].error}"
+    result = sync_dirpath_to_s3(Path(src_dirpath), dst_prefix, include=is_consolidated_metadata)
+    assert not result.failed, f"{result.failed} files failed to upload, e.g. {result.failures[0].src_fpath}: {result.failures[0].error}"
 
     uri = f"{c2zsettings.endpoint_url}/{c2zsettings.bucket_name}/{accession_id}/{image_id}/{image_id}.zarr"
 
     return uri
 
 
+def upload_zipped_zarr_to_s3(zip_uri: str, dst_prefix: str, max_workers: int = 16, span_bytes: int = 16 * 1024 ** 2) -> int:
+    """Upload the contents of the zipped Zarr at zip_uri to keys under dst_prefix,
+    stripping the archive's single top level directory, without downloading or
+    extracting the archive to disk.
+
+    Members are grouped into runs of up to span_bytes of the archive. Each worker
+    fetches a run with one Range request, then decompresses and uploads its members
+    from memory, so at most max_workers runs are held in memory at once. Once all
+    members are uploaded, consolidated metadata is written for the root and each
+    multiscale image.
+
+    Returns the number of objects uploaded."""
+
+    zip_index = get_zip_index(zip_uri)
+    members = [member for member in zip_index.members if not member.is_dir]
+    top_level_names = {member.filename.split("/", 1)[0] for member in zip_index.members}
+    assert len(top_level_names) == 1 and all("/" in member.filename for member in members), \
+        f"Expected a single top level directory in {zip_uri}"
+    strip_length = len(top_level_names.pop()) + 1
+
+    s3 = get_s3_client(max_pool_connections=max(max_workers, c2zsettings.s3_max_pool_connections))
+    documents: Dict[str, dict] = {}
+    documents_lock = threading.Lock()
+
+    def upload_span(span):
+        for member, content in iter_span_members(zip_uri, span):
+            key = member.filename[strip_length:]
+            s3.put_object(Bucket=c2zsettings.bucket_name, Key=f"{dst_prefix}/{key}", Body=content, ACL="public-read")
+            if is_metadata_key(key):
+                with documents_lock:
+                    documents[key] = json.loads(content)
+
+        return len(span), sum(member.file_size for member in span)
+
+    spans = group_members_into_spans(members, span_bytes)
+    logger.info(f"Uploading {len(members)} objects from {zip_uri} to {dst_prefix} in {len(spans)} parts")
+
+    start = time.monotonic()
+    n_uploaded, n_bytes = 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(upload_span, span) for span in spans]
+        for n, future in enumerate(as_completed(futures), start=1):
+            span_count, span_bytes_uploaded = future.result()
+            n_uploaded += span_count
+            n_bytes += span_bytes_uploaded
+            if n % 100 == 0 or n == len(spans):
+                elapsed = time.monotonic() - start
+                logger.info(
+                    f"Uploaded {n_uploaded}/{len(members)} objects, "
+                    f"{n_bytes / elapsed / 1024 ** 2:.1f}MiB/s"
+                )
+
+    consolidated_by_key = consolidated_documents(documents)
+    for key, consolidated in consolidated_by_key.items():
+        put_string_to_s3(json.dumps(consolidated, indent=4, sort_keys=True), f"{dst_prefix}/{key}")
+    logger.info(f"Wrote consolidated metadata for {len(consolidated_by_key)} groups")
+
+    return n_uploaded
+
+
+def upload_zipped_zarr_as_zarr_image_rep(zip_uri, accession_id, image_id):
+
+    dst_prefix = f"{accession_id}/{image_id}/{image_id}.zarr"
+    upload_zipped_zarr_to_s3(zip_uri, dst_prefix)
+
+    uri = f"{c2zsettings.endpoint_url}/{c2zsettings.bucket_name}/{dst_prefix}"
+
+    return uri
+
+
 def copy_uri_to_local(src_uri: str, dst_fpath: Path):
     """Copy the object at the given source URI to the local path specified by dst_fpath."""
 
@@ -49,9 +188,9 @@ def put_string_to_s3(string: str, dst_key: str) -> str:
     endpoint_url = c2zsettings.endpoint_url
     bucket_name = c2zsettings.bucket_name
 
-    s3 = boto3.resource('s3', endpoint_url=endpoint_url)
+    s3 = get_s3_client(endpoint_url)
     logger.info(f"Uploading {string} to {dst_key}")
-    s3.Object(bucket_name, dst_key).put(Body=string, ACL="public-read")
+    s3.put_object(Bucket=bucket_name, Key=dst_key, Body=string, ACL="public-read")
   
     return f"{endpoint_url}/{bucket_name}/{dst_key}"
 
@@ -66,20 +205,262 @@ def copy_local_to_s3(src_fpath: Path, dst_key: str) -> str:
     endpoint_url = c2zsettings.endpoint_url
     bucket_name = c2zsettings.bucket_name
 
-    s3 = boto3.resource('s3', endpoint_url=endpoint_url)
+    s3 = get_s3_client(endpoint_url)
     logger.info(f"Uploading {src_fpath} to {dst_key}")
-    response = s3.meta.client.upload_file(str(src_fpath), bucket_name, dst_key, ExtraArgs = {"ACL": "public-read"}) # type: ignore
+    response = s3.upload_file(str(src_fpath), bucket_name, dst_key, ExtraArgs = {"ACL": "public-read"}) # type: ignore
 
     return f"{endpoint_url}/{bucket_name}/{dst_key}"
 
 
-def upload_multiple_files_to_s3(src_dst_list):
+class UploadFailure(BaseModel):
+    src_fpath: Path
+    dst_key: str
+    error: str
+
+
+class _InFlightBudget:
+    """Limit the bytes and number of uploads in flight. A single upload larger than
+    the byte budget is let through on its own."""
+
+    def __init__(self, max_bytes: int, max_count: int):
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.n_bytes = 0
+        self.count = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, n_bytes: int):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.count == 0 or (
+                    self.count < self.max_count and self.n_bytes + n_bytes <= self.max_bytes
+                )
+            )
+            self.n_bytes += n_bytes
+            self.count += 1
+
+    def release(self, n_bytes: int):
+        with self._condition:
+            self.n_bytes -= n_bytes
+            self.count -= 1
+            self._condition.notify_all()
+
+
+class _UploadProgress:
+    """Count completed uploads and log progress and throughput every interval
+    seconds."""
+
+    def __init__(self, n_total: int, interval: float = 5.0):
+        self.n_total = n_total
+        self.interval = interval
+        self.n_done = 0
+        self.n_failed = 0
+        self.n_bytes = 0
+        self.start = time.monotonic()
+        self._last_logged = self.start
+        self._lock = threading.Lock()
+
+    def record(self, n_bytes: int, failed: bool = False):
+        with self._lock:
+            self.n_done += 1
+            self.n_failed += int(failed)
+            self.n_bytes += 0 if failed else n_bytes
+            now = time.monotonic()
+            if now - self._last_logged >= self.interval or self.n_done == self.n_total:
+                self._last_logged = now
+                self.log()
+
+    def log(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        logger.info(
+            f"Uploaded {self.n_done - self.n_failed}/{self.n_total} files ({self.n_failed} failed), "
+            f"{self.n_bytes / elapsed / 1024 ** 2:.1f}MiB/s, {self.n_done / elapsed:.0f} files/s"
+        )
+
+
+def _upload_file_with_retries(s3, src_fpath: Path, dst_key: str, size: int, max_retries: int):
+
+    for attempt in range(max_retries + 1):
+        try:
+            if size < c2zsettings.s3_multipart_threshold:
+                with open(src_fpath, "rb") as fh:
+                    s3.put_object(Bucket=c2zsettings.bucket_name, Key=dst_key, Body=fh, ACL="public-read")
+            else:
+                # Part size matches the threshold, so that local_etag can predict the ETag
+                transfer_config = TransferConfig(
+                    multipart_threshold=c2zsettings.s3_multipart_threshold,
+                    multipart_chunksize=c2zsettings.s3_multipart_threshold
+                )
+                s3.upload_file(
+                    str(src_fpath), c2zsettings.bucket_name, dst_key,
+                    ExtraArgs={"ACL": "public-read"}, Config=transfer_config
+                )
+            return
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            logger.warning(f"Uploading {src_fpath} to {dst_key} failed ({e}), retrying")
+            time.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+
+
+def upload_multiple_files_to_s3(
+        src_dst_list: Iterable[Tuple[Path, str]],
+        max_workers: Optional[int] = None,
+        max_in_flight_bytes: Optional[int] = None,
+        max_retries: Optional[int] = None
+    ) -> List[UploadFailure]:
     """Upload multiple files to S3, expected input is a list of:
     (source file local path, destination key) tuples.
-    Credentials, endpoint and bucket assumed to be determined by global config."""
+    Credentials, endpoint and bucket assumed to be determined by global config.
+
+    Files are uploaded concurrently by max_workers threads, with no more than
+    max_in_flight_bytes being uploaded at once, and each is retried up to
+    max_retries times (defaults for all of these are in C2ZSettings). Progress and
+    throughput are logged as the upload proceeds.
+
+    Returns the files that could not be uploaded; the rest of the batch carries on
+    regardless of failures."""
+
+    max_workers = max_workers or c2zsettings.s3_upload_workers
+    max_in_flight_bytes = max_in_flight_bytes or c2zsettings.s3_upload_max_in_flight_bytes
+    max_retries = c2zsettings.s3_upload_max_retries if max_retries is None else max_retries
+
+    src_dst_list = [(Path(src_fpath), dst_key) for src_fpath, dst_key in src_dst_list]
+    s3 = get_s3_client(max_pool_connections=max(max_workers, c2zsettings.s3_max_pool_connections))
+    budget = _InFlightBudget(max_in_flight_bytes, max_count=4 * max_workers)
+    progress = _UploadProgress(len(src_dst_list))
+    failures: List[UploadFailure] = []
+    failures_lock = threading.Lock()
+
+    def upload(src_fpath: Path, dst_key: str, size: int):
+        try:
+            _upload_file_with_retries(s3, src_fpath, dst_key, size, max_retries)
+        except Exception as e:
+            logger.error(f"Failed to upload {src_fpath} to {dst_key}: {e}")
+            with failures_lock:
+                failures.append(UploadFailure(src_fpath=src_fpath, dst_key=dst_key, error=f"{type(e).__name__}: {e}"))
+            progress.record(size, failed=True)
+        else:
+            progress.record(size)
+        finally:
+            budget.release(size)
+
+    logger.info(f"Uploading {len(src_dst_list)} files with {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for src_fpath, dst_key in src_dst_list:
+            try:
+                size = src_fpath.stat().st_size
+            except OSError as e:
+                with failures_lock:
+                    failures.append(UploadFailure(src_fpath=src_fpath, dst_key=dst_key, error=f"{type(e).__name__}: {e}"))
+                progress.record(0, failed=True)
+                continue
+            budget.acquire(size)
+            executor.submit(upload, src_fpath, dst_key, size)
+
+    return failures
+
+
+class SyncResult(BaseModel):
+    uploaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    uploaded_bytes: int = 0
+    skipped_bytes: int = 0
+    failures: List[UploadFailure] = []
+
+
+def local_etag(fpath: Path, size: Optional[int] = None) -> str:
+    """The ETag S3 gives a file uploaded as upload_multiple_files_to_s3 does: the MD5
+    of its content below the multipart threshold, otherwise the MD5 of the part
+    MD5s followed by the number of parts (parts being the threshold size)."""
+
+    size = fpath.stat().st_size if size is None else size
+    part_size = c2zsettings.s3_multipart_threshold
+
+    with open(fpath, "rb") as fh:
+        if size < part_size:
+            return hashlib.md5(fh.read()).hexdigest()
+
+        part_digests = []
+        while part := fh.read(part_size):
+            part_digests.append(hashlib.md5(part).digest())
+
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def list_s3_prefix(prefix: str) -> Dict[str, Tuple[int, str]]:
+    """Size and ETag of every object under prefix in the configured bucket."""
+
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+
+    objects = {}
+    for page in paginator.paginate(Bucket=c2zsettings.bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            objects[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+
+    return objects
+
+
+def sync_dirpath_to_s3(
+        src_dirpath: Path,
+        dst_prefix: str,
+        max_workers: Optional[int] = None,
+        include: Optional[Callable[[Path], bool]] = None
+    ) -> SyncResult:
+    """Upload the files under src_dirpath to keys under dst_prefix, skipping those
+    already present with the same size and checksum, so that re-running an
+    interrupted upload only sends what is missing or has changed. If given, only
+    files for which include returns True are considered.
+
+    The destination is listed once; local checksums are only computed for files
+    whose size matches an existing object. Uploads run concurrently (see
+    upload_multiple_files_to_s3)."""
+
+    max_workers = max_workers or c2zsettings.s3_upload_workers
+    existing = list_s3_prefix(f"{dst_prefix}/")
+
+    candidates = []
+    for fpath in sorted(src_dirpath.rglob("*")):
+        if fpath.is_file() and (include is None or include(fpath)):
+            dst_key = f"{dst_prefix}/{fpath.relative_to(src_dirpath).as_posix()}"
+            candidates.append((fpath, dst_key, fpath.stat().st_size))
+
+    def is_unchanged(candidate) -> bool:
+        fpath, dst_key, size = candidate
+        if existing.get(dst_key, (None, None))[0] != size:
+            return False
+        return existing[dst_key][1] == local_etag(fpath, size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        unchanged = list(executor.map(is_unchanged, candidates))
+
+    result = SyncResult()
+    to_upload = []
+    for (fpath, dst_key, size), skip in zip(candidates, unchanged):
+        if skip:
+            result.skipped += 1
+            result.skipped_bytes += size
+        else:
+            to_upload.append((fpath, dst_key))
+
+    logger.info(f"Syncing {src_dirpath} to {dst_prefix}: {len(to_upload)} to upload, {result.skipped} unchanged")
+    result.failures = upload_multiple_files_to_s3(to_upload, max_workers=max_workers)
+
+    failed_fpaths = {failure.src_fpath for failure in result.failures}
+    sizes = {fpath: size for fpath, _, size in candidates}
+    for fpath, _ in to_upload:
+        if fpath not in failed_fpaths:
+            result.uploaded += 1
+            result.uploaded_bytes += sizes[fpath]
+    result.failed = len(result.failures)
 
-    for src_fpath, dst_key in src_dst_list:
-        copy_local_to_s3(src_fpath, dst_key)
+    logger.info(
+        f"Synced {src_dirpath}: {result.uploaded} uploaded ({result.uploaded_bytes} bytes), "
+        f"{result.skipped} skipped ({result.skipped_bytes} bytes), {result.failed} failed"
+    )
+
+    return result
 
 
 def get_s3_key_prefix(accession_id, image_id):
@@ -89,7 +470,8 @@ def get_s3_key_prefix(accession_id, image_id):
 
 def copy_local_zarr_to_s3(zarr_fpath: Path, accession_id: str, image_id: str) -> str:
     """Copy the zarr at the given local path to S3, credentials, bucket and endpoint will
-    be taken from global config. Return the URI of the Zarr generated."""
+    be taken from global config. Consolidated metadata is written for the root and
+    each multiscale image, and uploaded last. Return the URI of the Zarr generated."""
 
     endpoint_url = c2zsettings.endpoint_url
     bucket_name = c2zsettings.bucket_name
@@ -98,18 +480,70 @@ def copy_local_zarr_to_s3(zarr_fpath: Path, accession_id: str, image_id: str) ->
 
     s3_key_prefix = get_s3_key_prefix(accession_id, image_id)
 
+    write_consolidated_metadata(zarr_fpath)
+
     upload_list = []
+    consolidated_upload_list = []
     for f in zarr_fpath.rglob("*"):
         if f.is_file():
-            upload_list.append((f, f"{s3_key_prefix}/{f.relative_to(zarr_parent_dirpath)}"))
+            src_dst = (f, f"{s3_key_prefix}/{f.relative_to(zarr_parent_dirpath)}")
+            (consolidated_upload_list if is_consolidated_metadata(f) else upload_list).append(src_dst)
 
-    upload_multiple_files_to_s3(upload_list)
+    for src_dst_list in (upload_list, consolidated_upload_list):
+        failures = upload_multiple_files_to_s3(src_dst_list)
+        assert not failures, f"{len(failures)} of {len(src_dst_list)} files failed to upload, e.g. {failures[0].src_fpath}: {failures[0].error}"
 
     zarr_image_uri = f"{endpoint_url}/{bucket_name}/{s3_key_prefix}/{image_id}.zarr/0"
 
     return zarr_image_uri
 
 
+def sync_sharded_zarr_to_s3(src_dirpath: Path, dst_prefix: str) -> SyncResult:
+    """Sync a sharded Zarr v3 hierarchy (see sharding.shard_zarr) to dst_prefix.
+
+    Shards go first and zarr.json metadata only once they are all in place, so a
+    reader never finds an array whose shards are still missing; if any shard fails
+    no metadata is uploaded. Shards are large, so they are sent as multipart
+    uploads by fewer workers, each within the in-flight byte budget."""
+
+    def is_metadata(fpath: Path) -> bool:
+        return fpath.name == "zarr.json"
+
+    shard_workers = max(1, c2zsettings.s3_upload_max_in_flight_bytes // (64 * 1024 ** 2))
+    result = sync_dirpath_to_s3(
+        src_dirpath, dst_prefix, max_workers=min(c2zsettings.s3_upload_workers, shard_workers),
+        include=lambda fpath: not is_metadata(fpath)
+    )
+    if result.failed:
+        return result
+
+    metadata_result = sync_dirpath_to_s3(src_dirpath, dst_prefix, include=is_metadata)
+    for field in ("uploaded", "skipped", "failed", "uploaded_bytes", "skipped_bytes"):
+        setattr(result, field, getattr(result, field) + getattr(metadata_result, field))
+    result.failures = metadata_result.failures
+
+    return result
+
+
+def upload_dirpath_as_sharded_zarr_image_rep(src_dirpath, accession_id, image_id):
+    """Upload a local sharded Zarr (see sharding.shard_zarr) to the same place as
+    upload_dirpath_as_zarr_image_rep, returning the URI of its root."""
+
+    dst_prefix = f"{get_s3_key_prefix(accession_id, image_id)}/{image_id}.zarr"
+    logger.info(f"Uploading with prefix {dst_prefix}")
+    result = sync_sharded_zarr_to_s3(Path(src_dirpath), dst_prefix)
+    assert not result.failed, f"{result.failed} files failed to upload, e.g. {result.failures[0].src_fpath}: {result.failures[0].error}"
+
+    return f"{c2zsettings.endpoint_url}/{c2zsettings.bucket_name}/{dst_prefix}"
+
+
+def copy_local_sharded_zarr_to_s3(zarr_fpath: Path, accession_id: str, image_id: str) -> str:
+    """Copy a local sharded Zarr to S3 in the same place copy_local_zarr_to_s3
+    would put the unsharded one, returning the URI of its image, as that does."""
+
+    return f"{upload_dirpath_as_sharded_zarr_image_rep(zarr_fpath, accession_id, image_id)}/0"
+
+
 def stage_fileref_and_get_fpath(accession_id: str, fileref: FileReference) -> Path:
 
     cache_root_dirpath = Path.home()/".cache"/"bia-converter"
@@ -0,0 +1,458 @@
+import os
+import json
+import math
+import shutil
+import logging
+import itertools
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pydantic import BaseModel, BaseSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ShardingSettings(BaseSettings):
+    # Shard shape in pixels, aligned to the last axes of each array and rounded
+    # down to a multiple of its chunks. If unset, shards are grown (x, y, z, ...)
+    # up to zarr_shard_target_bytes of uncompressed data
+    zarr_shard_shape: Optional[List[int]] = None
+    zarr_shard_target_bytes: int = 128 * 1024 ** 2
+    zarr_shard_workers: int = 8
+
+    class Config:
+        env_file = '.env'
+
+
+sharding_settings = ShardingSettings()
+
+
+# Attributes which OME-NGFF 0.5 keeps under "ome" in Zarr v3 group metadata
+NGFF_ATTRIBUTES = {"multiscales", "omero", "labels", "image-label", "plate", "well", "bioformats2raw.layout", "series"}
+V2_METADATA_FNAMES = {".zarray", ".zgroup", ".zattrs", ".zmetadata"}
+EMPTY_CHUNK = 2 ** 64 - 1
+BLOSC_SHUFFLES = {0: "noshuffle", 1: "shuffle", 2: "bitshuffle"}
+
+
+class ShardingResult(BaseModel):
+    n_arrays: int = 0
+    n_source_chunks: int = 0
+    n_shards: int = 0
+    n_reencoded_chunks: int = 0
+    source_bytes: int = 0
+    sharded_bytes: int = 0
+
+
+def _crc32c_table() -> List[int]:
+
+    table = []
+    for n in range(256):
+        crc = n
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data: bytes) -> int:
+    """CRC-32C (Castagnoli), which Zarr v3 uses to check shard indexes."""
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+
+    return crc ^ 0xFFFFFFFF
+
+
+def v3_compressor_codec(compressor: Optional[dict], dtype: np.dtype) -> Optional[List[dict]]:
+    """Zarr v3 codecs which decode the same bytes as a v2 compressor, so that chunks
+    can be copied into shards without re-encoding, or None if there are none."""
+
+    if compressor is None:
+        return []
+
+    if compressor["id"] == "blosc":
+        shuffle = compressor.get("shuffle", 1)
+        if shuffle == -1:
+            shuffle = 2 if dtype.itemsize == 1 else 1
+        return [{
+            "name": "blosc",
+            "configuration": {
+                "cname": compressor["cname"],
+                "clevel": compressor["clevel"],
+                "shuffle": BLOSC_SHUFFLES[shuffle],
+                "typesize": dtype.itemsize,
+                "blocksize": compressor.get("blocksize", 0)
+            }
+        }]
+
+    if compressor["id"] == "gzip":
+        return [{"name": "gzip", "configuration": {"level": compressor.get("level", 1)}}]
+
+    if compressor["id"] == "zstd":
+        return [{
+            "name": "zstd",
+            "configuration": {"level": compressor.get("level", 1), "checksum": compressor.get("checksum", False)}
+        }]
+
+    return None
+
+
+def bytes_codec(dtype: np.dtype) -> dict:
+
+    if dtype.itemsize == 1:
+        return {"name": "bytes"}
+
+    return {"name": "bytes", "configuration": {"endian": "big" if dtype.byteorder == ">" else "little"}}
+
+
+def v3_fill_value(fill_value, dtype: np.dtype):
+
+    if fill_value is None:
+        return False if dtype.kind == "b" else 0
+    if isinstance(fill_value, float) and math.isnan(fill_value):
+        return "NaN"
+    if isinstance(fill_value, float) and math.isinf(fill_value):
+        return "Infinity" if fill_value > 0 else "-Infinity"
+
+    return fill_value
+
+
+def choose_shard_shape(
+        shape: List[int],
+        chunks: List[int],
+        itemsize: int,
+        shard_shape: Optional[List[int]] = None,
+        target_bytes: Optional[int] = None
+    ) -> List[int]:
+    """Shard shape for an array, a whole number of chunks along every axis and no
+    larger than needed to cover the array.
+
+    An explicit shard_shape is aligned to the last axes and rounded down to whole
+    chunks. Otherwise the number of chunks per shard is doubled along each axis in
+    turn, last (x) first, for as long as the shard stays within target_bytes of
+    uncompressed data."""
+
+    n_chunks = [max(1, math.ceil(size / chunk)) for size, chunk in zip(shape, chunks)]
+
+    if shard_shape is not None:
+        shard_shape = [None] * (len(chunks) - len(shard_shape)) + list(shard_shape)[-len(chunks):]
+        per_shard = [
+            1 if requested is None else max(1, min(requested // chunk, n))
+            for requested, chunk, n in zip(shard_shape, chunks, n_chunks)
+        ]
+        return [chunk * n for chunk, n in zip(chunks, per_shard)]
+
+    target_bytes = target_bytes or sharding_settings.zarr_shard_target_bytes
+    chunk_bytes = math.prod(chunks) * itemsize
+    per_shard = [1] * len(chunks)
+    grew = True
+    while grew:
+        grew = False
+        for axis in reversed(range(len(chunks))):
+            if per_shard[axis] >= n_chunks[axis]:
+                continue
+            grown = min(2 * per_shard[axis], n_chunks[axis])
+            if chunk_bytes * math.prod(per_shard) // per_shard[axis] * grown > target_bytes:
+                continue
+            per_shard[axis] = grown
+            grew = True
+
+    return [chunk * n for chunk, n in zip(chunks, per_shard)]
+
+
+def ngff_v3_attributes(attributes: dict) -> dict:
+    """Group attributes in the OME-NGFF 0.5 form for Zarr v3: NGFF metadata moves
+    under "ome" with a single version, other attributes are kept as they are."""
+
+    ome = {key: value for key, value in attributes.items() if key in NGFF_ATTRIBUTES}
+    if not ome:
+        return attributes
+
+    ome = json.loads(json.dumps(ome))
+    for key in ("multiscales", "plate", "well"):
+        values = ome.get(key)
+        for value in (values if isinstance(values, list) else [values]):
+            if isinstance(value, dict):
+                value.pop("version", None)
+
+    v3_attributes = {key: value for key, value in attributes.items() if key not in NGFF_ATTRIBUTES}
+    v3_attributes["ome"] = {"version": "0.5", **ome}
+
+    return v3_attributes
+
+
+def dimension_names_by_array(src_dirpath: Path) -> Dict[Path, List[str]]:
+    """Axis names of the arrays of every multiscale image under src_dirpath, from
+    the multiscales metadata, by array directory."""
+
+    dimension_names = {}
+    for zattrs_fpath in src_dirpath.rglob(".zattrs"):
+        attributes = json.loads(zattrs_fpath.read_text())
+        for multiscale in attributes.get("multiscales", []):
+            axes = multiscale.get("axes")
+            if not axes:
+                continue
+            names = [axis["name"] if isinstance(axis, dict) else axis for axis in axes]
+            for dataset in multiscale["datasets"]:
+                dimension_names[zattrs_fpath.parent/dataset["path"]] = names
+
+    return dimension_names
+
+
+class _ChunkReencoder:
+    """Decode v2 chunks whose compressor, filters or order have no direct Zarr v3
+    equivalent, and re-encode them as C order, Blosc-compressed chunks."""
+
+    def __init__(self, zarray: dict, dtype: np.dtype):
+        import numcodecs
+
+        self.source_codecs = [numcodecs.get_codec(f) for f in (zarray.get("filters") or [])]
+        self.source_compressor = numcodecs.get_codec(zarray["compressor"]) if zarray["compressor"] else None
+        self.compressor = numcodecs.Blosc(
+            cname="zstd", clevel=5, shuffle=numcodecs.Blosc.BITSHUFFLE if dtype.itemsize == 1 else numcodecs.Blosc.SHUFFLE
+        )
+        self.order = zarray.get("order", "C")
+        self.chunks = zarray["chunks"]
+        self.dtype = dtype
+
+    @property
+    def v3_codecs(self) -> List[dict]:
+        config = self.compressor.get_config()
+        return v3_compressor_codec(config, self.dtype)
+
+    def decode_source(self, data: bytes) -> np.ndarray:
+
+        if self.source_compressor is not None:
+            data = self.source_compressor.decode(data)
+        for codec in reversed(self.source_codecs):
+            data = codec.decode(data)
+
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.chunks, order=self.order)
+
+    def decode(self, data: bytes) -> np.ndarray:
+
+        return np.frombuffer(self.compressor.decode(data), dtype=self.dtype).reshape(self.chunks)
+
+    def encode(self, data: bytes) -> bytes:
+
+        # Blosc takes its shuffle typesize from the array's itemsize
+        return self.compressor.encode(np.ascontiguousarray(self.decode_source(data)))
+
+
+def _v2_chunk_key(indices: Tuple[int, ...], separator: str) -> str:
+
+    return separator.join(str(index) for index in indices) or "0"
+
+
+def _v3_chunk_key(indices: Tuple[int, ...]) -> str:
+
+    return "/".join(["c"] + [str(index) for index in indices])
+
+
+def _write_shard(
+        src_array_dirpath: Path,
+        dst_array_dirpath: Path,
+        shard_indices: Tuple[int, ...],
+        chunks_per_shard: List[int],
+        n_chunks: List[int],
+        separator: str,
+        reencoder: Optional[_ChunkReencoder]
+    ) -> Tuple[int, int, int]:
+    """Write one shard from the source chunks it covers, then read it back and check
+    every chunk against its source. Returns the number of chunks and bytes read and
+    the size of the shard (nothing is written if all its chunks are empty)."""
+
+    index = np.full(list(chunks_per_shard) + [2], EMPTY_CHUNK, dtype="<u8")
+    sources = {}
+    for inner in itertools.product(*(range(n) for n in chunks_per_shard)):
+        chunk = tuple(s * n + i for s, n, i in zip(shard_indices, chunks_per_shard, inner))
+        if any(c >= n for c, n in zip(chunk, n_chunks)):
+            continue
+        src_fpath = src_array_dirpath/_v2_chunk_key(chunk, separator)
+        if src_fpath.exists():
+            sources[inner] = src_fpath
+
+    if not sources:
+        return 0, 0, 0
+
+    shard_fpath = dst_array_dirpath/_v3_chunk_key(shard_indices)
+    shard_fpath.parent.mkdir(exist_ok=True, parents=True)
+    source_bytes = 0
+    offset = 0
+    with open(shard_fpath, "wb") as fh:
+        for inner, src_fpath in sources.items():
+            data = src_fpath.read_bytes()
+            source_bytes += len(data)
+            if reencoder:
+                data = reencoder.encode(data)
+            fh.write(data)
+            index[inner] = (offset, len(data))
+            offset += len(data)
+        index_bytes = index.tobytes()
+        fh.write(index_bytes)
+        fh.write(crc32c(index_bytes).to_bytes(4, "little"))
+
+    shard = shard_fpath.read_bytes()
+    for inner, src_fpath in sources.items():
+        chunk_offset, chunk_size = (int(n) for n in index[inner])
+        data = shard[chunk_offset:chunk_offset + chunk_size]
+        if reencoder:
+            identical = np.array_equal(reencoder.decode(data), reencoder.decode_source(src_fpath.read_bytes()))
+        else:
+            identical = data == src_fpath.read_bytes()
+        assert identical, f"Sharded chunk {inner} of {shard_fpath} differs from {src_fpath}"
+
+    return len(sources), source_bytes, len(shard)
+
+
+def shard_array(
+        src_array_dirpath: Path,
+        dst_array_dirpath: Path,
+        dimension_names: Optional[List[str]] = None,
+        shard_shape: Optional[List[int]] = None,
+        max_workers: Optional[int] = None
+    ) -> ShardingResult:
+    """Rewrite a Zarr v2 array as a Zarr v3 array whose chunks are stored in shards.
+
+    The source chunks become the inner chunks of each shard. Where the source
+    compressor has a v3 equivalent (Blosc, gzip, zstd or none) the encoded chunks
+    are copied byte for byte; otherwise they are decoded and re-encoded with Blosc.
+    Every chunk is checked against its source after its shard is written."""
+
+    zarray = json.loads((src_array_dirpath/".zarray").read_text())
+    zattrs_fpath = src_array_dirpath/".zattrs"
+    attributes = json.loads(zattrs_fpath.read_text()) if zattrs_fpath.exists() else {}
+
+    dtype = np.dtype(zarray["dtype"])
+    assert dtype.kind in "biufc", f"Unsupported dtype {zarray['dtype']} in {src_array_dirpath}"
+    shape, chunks = zarray["shape"], zarray["chunks"]
+
+    codecs = v3_compressor_codec(zarray["compressor"], dtype)
+    if codecs is None or zarray.get("filters") or zarray.get("order", "C") != "C":
+        reencoder = _ChunkReencoder(zarray, dtype)
+        codecs = reencoder.v3_codecs
+    else:
+        reencoder = None
+
+    shard_shape = choose_shard_shape(
+        shape, chunks, dtype.itemsize, shard_shape or sharding_settings.zarr_shard_shape
+    )
+    chunks_per_shard = [s // c for s, c in zip(shard_shape, chunks)]
+    n_chunks = [math.ceil(size / chunk) for size, chunk in zip(shape, chunks)]
+    n_shards = [math.ceil(n / per_shard) for n, per_shard in zip(n_chunks, chunks_per_shard)]
+
+    metadata = {
+        "zarr_format": 3,
+        "node_type": "array",
+        "shape": shape,
+        "data_type": dtype.name,
+        "chunk_grid": {"name": "regular", "configuration": {"chunk_shape": shard_shape}},
+        "chunk_key_encoding": {"name": "default", "configuration": {"separator": "/"}},
+        "fill_value": v3_fill_value(zarray.get("fill_value"), dtype),
+        "codecs": [{
+            "name": "sharding_indexed",
+            "configuration": {
+                "chunk_shape": chunks,
+                "codecs": [bytes_codec(dtype)] + codecs,
+                "index_codecs": [bytes_codec(np.dtype("<u8")), {"name": "crc32c"}],
+                "index_location": "end"
+            }
+        }],
+        "attributes": attributes
+    }
+    if dimension_names and len(dimension_names) == len(shape):
+        metadata["dimension_names"] = dimension_names
+
+    dst_array_dirpath.mkdir(exist_ok=True, parents=True)
+
+    def write_shard(shard_indices):
+        return _write_shard(
+            src_array_dirpath, dst_array_dirpath, shard_indices, chunks_per_shard, n_chunks,
+            zarray.get("dimension_separator", "."), reencoder
+        )
+
+    max_workers = max_workers or sharding_settings.zarr_shard_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        written = list(executor.map(write_shard, itertools.product(*(range(n) for n in n_shards))))
+
+    (dst_array_dirpath/"zarr.json").write_text(json.dumps(metadata, indent=2))
+
+    result = ShardingResult(n_arrays=1)
+    for n_source_chunks, source_bytes, sharded_bytes in written:
+        result.n_source_chunks += n_source_chunks
+        result.source_bytes += source_bytes
+        result.n_shards += int(sharded_bytes > 0)
+        result.sharded_bytes += sharded_bytes
+    if reencoder:
+        result.n_reencoded_chunks = result.n_source_chunks
+
+    logger.info(
+        f"Sharded {src_array_dirpath} with shard shape {shard_shape}: "
+        f"{result.n_source_chunks} chunks into {result.n_shards} shards"
+    )
+
+    return result
+
+
+def shard_zarr(
+        src_dirpath: Path,
+        dst_dirpath: Path,
+        shard_shape: Optional[List[int]] = None,
+        max_workers: Optional[int] = None
+    ) -> ShardingResult:
+    """Rewrite the local Zarr v2 hierarchy at src_dirpath (e.g. the output of
+    run_zarr_conversion) as a sharded Zarr v3 hierarchy at dst_dirpath, so that each
+    array is stored in a few large objects rather than one object per chunk.
+
+    Groups get OME-NGFF 0.5 attributes, arrays are rewritten by shard_array, and any
+    other files (e.g. OME/METADATA.ome.xml) are copied. The output is written
+    alongside dst_dirpath and moved into place once complete."""
+
+    tmp_dirpath = dst_dirpath.with_name(f"{dst_dirpath.name}.{os.getpid()}.tmp")
+    if tmp_dirpath.exists():
+        shutil.rmtree(tmp_dirpath)
+
+    dimension_names = dimension_names_by_array(src_dirpath)
+    result = ShardingResult()
+    for dirpath, dirnames, fnames in os.walk(src_dirpath):
+        dirpath = Path(dirpath)
+        dst_node_dirpath = tmp_dirpath/dirpath.relative_to(src_dirpath)
+
+        if ".zarray" in fnames:
+            dirnames.clear()
+            array_result = shard_array(
+                dirpath, dst_node_dirpath, dimension_names.get(dirpath), shard_shape, max_workers
+            )
+            for field in result.__fields__:
+                setattr(result, field, getattr(result, field) + getattr(array_result, field))
+            continue
+
+        dst_node_dirpath.mkdir(exist_ok=True, parents=True)
+        if ".zgroup" in fnames:
+            zattrs_fpath = dirpath/".zattrs"
+            attributes = json.loads(zattrs_fpath.read_text()) if zattrs_fpath.exists() else {}
+            group = {"zarr_format": 3, "node_type": "group", "attributes": ngff_v3_attributes(attributes)}
+            (dst_node_dirpath/"zarr.json").write_text(json.dumps(group, indent=2))
+
+        for fname in fnames:
+            if fname not in V2_METADATA_FNAMES:
+                shutil.copy2(dirpath/fname, dst_node_dirpath/fname)
+
+    if dst_dirpath.exists():
+        shutil.rmtree(dst_dirpath)
+    os.replace(tmp_dirpath, dst_dirpath)
+
+    logger.info(
+        f"Sharded {src_dirpath} to {dst_dirpath}: {result.n_source_chunks} chunk objects "
+        f"in {result.n_arrays} arrays became {result.n_shards} shards"
+    )
+
+    return result
@@ -0,0 +1,168 @@
+import json
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .http_client import get_http_client
+from .biostudies import (
+    FLIST_CHUNK_SIZE,
+    FLIST_URI_TEMPLATE,
+    STUDY_URL_TEMPLATE,
+    Submission,
+    iter_json_array,
+    iter_flist_records,
+    load_submission,
+    submission_from_obj_trusted
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionSource(ABC):
+    """Where BioStudies submissions and their file lists are read from."""
+
+    @abstractmethod
+    def load_submission(self, accession_id: str) -> Submission:
+        ...
+
+    @abstractmethod
+    def iter_flist_records(self, accession_id: str, flist_fname: str) -> Iterator[dict]:
+        ...
+
+    @abstractmethod
+    def submission_version(self, accession_id: str, flist_fnames: List[str]) -> Optional[str]:
+        """Digest identifying the current version of a submission and the given file
+        lists, found without reading them, or None if it cannot be determined."""
+        ...
+
+
+def _version_digest(parts: List[str]) -> str:
+
+    return hashlib.md5("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class HTTPSubmissionSource(SubmissionSource):
+    """Read from the BioStudies API (the default)."""
+
+    def __init__(self, trusted: bool = False):
+        self.trusted = trusted
+
+    def load_submission(self, accession_id: str) -> Submission:
+        return load_submission(accession_id, trusted=self.trusted)
+
+    def iter_flist_records(self, accession_id: str, flist_fname: str) -> Iterator[dict]:
+        return iter_flist_records(accession_id, flist_fname)
+
+    def submission_version(self, accession_id: str, flist_fnames: List[str]) -> Optional[str]:
+        """Validators (ETag, else Last-Modified) of the submission and its file
+        lists, from one HEAD request each."""
+
+        urls = [STUDY_URL_TEMPLATE.format(accession=accession_id)] + [
+            FLIST_URI_TEMPLATE.format(accession_id=accession_id, flist_fname=fname)
+            for fname in flist_fnames
+        ]
+
+        validators = []
+        for url in urls:
+            r = get_http_client().head(url, allow_redirects=True)
+            validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+            if r.status_code != 200 or not validator:
+                return None
+            validators.append(f"{url} {validator}")
+
+        return _version_digest(validators)
+
+
+def _iter_file_chunks(fpath: Path, chunk_size: int = FLIST_CHUNK_SIZE) -> Iterator[bytes]:
+
+    with open(fpath, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            yield chunk
+
+
+class LocalMirrorSubmissionSource(SubmissionSource):
+    """Read from a local mirror of BioStudies PageTab JSON.
+
+    Each submission is expected in a directory named by its accession, holding
+    <accession>.json and its file lists (either alongside, or under Files/). The
+    directory can be directly under the mirror root, or in the FIRE layout used on
+    the BioStudies FTP site, e.g. S-BIAD/610/S-BIAD610/."""
+
+    def __init__(self, root_dirpath: Path, trusted: bool = True):
+        self.root_dirpath = Path(root_dirpath)
+        self.trusted = trusted
+
+    def submission_dirpath(self, accession_id: str) -> Path:
+        flat_dirpath = self.root_dirpath/accession_id
+        if flat_dirpath.is_dir():
+            return flat_dirpath
+
+        prefix = accession_id.rstrip("0123456789")
+        number = accession_id[len(prefix):]
+        fire_dirpath = self.root_dirpath/prefix/number[-3:]/accession_id
+
+        return fire_dirpath
+
+    def list_accessions(self) -> List[str]:
+        """All accessions in the mirror, in either layout."""
+
+        accession_ids = set()
+        for pattern in ["*/*.json", "*/*/*/*.json"]:
+            for fpath in self.root_dirpath.glob(pattern):
+                if fpath.stem == fpath.parent.name:
+                    accession_ids.add(fpath.stem)
+
+        return sorted(accession_ids)
+
+    def flist_fpath(self, accession_id: str, flist_fname: str) -> Path:
+        dirpath = self.submission_dirpath(accession_id)
+        fpath = dirpath/flist_fname
+        if not fpath.exists():
+            fpath = dirpath/"Files"/flist_fname
+
+        return fpath
+
+    def load_submission(self, accession_id: str) -> Submission:
+        fpath = self.submission_dirpath(accession_id)/f"{accession_id}.json"
+        logger.info(f"Reading submission from {fpath}")
+
+        content = fpath.read_bytes()
+        if self.trusted:
+            return submission_from_obj_trusted(json.loads(content))
+
+        return Submission.parse_raw(content)
+
+    def iter_flist_records(self, accession_id: str, flist_fname: str) -> Iterator[dict]:
+        fpath = self.flist_fpath(accession_id, flist_fname)
+        logger.info(f"Reading file list from {fpath}")
+
+        return iter_json_array(_iter_file_chunks(fpath))
+
+    def submission_version(self, accession_id: str, flist_fnames: List[str]) -> Optional[str]:
+        """Size and modification time of the submission and its file lists."""
+
+        fpaths = [self.submission_dirpath(accession_id)/f"{accession_id}.json"] + [
+            self.flist_fpath(accession_id, fname) for fname in flist_fnames
+        ]
+
+        parts = []
+        for fpath in fpaths:
+            try:
+                stat = fpath.stat()
+            except FileNotFoundError:
+                return None
+            parts.append(f"{fpath} {stat.st_size} {stat.st_mtime_ns}")
+
+        return _version_digest(parts)
+
+
+def get_submission_source(mirror_root: Optional[Path] = None) -> SubmissionSource:
+    """Local mirror source if a mirror root is given, otherwise the BioStudies API."""
+
+    if mirror_root:
+        return LocalMirrorSubmissionSource(mirror_root)
+
+    return HTTPSubmissionSource()
@@ -0,0 +1,188 @@
+import os
+import math
+import hashlib
+import logging
+import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from .biostudies import SEARCH_URL_TEMPLATE, StudyResult, search_studies
+
+
+logger = logging.getLogger(__name__)
+
+
+SYNC_STATE_DIRPATH = Path.home()/".cache"/"bia-integrator"/"sync"
+
+
+class SyncState(BaseModel):
+    """Watermark for incremental sync: the release date up to which all studies
+    have been ingested, and a digest of the search result for each study
+    ingested."""
+
+    release_date: Optional[datetime.date]
+    digests: Dict[str, str] = {}
+
+
+class SyncReport(BaseModel):
+    new: List[str] = []
+    changed: List[str] = []
+    unchanged: int = 0
+    failed: List[str] = []
+
+
+def default_state_fpath(collection: str) -> Path:
+
+    return SYNC_STATE_DIRPATH/f"{collection}.json"
+
+
+def load_sync_state(state_fpath: Path) -> SyncState:
+
+    if state_fpath.exists():
+        return SyncState.parse_file(state_fpath)
+
+    return SyncState(release_date=None)
+
+
+def save_sync_state(state: SyncState, state_fpath: Path):
+
+    state_fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = state_fpath.with_suffix(".tmp")
+    tmp_fpath.write_text(state.json())
+    os.replace(tmp_fpath, state_fpath)
+
+
+def study_result_digest(result: StudyResult) -> str:
+    """Digest of the parts of a search result that change when a study is updated
+    (view counts are excluded)."""
+
+    digest_input = result.json(exclude={"views"})
+
+    return hashlib.md5(digest_input.encode("utf-8")).hexdigest()
+
+
+def iter_search_results(
+        collection: str,
+        page_size: int = 100,
+        max_workers: int = 4,
+        released_since: Optional[datetime.date] = None,
+        search_url_template: str = SEARCH_URL_TEMPLATE
+    ) -> Iterator[StudyResult]:
+    """Iterate over the studies in a collection, newest first. Pages are fetched
+    max_workers at a time. If released_since is given, stop after the first
+    batch of pages that reaches studies released before that date."""
+
+    def fetch_page(page: int):
+        return search_studies(collection, page, page_size, search_url_template=search_url_template)
+
+    first_page = fetch_page(1)
+    n_pages = math.ceil(first_page.totalHits / page_size)
+    pages = [first_page]
+    next_page = 2
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            for query_result in pages:
+                yield from query_result.hits
+
+            hits = pages[-1].hits
+            if not hits or next_page > n_pages:
+                return
+            if released_since and hits[-1].release_date < released_since:
+                return
+
+            batch = range(next_page, min(next_page + max_workers, n_pages + 1))
+            pages = list(executor.map(fetch_page, batch))
+            next_page = batch.stop
+
+
+def sync_studies(
+        collection: str,
+        ingest: Callable[[str], None],
+        state_fpath: Optional[Path] = None,
+        full: bool = False,
+        dry_run: bool = False,
+        page_size: int = 100,
+        max_workers: int = 4,
+        search_url_template: str = SEARCH_URL_TEMPLATE
+    ) -> SyncReport:
+    """Ingest the public studies in a collection that are new or have changed since
+    the last sync, by calling ingest with each accession.
+
+    Normally only studies released on or after the stored watermark date are
+    examined; with full set, every study in the collection is checked against its
+    stored digest. State is saved after each successful ingest, so an interrupted
+    sync picks up where it left off."""
+
+    state_fpath = state_fpath or default_state_fpath(collection)
+    state = load_sync_state(state_fpath)
+    released_since = None if full else state.release_date
+
+    report = SyncReport()
+    to_ingest = []
+    seen = set()
+    newest_release_date = state.release_date
+
+    results = iter_search_results(
+        collection,
+        page_size=page_size,
+        max_workers=max_workers,
+        released_since=released_since,
+        search_url_template=search_url_template
+    )
+    for result in results:
+        if result.accession in seen or not result.isPublic:
+            continue
+        if released_since and result.release_date < released_since:
+            continue
+        seen.add(result.accession)
+
+        if newest_release_date is None or result.release_date > newest_release_date:
+            newest_release_date = result.release_date
+
+        digest = study_result_digest(result)
+        previous_digest = state.digests.get(result.accession)
+        if previous_digest == digest:
+            report.unchanged += 1
+            continue
+
+        if previous_digest is None:
+            report.new.append(result.accession)
+        else:
+            report.changed.append(result.accession)
+        to_ingest.append((result, digest))
+
+    logger.info(
+        f"{len(report.new)} new, {len(report.changed)} changed and "
+        f"{report.unchanged} unchanged studies in {collection}"
+    )
+
+    if dry_run:
+        return report
+
+    failed_release_dates = []
+    for result, digest in to_ingest:
+        logger.info(f"Ingesting {result.accession}")
+        try:
+            ingest(result.accession)
+        except Exception:
+            logger.exception(f"Failed to ingest {result.accession}")
+            report.failed.append(result.accession)
+            failed_release_dates.append(result.release_date)
+            continue
+
+        state.digests[result.accession] = digest
+        save_sync_state(state, state_fpath)
+
+    # Only move the watermark past studies that were all ingested successfully,
+    # so that failures are retried by the next incremental sync
+    if failed_release_dates:
+        state.release_date = min(failed_release_dates)
+    else:
+        state.release_date = newest_release_date
+    save_sync_state(state, state_fpath)
+
+    return report
@@ -8,6 +8,8 @@ from bia_integrator_core.models import BIAImageRepresentation
 from bia_integrator_core.models import RenderingInfo, ChannelRendering
 from bia_integrator_core.interface import persist_image_representation
 
+from .zarr_metadata import fetch_consolidated_metadata, multiscale_image_metadata, omero_colormaps
+
 logger = logging.getLogger(__name__)
 
 
@@ -41,18 +43,32 @@ def set_rendering_info_for_ome_ngff_rep(ome_ngff_rep):
     if not ome_ngff_rep.rendering:
         logger.info(f"No rendering info set, using Zarr OMERO metadata")
 
-        reader = Reader(parse_url(ome_ngff_rep.uri))
-        # nodes may include images, labels etc
-        nodes = list(reader())
-        # first node will be the image pixel data
-        image_node = nodes[0]
+        consolidated_metadata = fetch_consolidated_metadata(ome_ngff_rep.uri)
+        image_metadata = None
+        if consolidated_metadata is not None:
+            # The URI may be a bioformats2raw root, with the image at 0/
+            image_metadata = multiscale_image_metadata(consolidated_metadata)
+
+        if image_metadata is not None:
+            colormaps = omero_colormaps(image_metadata.get(".zattrs", {}))
+        else:
+            reader = Reader(parse_url(ome_ngff_rep.uri))
+            # nodes may include images, labels etc
+            nodes = list(reader())
+            # first node will be the image pixel data
+            image_node = nodes[0]
+            colormaps = image_node.metadata['colormap']
+
+        if not colormaps:
+            logger.warning(f"No OMERO channel colours for {ome_ngff_rep.uri}, not setting rendering info")
+            return
 
         chrenders = [
             ChannelRendering(
                 colormap_start=colormap_start,
                 colormap_end=colormap_end
             )
-            for colormap_start, colormap_end in image_node.metadata['colormap']
+            for colormap_start, colormap_end in colormaps
         ]
 
         ome_ngff_rep.rendering = RenderingInfo(
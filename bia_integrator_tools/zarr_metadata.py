@@ -0,0 +1,221 @@
+import os
+import json
+import logging
+import posixpath
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .http_client import get_http_client
+
+
+logger = logging.getLogger(__name__)
+
+
+CONSOLIDATED_METADATA_FNAME = ".zmetadata"
+METADATA_FNAMES = {".zarray", ".zgroup", ".zattrs"}
+
+
+def is_metadata_key(key: str) -> bool:
+
+    return posixpath.basename(key) in METADATA_FNAMES
+
+
+def consolidated_group_paths(documents: Dict[str, dict]) -> List[str]:
+    """Groups which get consolidated metadata: the root and every multiscale image
+    group, given the metadata documents of a Zarr by path ("0/.zattrs" etc.)."""
+
+    group_paths = {""} if ".zgroup" in documents else set()
+    for key, document in documents.items():
+        if posixpath.basename(key) == ".zattrs" and "multiscales" in document:
+            group_path = posixpath.dirname(key)
+            if posixpath.join(group_path, ".zgroup") in documents:
+                group_paths.add(group_path)
+
+    return sorted(group_paths)
+
+
+def consolidate(documents: Dict[str, dict], group_path: str = "") -> dict:
+    """Consolidated metadata, as zarr.consolidate_metadata writes it, for the group
+    at group_path and everything below it."""
+
+    prefix = f"{group_path}/" if group_path else ""
+
+    return {
+        "zarr_consolidated_format": 1,
+        "metadata": {
+            key[len(prefix):]: document
+            for key, document in sorted(documents.items())
+            if key.startswith(prefix)
+        }
+    }
+
+
+def consolidated_documents(documents: Dict[str, dict]) -> Dict[str, dict]:
+    """.zmetadata documents for the root and each multiscale group, by path."""
+
+    return {
+        posixpath.join(group_path, CONSOLIDATED_METADATA_FNAME): consolidate(documents, group_path)
+        for group_path in consolidated_group_paths(documents)
+    }
+
+
+def read_local_metadata(zarr_dirpath: Path) -> Dict[str, dict]:
+    """The .zgroup, .zattrs and .zarray documents of a local Zarr (v2), by path
+    relative to zarr_dirpath. Array directories are not walked into."""
+
+    documents = {}
+    for dirpath, dirnames, fnames in os.walk(zarr_dirpath):
+        if ".zarray" in fnames:
+            dirnames.clear()
+        relpath = Path(dirpath).relative_to(zarr_dirpath).as_posix()
+        for fname in METADATA_FNAMES.intersection(fnames):
+            key = fname if relpath == "." else f"{relpath}/{fname}"
+            documents[key] = json.loads((Path(dirpath)/fname).read_text())
+
+    return documents
+
+
+def write_consolidated_metadata(zarr_dirpath: Path) -> List[Path]:
+    """Write .zmetadata for the root of the local Zarr at zarr_dirpath and for each
+    of its multiscale images, so that a reader can open any of them with a single
+    request. Returns the paths written (none if this is not a Zarr v2 hierarchy)."""
+
+    fpaths = []
+    for key, document in consolidated_documents(read_local_metadata(zarr_dirpath)).items():
+        fpath = zarr_dirpath/key
+        fpath.write_text(json.dumps(document, indent=4, sort_keys=True))
+        fpaths.append(fpath)
+
+    logger.info(f"Wrote consolidated metadata for {len(fpaths)} groups of {zarr_dirpath}")
+
+    return fpaths
+
+
+def fetch_consolidated_metadata(zarr_uri: str) -> Optional[Dict[str, dict]]:
+    """Metadata documents from the .zmetadata of the group at zarr_uri, by path
+    relative to it, or None if the group has no consolidated metadata."""
+
+    r = get_http_client().get(f"{zarr_uri.rstrip('/')}/{CONSOLIDATED_METADATA_FNAME}")
+    if r.status_code in (403, 404):
+        return None
+    assert r.status_code == 200, f"Fetching consolidated metadata for {zarr_uri} failed with status {r.status_code}"
+
+    consolidated = r.json()
+    assert consolidated.get("zarr_consolidated_format") == 1, f"Unknown consolidated metadata format at {zarr_uri}"
+
+    return consolidated["metadata"]
+
+
+def fetch_group_attributes(zarr_uri: str) -> dict:
+    """Attributes of the group at zarr_uri, from its consolidated metadata if it has
+    any, otherwise from its .zattrs."""
+
+    metadata = fetch_consolidated_metadata(zarr_uri)
+    if metadata is not None:
+        return metadata.get(".zattrs", {})
+
+    r = get_http_client().get(f"{zarr_uri.rstrip('/')}/.zattrs")
+    assert r.status_code == 200, f"Fetching attributes for {zarr_uri} failed with status {r.status_code}"
+
+    return r.json()
+
+
+def consolidated_metadata_uris(zarr_uri: str) -> List[Tuple[str, str]]:
+    """.zmetadata URIs which may hold the attributes of the group at zarr_uri, each
+    with the key of its .zattrs there: the group's own, and the Zarr root's if the
+    group is below it."""
+
+    zarr_uri = zarr_uri.rstrip("/")
+    uris = [(f"{zarr_uri}/{CONSOLIDATED_METADATA_FNAME}", ".zattrs")]
+
+    root_uri, sep, group_path = zarr_uri.partition(".zarr/")
+    if sep:
+        uris.append((f"{root_uri}.zarr/{CONSOLIDATED_METADATA_FNAME}", f"{group_path}/.zattrs"))
+
+    return uris
+
+
+def updated_consolidated_metadata(zarr_uri: str, attributes: dict) -> Dict[str, str]:
+    """Consolidated metadata documents that need to be rewritten, by URI, when the
+    attributes of the group at zarr_uri are set to attributes, so that they do
+    not go stale."""
+
+    updated = {}
+    for zmetadata_uri, zattrs_key in consolidated_metadata_uris(zarr_uri):
+        r = get_http_client().get(zmetadata_uri)
+        if r.status_code in (403, 404):
+            continue
+        assert r.status_code == 200, f"Fetching {zmetadata_uri} failed with status {r.status_code}"
+
+        consolidated = r.json()
+        consolidated["metadata"][zattrs_key] = attributes
+        updated[zmetadata_uri] = json.dumps(consolidated, indent=4, sort_keys=True)
+
+    return updated
+
+
+def multiscale_image_path(metadata: Dict[str, dict]) -> Optional[str]:
+    """Path of the multiscale image in a group, given its metadata documents: the
+    group itself, or for a bioformats2raw layout root, its first image at 0/ (as
+    ome_zarr's reader takes it). None if there is neither."""
+
+    attributes = metadata.get(".zattrs", {})
+    if "multiscales" in attributes:
+        return ""
+    if "bioformats2raw.layout" in attributes and "multiscales" in metadata.get("0/.zattrs", {}):
+        return "0"
+
+    return None
+
+
+def multiscale_image_metadata(metadata: Dict[str, dict]) -> Optional[Dict[str, dict]]:
+    """Metadata documents of the multiscale image in a group (see
+    multiscale_image_path), by path relative to the image, from the group's
+    consolidated metadata, or None if it has no image."""
+
+    image_path = multiscale_image_path(metadata)
+    if image_path is None:
+        return None
+
+    prefix = f"{image_path}/" if image_path else ""
+
+    return {key[len(prefix):]: document for key, document in metadata.items() if key.startswith(prefix)}
+
+
+def resolve_multiscale_image_uri(zarr_uri: str) -> str:
+    """URI of the multiscale image group at zarr_uri, which may be a bioformats2raw
+    layout root above it (see multiscale_image_path)."""
+
+    attributes = fetch_group_attributes(zarr_uri)
+    if "multiscales" not in attributes and "bioformats2raw.layout" in attributes:
+        return f"{zarr_uri.rstrip('/')}/0"
+
+    return zarr_uri
+
+
+def multiscale_shapes(metadata: Dict[str, dict]) -> List[List[int]]:
+    """Array shapes of each resolution level, highest first, of the multiscale image
+    described by consolidated metadata (see multiscale_image_metadata), without
+    reading any arrays."""
+
+    datasets = metadata[".zattrs"]["multiscales"][0]["datasets"]
+
+    return [metadata[f"{dataset['path']}/.zarray"]["shape"] for dataset in datasets]
+
+
+def omero_colormaps(attributes: dict) -> List[List[List[float]]]:
+    """Start and end colours of each channel from OMERO rendering metadata, as
+    ome_zarr's reader gives them in node.metadata["colormap"]."""
+
+    omero = attributes.get("omero", {})
+    greyscale = omero.get("rdefs", {}).get("model") == "greyscale"
+
+    colormaps = []
+    for channel in omero.get("channels", []):
+        color = channel.get("color")
+        if color is None:
+            continue
+        rgb = [1.0, 1.0, 1.0] if greyscale else [int(color[i:i + 2], 16) / 255 for i in range(0, 6, 2)]
+        colormaps.append([[0.0, 0.0, 0.0], rgb])
+
+    return colormaps
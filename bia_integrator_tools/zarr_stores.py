@@ -0,0 +1,134 @@
+import json
+import logging
+import threading
+from typing import Dict, Iterator, Optional, Sequence
+
+from zarr.errors import ReadOnlyError
+from zarr.storage import BaseStore
+
+from .http_client import get_http_client
+from .zipindex import ZipIndex, get_zip_index, iter_member_content
+from .zipped_zarr import zarr_root_in_zip
+from .zarr_metadata import fetch_consolidated_metadata, is_metadata_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class ZippedZarrStore(BaseStore):
+    """Read-only Zarr store over a remote zip archive, without downloading it.
+
+    Keys are resolved to members through the archive's cached central directory
+    index, and each member is fetched with a Range request. For stored
+    (uncompressed) archives that is a direct read of the chunk's bytes; compressed
+    members are decompressed after fetching. Metadata documents are kept in memory
+    once read."""
+
+    _readable = True
+    _writeable = False
+    _erasable = False
+    _listable = True
+
+    def __init__(self, zip_uri: str, path_in_zarr: str = "", zip_index: Optional[ZipIndex] = None):
+        self.zip_uri = zip_uri
+        self.zip_index = zip_index or get_zip_index(zip_uri)
+        self.prefix = zarr_root_in_zip(self.zip_index)
+        if path_in_zarr:
+            self.prefix += f"{path_in_zarr.strip('/')}/"
+
+        self._metadata: Dict[str, bytes] = {}
+        self._metadata_lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> bytes:
+        if key in self._metadata:
+            return self._metadata[key]
+
+        try:
+            member = self.zip_index.member(self.prefix + key)
+        except KeyError:
+            raise KeyError(key)
+
+        content = b"".join(iter_member_content(self.zip_uri, member))
+
+        if key.rsplit("/", 1)[-1].startswith("."):
+            with self._metadata_lock:
+                self._metadata[key] = content
+
+        return content
+
+    def __setitem__(self, key, value):
+        raise ReadOnlyError()
+
+    def __delitem__(self, key):
+        raise ReadOnlyError()
+
+    def __contains__(self, key) -> bool:
+        return (self.prefix + key) in self.zip_index
+
+    def __iter__(self) -> Iterator[str]:
+        for member in self.zip_index.members:
+            if member.filename.startswith(self.prefix) and not member.is_dir:
+                yield member.filename[len(self.prefix):]
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class ConsolidatedHTTPStore(BaseStore):
+    """Read-only Zarr store over HTTP for a group with consolidated metadata.
+
+    Metadata comes from the group's .zmetadata, fetched once, so opening the group
+    and its arrays makes no further requests; only chunks are fetched, with the
+    pooled HTTP client."""
+
+    _readable = True
+    _writeable = False
+    _erasable = False
+    _listable = True
+
+    def __init__(self, zarr_uri: str, metadata: Optional[Dict[str, dict]] = None):
+        self.zarr_uri = zarr_uri.rstrip("/")
+        if metadata is None:
+            metadata = fetch_consolidated_metadata(self.zarr_uri)
+            assert metadata is not None, f"No consolidated metadata for {zarr_uri}"
+        self.metadata = metadata
+
+    def __getitem__(self, key: str) -> bytes:
+        if key in self.metadata:
+            return json.dumps(self.metadata[key]).encode("utf-8")
+        if is_metadata_key(key):
+            raise KeyError(key)
+
+        r = get_http_client().get(f"{self.zarr_uri}/{key}")
+        if r.status_code in (403, 404):
+            raise KeyError(key)
+        assert r.status_code == 200, f"Fetching {self.zarr_uri}/{key} failed with status {r.status_code}"
+
+        return r.content
+
+    def getitems(self, keys: Sequence[str], *, contexts=None) -> Dict[str, bytes]:
+        # The default checks each key with __contains__, which only knows about
+        # metadata, so would never fetch a chunk
+        items = {}
+        for key in keys:
+            try:
+                items[key] = self[key]
+            except KeyError:
+                pass
+
+        return items
+
+    def __setitem__(self, key, value):
+        raise ReadOnlyError()
+
+    def __delitem__(self, key):
+        raise ReadOnlyError()
+
+    def __contains__(self, key) -> bool:
+        return key in self.metadata
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.metadata)
+
+    def __len__(self) -> int:
+        return len(self.metadata)
@@ -0,0 +1,320 @@
+import os
+import bz2
+import zlib
+import struct
+import hashlib
+import logging
+import itertools
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, PrivateAttr
+
+from .http_client import get_http_client
+
+
+logger = logging.getLogger(__name__)
+
+
+ZIP_INDEX_DIRPATH = Path.home()/".cache"/"bia-integrator"/"zip-index"
+
+# Signature, version, flags, method, time, date, CRC, sizes, name and extra lengths
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+# Room allowed for the local header's extra field when requesting a member in one
+# go; a larger extra field costs a second request
+LOCAL_EXTRA_ALLOWANCE = 1024
+
+
+class ZipMember(BaseModel):
+    """Central directory entry for one member of a zip archive."""
+
+    filename: str
+    header_offset: int
+    compress_size: int
+    file_size: int
+    compress_type: int
+    CRC: int
+
+    @property
+    def is_dir(self) -> bool:
+        return self.filename.endswith("/")
+
+
+class ZipIndex(BaseModel):
+    """Index of the members of a remote zip archive, built from its central
+    directory alone."""
+
+    uri: str
+    size: int
+    members: List[ZipMember]
+
+    _by_name: Optional[Dict[str, ZipMember]] = PrivateAttr(None)
+
+    def member(self, filename: str) -> ZipMember:
+        if self._by_name is None:
+            self._by_name = {member.filename: member for member in self.members}
+
+        return self._by_name[filename]
+
+    def __contains__(self, filename: str) -> bool:
+        try:
+            self.member(filename)
+        except KeyError:
+            return False
+
+        return True
+
+
+def zip_index_fpath(uri: str) -> Path:
+
+    return ZIP_INDEX_DIRPATH/f"{hashlib.sha256(uri.encode('utf-8')).hexdigest()}.json"
+
+
+def build_zip_index(uri: str) -> ZipIndex:
+    """Read the central directory of the zip archive at uri with HTTP Range requests
+    (the end of central directory record and the directory itself), without
+    downloading any member data."""
+
+    from remotezip import RemoteZip
+
+    with RemoteZip(uri, session=get_http_client().session) as remote_zip:
+        members = [
+            ZipMember(
+                filename=zipinfo.filename,
+                header_offset=zipinfo.header_offset,
+                compress_size=zipinfo.compress_size,
+                file_size=zipinfo.file_size,
+                compress_type=zipinfo.compress_type,
+                CRC=zipinfo.CRC
+            )
+            for zipinfo in remote_zip.infolist()
+        ]
+        size = remote_zip.size()
+
+    logger.info(f"Indexed {len(members)} members of {uri}")
+
+    return ZipIndex(uri=uri, size=size, members=members)
+
+
+_indexes: Dict[str, ZipIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_zip_index(uri: str, refresh: bool = False) -> ZipIndex:
+    """Return the member index of the zip archive at uri. Indexes are stored as
+    JSON sidecars under ZIP_INDEX_DIRPATH and kept in memory, so the central
+    directory is only fetched once per archive."""
+
+    with _indexes_lock:
+        if not refresh and uri in _indexes:
+            return _indexes[uri]
+
+        index_fpath = zip_index_fpath(uri)
+        if not refresh and index_fpath.exists():
+            zip_index = ZipIndex.parse_file(index_fpath)
+        else:
+            zip_index = build_zip_index(uri)
+            index_fpath.parent.mkdir(exist_ok=True, parents=True)
+            tmp_fpath = index_fpath.with_suffix(f".{os.getpid()}.tmp")
+            tmp_fpath.write_text(zip_index.json())
+            os.replace(tmp_fpath, index_fpath)
+
+        _indexes[uri] = zip_index
+
+    return zip_index
+
+
+def _decompressor(compress_type: int):
+
+    if compress_type == 0:
+        return None
+    if compress_type == 8:
+        return zlib.decompressobj(-15)
+    if compress_type == 12:
+        return bz2.BZ2Decompressor()
+
+    raise NotImplementedError(f"Unsupported zip compression method {compress_type}")
+
+
+def _iter_range(uri: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+
+    with get_http_client().get(uri, headers={"Range": f"bytes={start}-{end - 1}"}, stream=True) as r:
+        assert r.status_code == 206, f"Range request for {uri} failed with status {r.status_code}"
+        yield from r.iter_content(chunk_size=chunk_size)
+
+
+def iter_member_raw(uri: str, member: ZipMember, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Iterate over the (still compressed) bytes of a zip member. Its local header
+    and data are normally fetched with a single Range request."""
+
+    start = member.header_offset
+    end = (
+        start + LOCAL_HEADER.size + len(member.filename.encode("utf-8"))
+        + LOCAL_EXTRA_ALLOWANCE + member.compress_size
+    )
+    chunks = _iter_range(uri, start, end, chunk_size)
+
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= LOCAL_HEADER.size:
+            break
+    if len(buffer) < LOCAL_HEADER.size:
+        raise IOError(f"Response for {member.filename} in {uri} ended within its local header")
+    header = LOCAL_HEADER.unpack_from(buffer)
+    assert header[0] == LOCAL_HEADER_SIGNATURE, f"No local file header for {member.filename} in {uri}"
+    data_start = LOCAL_HEADER.size + header[9] + header[10]
+
+    # Skip the local header and pass member data through, reading any remaining
+    # allowance so that the connection can be reused
+    remaining = member.compress_size
+    position = 0
+    for chunk in itertools.chain([buffer], chunks):
+        chunk_start = max(0, data_start - position)
+        position += len(chunk)
+        if remaining and chunk_start < len(chunk):
+            data = chunk[chunk_start:chunk_start + remaining]
+            remaining -= len(data)
+            yield data
+
+    if not remaining:
+        return
+    if position < end - start:
+        raise IOError(
+            f"Response for {member.filename} in {uri} ended after {position} of {end - start} bytes"
+        )
+
+    # The local extra field was larger than allowed for, so fetch the rest of the
+    # data from where the header says it starts
+    data_offset = start + data_start + member.compress_size - remaining
+    for chunk in _iter_range(uri, data_offset, data_offset + remaining, chunk_size):
+        remaining -= len(chunk)
+        yield chunk
+    if remaining:
+        raise IOError(f"Response for {member.filename} in {uri} ended {remaining} bytes short")
+
+
+def iter_member_content(uri: str, member: ZipMember, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Iterate over the decompressed content of a zip member, checking its CRC."""
+
+    decompressor = _decompressor(member.compress_type)
+    crc = 0
+    for raw in iter_member_raw(uri, member, chunk_size):
+        data = decompressor.decompress(raw) if decompressor else raw
+        crc = zlib.crc32(data, crc)
+        yield data
+
+    if member.compress_type == 8:
+        data = decompressor.flush()
+        crc = zlib.crc32(data, crc)
+        yield data
+
+    assert crc == member.CRC, f"CRC mismatch for {member.filename} in {uri}"
+
+
+def _member_data(buffer: bytes, offset: int, member: ZipMember) -> Optional[bytes]:
+    """Compressed data of member, whose local header is at offset in buffer, or None
+    if the buffer does not extend to the end of its data."""
+
+    if offset + LOCAL_HEADER.size > len(buffer):
+        return None
+    header = LOCAL_HEADER.unpack_from(buffer, offset)
+    assert header[0] == LOCAL_HEADER_SIGNATURE, f"No local file header for {member.filename}"
+    data_start = offset + LOCAL_HEADER.size + header[9] + header[10]
+    data_end = data_start + member.compress_size
+    if data_end > len(buffer):
+        return None
+
+    return buffer[data_start:data_end]
+
+
+def _decompress_member(data: bytes, member: ZipMember) -> bytes:
+
+    decompressor = _decompressor(member.compress_type)
+    content = decompressor.decompress(data) if decompressor else data
+    if member.compress_type == 8:
+        content += decompressor.flush()
+    assert zlib.crc32(content) == member.CRC, f"CRC mismatch for {member.filename}"
+
+    return content
+
+
+def iter_span_members(uri: str, members: List[ZipMember]) -> Iterator[Tuple[ZipMember, bytes]]:
+    """Fetch a run of members, sorted by offset, with one Range request covering
+    all of them, and yield each member with its decompressed content."""
+
+    start = members[0].header_offset
+    last = members[-1]
+    end = (
+        last.header_offset + LOCAL_HEADER.size + len(last.filename.encode("utf-8"))
+        + LOCAL_EXTRA_ALLOWANCE + last.compress_size
+    )
+    buffer = b"".join(_iter_range(uri, start, end, 1024 * 1024))
+
+    for member in members:
+        data = _member_data(buffer, member.header_offset - start, member)
+        if data is None:
+            data = b"".join(iter_member_raw(uri, member))
+        yield member, _decompress_member(data, member)
+
+
+def group_members_into_spans(members: List[ZipMember], span_bytes: int) -> List[List[ZipMember]]:
+    """Split members into runs, in archive order, each spanning at most span_bytes
+    of the archive (or a single member larger than that)."""
+
+    spans = []
+    span: List[ZipMember] = []
+    for member in sorted(members, key=lambda member: member.header_offset):
+        if span and member.header_offset + member.compress_size - span[0].header_offset > span_bytes:
+            spans.append(span)
+            span = []
+        span.append(member)
+    if span:
+        spans.append(span)
+
+    return spans
+
+
+def read_member(uri: str, filename: str, zip_index: Optional[ZipIndex] = None) -> bytes:
+    """Content of a single zip member, fetched by Range request."""
+
+    zip_index = zip_index or get_zip_index(uri)
+
+    return b"".join(iter_member_content(uri, zip_index.member(filename)))
+
+
+def member_local_fpath(dst_dirpath: Path, filename: str) -> Path:
+    """Path under dst_dirpath to extract the member filename to, sanitised as
+    ZipFile.extract does: drive letters and empty, "." and ".." components are
+    dropped, so that it cannot point outside dst_dirpath."""
+
+    arcname = os.path.splitdrive(filename.replace("\\", "/"))[1]
+    parts = [part for part in arcname.split("/") if part not in ("", ".", "..")]
+    assert parts, f"Zip member name {filename!r} has no usable path"
+
+    dst_fpath = dst_dirpath.joinpath(*parts)
+    assert dst_fpath.resolve().is_relative_to(dst_dirpath.resolve()), \
+        f"Zip member {filename!r} would be extracted outside {dst_dirpath}"
+
+    return dst_fpath
+
+
+def fetch_zip_member(uri: str, filename: str, dst_fpath: Path, zip_index: Optional[ZipIndex] = None) -> Path:
+    """Write a single member of the remote zip archive at uri to dst_fpath,
+    decompressing it as it streams in. Only that member's bytes are downloaded,
+    using the (cached) central directory index of the archive to find them."""
+
+    zip_index = zip_index or get_zip_index(uri)
+    member = zip_index.member(filename)
+    logger.info(f"Fetching {filename} ({member.compress_size} bytes) from {uri}")
+
+    dst_fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = dst_fpath.with_name(f"{dst_fpath.name}.{os.getpid()}.tmp")
+    with open(tmp_fpath, "wb") as fh:
+        for data in iter_member_content(uri, member):
+            fh.write(data)
+    os.replace(tmp_fpath, dst_fpath)
+
+    return dst_fpath
@@ -0,0 +1,103 @@
+import re
+import json
+import logging
+import posixpath
+from typing import List, MutableMapping, Optional, Tuple
+
+from .zipindex import ZipIndex
+from .zarr_metadata import fetch_consolidated_metadata, multiscale_image_path
+
+
+logger = logging.getLogger(__name__)
+
+
+ZIPPED_ZARR_URI_RE = re.compile(r"^(?P<zip_uri>.+?\.zip)(?:/(?P<path_in_zarr>.*))?$", re.IGNORECASE)
+
+
+def split_zipped_zarr_uri(uri: str) -> Optional[Tuple[str, str]]:
+    """Split a URI of the form <archive>.zip[/<path in zarr>] into the archive URI
+    and path, or return None if it does not refer to a zip archive."""
+
+    match = ZIPPED_ZARR_URI_RE.match(uri)
+    if not match:
+        return None
+
+    return match.group("zip_uri"), (match.group("path_in_zarr") or "").strip("/")
+
+
+def zarr_root_in_zip(zip_index: ZipIndex) -> str:
+    """Prefix of the Zarr within the archive: empty if the Zarr is at the root of
+    the archive, otherwise its single top level directory."""
+
+    if ".zattrs" in zip_index or ".zgroup" in zip_index:
+        return ""
+
+    top_level_names = {member.filename.split("/", 1)[0] for member in zip_index.members}
+    assert len(top_level_names) == 1, f"Expected a single top level directory in {zip_index.uri}"
+
+    return f"{top_level_names.pop()}/"
+
+
+def multiscale_arrays_from_store(store: MutableMapping) -> List:
+    """Arrays of each resolution level of the OME-NGFF image at the root of store
+    (or of its first image, for a bioformats2raw layout root), highest resolution
+    first, as dask arrays (the same form as ome_zarr's Reader gives)."""
+
+    import zarr
+    import dask.array as da
+
+    metadata = {key: json.loads(store[key]) for key in (".zattrs", "0/.zattrs") if key in store}
+    image_path = multiscale_image_path(metadata)
+    assert image_path is not None, "No multiscale image at the root of the store"
+
+    group = zarr.open_group(store=store, path=image_path, mode="r")
+    datasets = group.attrs["multiscales"][0]["datasets"]
+
+    return [
+        da.from_zarr(zarr.open_array(store=store, path=posixpath.join(image_path, dataset["path"]), mode="r"))
+        for dataset in datasets
+    ]
+
+
+def multiscale_arrays_from_zipped_zarr(zip_uri: str, path_in_zarr: str = "") -> List:
+    """Resolution levels of the OME-NGFF image at path_in_zarr in the zipped Zarr at
+    zip_uri, reading from the remote archive."""
+
+    from .zarr_stores import ZippedZarrStore
+
+    return multiscale_arrays_from_store(ZippedZarrStore(zip_uri, path_in_zarr))
+
+
+def multiscale_arrays_from_zarr_uri(zarr_uri: str) -> List:
+    """Resolution levels of the image at zarr_uri, which can be an OME-NGFF Zarr, or
+    a zipped Zarr given as <archive>.zip[/<path in zarr>]. An OME-NGFF Zarr is read
+    through its consolidated metadata where it has some, so that opening it costs
+    a single request."""
+
+    zipped = split_zipped_zarr_uri(zarr_uri)
+    if zipped:
+        return multiscale_arrays_from_zipped_zarr(*zipped)
+
+    metadata = fetch_consolidated_metadata(zarr_uri)
+    if metadata is not None and multiscale_image_path(metadata) is not None:
+        from .zarr_stores import ConsolidatedHTTPStore
+
+        return multiscale_arrays_from_store(ConsolidatedHTTPStore(zarr_uri, metadata))
+
+    from ome_zarr.io import parse_url
+    from ome_zarr.reader import Reader
+
+    reader = Reader(parse_url(zarr_uri))
+    # first node will be the image pixel data
+    image_node = list(reader())[0]
+
+    return image_node.data
+
+
+def zipped_zarr_rep_uri(zipped_zarr_rep) -> str:
+    """URI of the image in a zipped_zarr representation, in the form understood by
+    multiscale_arrays_from_zarr_uri."""
+
+    path_in_zarr = zipped_zarr_rep.attributes.get("path_in_zarr", "")
+
+    return zipped_zarr_rep.uri + path_in_zarr
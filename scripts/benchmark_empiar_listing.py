@@ -0,0 +1,69 @@
+import time
+import logging
+
+import click
+
+from bia_integrator_tools.empiar import EMPIARListingSettings, empiar_s3_prefix, empiar_files_by_s3
+
+from standin_servers import make_s3_listing_handler, serve_in_thread
+
+
+logger = logging.getLogger(__file__)
+
+
+def synthetic_objects(accession_no: str, n_dirs: int, n_subdirs: int, files_per_subdir: int):
+
+    root_prefix = empiar_s3_prefix(accession_no)
+
+    return {
+        f"{root_prefix}dir{d}/sub{s}/file{n}.mrc": n
+        for d in range(n_dirs)
+        for s in range(n_subdirs)
+        for n in range(files_per_subdir)
+    }
+
+
+@click.command()
+@click.option("--n-dirs", default=8)
+@click.option("--n-subdirs", default=50)
+@click.option("--files-per-subdir", default=100)
+@click.option("--latency", default=0.05, help="Seconds of simulated latency per request")
+@click.option("--max-workers", default=16)
+def main(n_dirs, n_subdirs, files_per_subdir, latency, max_workers):
+
+    logging.basicConfig(level=logging.WARNING)
+
+    accession_no = "10000"
+    objects = synthetic_objects(accession_no, n_dirs, n_subdirs, files_per_subdir)
+    server, base_url = serve_in_thread(make_s3_listing_handler(objects, latency))
+
+    # Walking one directory at a time is the request pattern of the FTP backends
+    strategies = [
+        ("directory walk", 1, 100),
+        ("flat listing", 1, 0),
+        ("fan-out", max_workers, 2)
+    ]
+
+    results = {}
+    for label, workers, fanout_depth in strategies:
+        settings = EMPIARListingSettings(
+            empiar_s3_endpoint_url=base_url,
+            empiar_s3_max_workers=workers,
+            empiar_s3_fanout_depth=fanout_depth
+        )
+        start = time.perf_counter()
+        files = empiar_files_by_s3(accession_no, settings)
+        elapsed = time.perf_counter() - start
+        results[label] = (elapsed, [(str(f.path), f.size) for f in files])
+        print(f"{label:>15}: {len(files)} files in {elapsed:.2f}s")
+
+    expected = sorted((key[len(empiar_s3_prefix(accession_no)):], size) for key, size in objects.items())
+    for label, (_, listing) in results.items():
+        assert listing == expected, f"{label} listing differs"
+    print(f"Speedup over directory walk: {results['directory walk'][0] / results['fan-out'][0]:.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import json
+import time
+import logging
+
+import click
+
+from bia_integrator_tools import biostudies, http_cache
+from bia_integrator_tools.biostudies import (
+    Submission,
+    find_files_in_submission_file_lists
+)
+
+from standin_servers import QuietHandler, serve_in_thread
+
+
+logger = logging.getLogger(__file__)
+
+
+def synthetic_submission(n_file_lists: int) -> Submission:
+
+    subsections = [
+        {
+            "type": "Study Component",
+            "attributes": [{"name": "File List", "value": f"flist{n}.json"}]
+        }
+        for n in range(n_file_lists)
+    ]
+
+    return Submission.parse_obj({
+        "accno": "S-BENCH1",
+        "attributes": [],
+        "section": {"type": "Study", "subsections": subsections}
+    })
+
+
+def make_handler(files_per_list: int, latency: float):
+
+    class FileListHandler(QuietHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            fname = self.path.rsplit("/", 1)[-1]
+            body = json.dumps([
+                {"path": f"{fname}/file{n}.tif", "size": n, "attributes": []}
+                for n in range(files_per_list)
+            ]).encode()
+            self.send_body(body)
+
+    return FileListHandler
+
+
+@click.command()
+@click.option("--n-file-lists", default=48)
+@click.option("--files-per-list", default=1000)
+@click.option("--latency", default=0.2, help="Seconds of simulated latency per request")
+@click.option("--max-workers", default=8)
+def main(n_file_lists, files_per_list, latency, max_workers):
+
+    logging.basicConfig(level=logging.WARNING)
+    # Otherwise the concurrent pass reads what the sequential one cached, and the
+    # stand-in's responses end up in the user's cache
+    http_cache.cache_settings.http_cache_enabled = False
+
+    server, base_url = serve_in_thread(make_handler(files_per_list, latency))
+    biostudies.FLIST_URI_TEMPLATE = base_url + "/{accession_id}/{flist_fname}"
+
+    submission = synthetic_submission(n_file_lists)
+
+    results = {}
+    for label, workers in [("sequential", 1), ("concurrent", max_workers)]:
+        start = time.perf_counter()
+        files = find_files_in_submission_file_lists(submission, max_workers=workers)
+        elapsed = time.perf_counter() - start
+        results[label] = (elapsed, [str(f.path) for f in files])
+        print(f"{label:>12}: {len(files)} files in {elapsed:.2f}s")
+
+    assert results["sequential"][1] == results["concurrent"][1], "File order differs"
+    print(f"Speedup: {results['sequential'][0] / results['concurrent'][0]:.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
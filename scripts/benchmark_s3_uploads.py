@@ -0,0 +1,80 @@
+import os
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+import boto3
+import click
+
+from bia_integrator_tools import io
+from bia_integrator_tools.io import put_string_to_s3, upload_multiple_files_to_s3
+
+from standin_servers import make_s3_put_handler, serve_in_thread
+
+
+logger = logging.getLogger(__file__)
+
+
+def put_string_to_s3_with_new_resource(string: str, dst_key: str):
+    """put_string_to_s3 as it was, creating a boto3 resource for every object."""
+
+    s3 = boto3.resource('s3', endpoint_url=io.c2zsettings.endpoint_url)
+    s3.Object(io.c2zsettings.bucket_name, dst_key).put(Body=string, ACL="public-read")
+
+
+@click.command()
+@click.option("--n-objects", default=500)
+@click.option("--object-size", default=1024)
+@click.option("--latency", default=0.0, help="Seconds of simulated latency per request")
+@click.option("--max-workers", default=16)
+def main(n_objects, object_size, latency, max_workers):
+
+    logging.basicConfig(level=logging.WARNING)
+    # The stand-in accepts any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "standin")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "standin")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    handler = make_s3_put_handler(latency)
+    server, base_url = serve_in_thread(handler)
+    io.c2zsettings.endpoint_url = base_url
+    io.c2zsettings.bucket_name = "bench"
+
+    body = "x" * object_size
+    results = {}
+    for label, put in [("new resource", put_string_to_s3_with_new_resource), ("shared client", put_string_to_s3)]:
+        handler.objects.clear()
+        start = time.perf_counter()
+        for n in range(n_objects):
+            put(body, f"{label.replace(' ', '-')}/{n}")
+        elapsed = time.perf_counter() - start
+        assert len(handler.objects) == n_objects
+        results[label] = n_objects / elapsed
+        print(f"{label:>14}: {n_objects} objects in {elapsed:.2f}s, {results[label]:.0f} objects/sec")
+
+    print(f"Speedup: {results['shared client'] / results['new resource']:.1f}x")
+
+    with tempfile.TemporaryDirectory() as td:
+        src_dst_list = []
+        for n in range(n_objects):
+            src_fpath = Path(td)/f"{n}"
+            src_fpath.write_text(body)
+            src_dst_list.append((src_fpath, f"files/{n}"))
+
+        for label, workers in [("sequential", 1), ("concurrent", max_workers)]:
+            handler.objects.clear()
+            start = time.perf_counter()
+            failures = upload_multiple_files_to_s3(src_dst_list, max_workers=workers)
+            elapsed = time.perf_counter() - start
+            assert not failures and len(handler.objects) == n_objects
+            results[label] = n_objects / elapsed
+            print(f"{label:>14}: {n_objects} files in {elapsed:.2f}s, {results[label]:.0f} files/sec")
+
+    print(f"Speedup: {results['concurrent'] / results['sequential']:.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import click
+import numpy as np
+
+from bia_integrator_tools import io
+from bia_integrator_tools.io import sync_dirpath_to_s3, sync_sharded_zarr_to_s3
+from bia_integrator_tools.sharding import shard_zarr, crc32c
+
+from standin_servers import make_s3_put_handler, serve_in_thread
+
+
+logger = logging.getLogger(__file__)
+
+
+def write_v2_zarr(dirpath: Path, volume: np.ndarray, chunks):
+    """Write volume as a bioformats2raw style, uncompressed OME-Zarr (v2) with one
+    resolution level at 0/0."""
+
+    (dirpath/"0"/"0").mkdir(parents=True)
+    (dirpath/".zgroup").write_text(json.dumps({"zarr_format": 2}))
+    (dirpath/".zattrs").write_text(json.dumps({"bioformats2raw.layout": 3}))
+    (dirpath/"0"/".zgroup").write_text(json.dumps({"zarr_format": 2}))
+    (dirpath/"0"/".zattrs").write_text(json.dumps({"multiscales": [{
+        "version": "0.4",
+        "axes": [{"name": name} for name in "tczyx"],
+        "datasets": [{"path": "0"}]
+    }]}))
+    (dirpath/"0"/"0"/".zarray").write_text(json.dumps({
+        "zarr_format": 2, "shape": list(volume.shape), "chunks": list(chunks), "dtype": volume.dtype.str,
+        "compressor": None, "filters": None, "fill_value": 0, "order": "C", "dimension_separator": "/"
+    }))
+
+    for indices in np.ndindex(*[-(-s // c) for s, c in zip(volume.shape, chunks)]):
+        chunk = np.zeros(chunks, dtype=volume.dtype)
+        region = volume[tuple(slice(i * c, (i + 1) * c) for i, c in zip(indices, chunks))]
+        chunk[tuple(slice(0, s) for s in region.shape)] = region
+        chunk_fpath = dirpath/"0"/"0"/"/".join(str(i) for i in indices)
+        chunk_fpath.parent.mkdir(parents=True, exist_ok=True)
+        chunk_fpath.write_bytes(chunk.tobytes())
+
+
+def read_sharded_array(array_dirpath: Path) -> np.ndarray:
+    """Read an uncompressed, sharded Zarr v3 array directly from its shard files."""
+
+    metadata = json.loads((array_dirpath/"zarr.json").read_text())
+    shape = metadata["shape"]
+    shard_shape = metadata["chunk_grid"]["configuration"]["chunk_shape"]
+    inner = metadata["codecs"][0]["configuration"]["chunk_shape"]
+    dtype = np.dtype(metadata["data_type"])
+    per_shard = [s // c for s, c in zip(shard_shape, inner)]
+
+    padded = [-(-s // c) * c for s, c in zip(shape, shard_shape)]
+    volume = np.zeros(padded, dtype=dtype)
+    for shard_indices in np.ndindex(*[-(-s // c) for s, c in zip(shape, shard_shape)]):
+        shard_fpath = array_dirpath/"/".join(["c"] + [str(i) for i in shard_indices])
+        if not shard_fpath.exists():
+            continue
+        shard = shard_fpath.read_bytes()
+        index_nbytes = 16 * int(np.prod(per_shard))
+        index_bytes = shard[-index_nbytes - 4:-4]
+        assert crc32c(index_bytes) == int.from_bytes(shard[-4:], "little")
+        index = np.frombuffer(index_bytes, dtype="<u8").reshape(per_shard + [2])
+        for inner_indices in np.ndindex(*per_shard):
+            offset, nbytes = (int(n) for n in index[inner_indices])
+            if offset == 2 ** 64 - 1:
+                continue
+            chunk = np.frombuffer(shard[offset:offset + nbytes], dtype=dtype).reshape(inner)
+            start = [(s * p + i) * c for s, p, i, c in zip(shard_indices, per_shard, inner_indices, inner)]
+            volume[tuple(slice(a, a + c) for a, c in zip(start, inner))] = chunk
+
+    return volume[tuple(slice(0, s) for s in shape)]
+
+
+def read_with_zarr_v3(array_dirpath: Path) -> Optional[np.ndarray]:
+    """Read a sharded array with zarr-python 3, or return None if it is not installed."""
+
+    try:
+        import zarr
+    except ImportError:
+        return None
+    if int(zarr.__version__.split(".")[0]) < 3:
+        return None
+
+    return zarr.open_array(str(array_dirpath), mode="r")[...]
+
+
+@click.command()
+@click.option("--shape", default="1,1,64,512,512", help="Volume shape (tczyx)")
+@click.option("--chunks", default="1,1,1,64,64", help="Chunk shape of the unsharded Zarr")
+@click.option("--latency", default=0.005, help="Seconds of simulated latency per request")
+def main(shape, chunks, latency):
+
+    logging.basicConfig(level=logging.WARNING)
+    # The stand-in accepts any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "standin")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "standin")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    shape = [int(n) for n in shape.split(",")]
+    chunks = [int(n) for n in chunks.split(",")]
+    volume = np.random.default_rng(0).integers(0, 2 ** 16, size=shape, dtype=np.uint16)
+
+    handler = make_s3_put_handler(latency)
+    server, base_url = serve_in_thread(handler)
+    io.c2zsettings.endpoint_url = base_url
+    io.c2zsettings.bucket_name = "bench"
+    # The stand-in only takes single part uploads
+    io.c2zsettings.s3_multipart_threshold = 2 ** 40
+
+    with tempfile.TemporaryDirectory() as td:
+        zarr_dirpath = Path(td)/"image.zarr"
+        sharded_dirpath = Path(td)/"image.sharded.zarr"
+        write_v2_zarr(zarr_dirpath, volume, chunks)
+
+        start = time.perf_counter()
+        result = shard_zarr(zarr_dirpath, sharded_dirpath)
+        print(f"Sharded {result.n_source_chunks} chunks into {result.n_shards} shards in {time.perf_counter() - start:.2f}s")
+
+        assert np.array_equal(read_sharded_array(sharded_dirpath/"0"/"0"), volume)
+        print("Sharded pixels identical to source")
+
+        v3_volume = read_with_zarr_v3(sharded_dirpath/"0"/"0")
+        if v3_volume is None:
+            print("zarr-python 3 not installed, skipping read back with it")
+        else:
+            assert np.array_equal(v3_volume, volume)
+            print("Sharded pixels read back identically with zarr-python 3")
+
+        for label, dirpath, sync in [
+            ("unsharded", zarr_dirpath, sync_dirpath_to_s3),
+            ("sharded", sharded_dirpath, sync_sharded_zarr_to_s3)
+        ]:
+            n_objects = sum(1 for fpath in dirpath.rglob("*") if fpath.is_file())
+            start = time.perf_counter()
+            sync_result = sync(dirpath, label)
+            elapsed = time.perf_counter() - start
+            assert sync_result.uploaded == n_objects
+            print(f"{label:>9}: {n_objects} objects uploaded in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import json
+import time
+import logging
+
+import click
+
+from bia_integrator_tools.biostudies import Submission, submission_from_obj_trusted
+
+
+logger = logging.getLogger(__file__)
+
+
+def synthetic_attributes(n: int):
+
+    return [
+        {"name": f"Attribute {k}", "value": f"Value {k}", "valqual": [{"name": "q", "value": "v"}]}
+        for k in range(n)
+    ]
+
+
+def synthetic_section(depth: int, breadth: int, n_files: int) -> dict:
+
+    section = {
+        "type": "Study Component",
+        "accno": f"Section-{depth}",
+        "attributes": synthetic_attributes(5),
+        "links": [{"url": f"https://example.org/{k}", "attributes": synthetic_attributes(2)} for k in range(3)],
+        "files": [
+            {"path": f"dir{depth}/file{k}.tif", "size": k, "attributes": synthetic_attributes(2)}
+            for k in range(n_files)
+        ] + [[{"path": f"dir{depth}/grouped.tif", "size": 1}]]
+    }
+
+    if depth > 0:
+        children = [synthetic_section(depth - 1, breadth, n_files) for _ in range(breadth)]
+        section["subsections"] = children[:-1] + [children[-1:]]
+
+    return section
+
+
+@click.command()
+@click.option("--depth", default=6)
+@click.option("--breadth", default=4)
+@click.option("--files-per-section", default=5)
+@click.option("--repeats", default=3)
+def main(depth, breadth, files_per_section, repeats):
+
+    logging.basicConfig(level=logging.WARNING)
+
+    raw = json.dumps({
+        "accno": "S-BENCH1",
+        "attributes": synthetic_attributes(10),
+        "section": synthetic_section(depth, breadth, files_per_section)
+    }).encode()
+
+    print(f"Submission JSON is {len(raw) / 1e6:.1f}MB")
+
+    timings = {}
+    for label, parse in [
+        ("validated", Submission.parse_raw),
+        ("trusted", lambda content: submission_from_obj_trusted(json.loads(content)))
+    ]:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            submission = parse(raw)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = (best, submission)
+        print(f"{label:>10}: {best:.3f}s")
+
+    assert timings["validated"][1] == timings["trusted"][1], "Parsed submissions differ"
+    print(f"Speedup: {timings['validated'][0] / timings['trusted'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
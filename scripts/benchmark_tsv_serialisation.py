@@ -0,0 +1,72 @@
+import gc
+import time
+import logging
+import tempfile
+
+import click
+
+from bia_integrator_tools.biostudies import submission_from_obj_trusted
+
+
+logger = logging.getLogger(__file__)
+
+
+def synthetic_submission(n_sections: int, links_per_section: int):
+
+    def attributes(n):
+        return [{"name": f"Attribute {k}", "value": f"Value {k}"} for k in range(n)]
+
+    subsections = [
+        {
+            "type": "Study Component",
+            "accno": f"Component-{n}",
+            "attributes": attributes(3),
+            "links": [
+                {"url": f"https://example.org/{n}/{k}", "attributes": attributes(2)}
+                for k in range(links_per_section)
+            ],
+            "subsections": [{"type": "Biosample", "attributes": attributes(3)}]
+        }
+        for n in range(n_sections)
+    ]
+
+    return submission_from_obj_trusted({
+        "accno": "S-BENCH1",
+        "attributes": attributes(5),
+        "section": {"type": "Study", "accno": "Study-1", "subsections": subsections}
+    })
+
+
+@click.command()
+@click.option("--n-sections", default=10000)
+@click.option("--links-per-section", default=4)
+def main(n_sections, links_per_section):
+    """Time TSV serialisation at increasing submission sizes. Time per section
+    should stay roughly constant if serialisation is linear."""
+
+    logging.basicConfig(level=logging.WARNING)
+
+    for scale in [1, 2, 4]:
+        submission = synthetic_submission(n_sections * scale, links_per_section)
+        gc.collect()
+
+        start = time.perf_counter()
+        tsv_rep = submission.as_tsv()
+        as_tsv_seconds = time.perf_counter() - start
+
+        gc.collect()
+        with tempfile.TemporaryFile("w") as fh:
+            start = time.perf_counter()
+            submission.write_tsv(fh)
+            write_tsv_seconds = time.perf_counter() - start
+
+        n = n_sections * scale
+        print(
+            f"{n} sections, {n * links_per_section} links, {len(tsv_rep) / 1e6:.1f}MB: "
+            f"as_tsv {as_tsv_seconds:.2f}s, write_tsv {write_tsv_seconds:.2f}s "
+            f"({1e6 * write_tsv_seconds / n:.1f}us/section)"
+        )
+
+
+if __name__ == "__main__":
+    main()
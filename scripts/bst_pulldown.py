@@ -9,6 +9,7 @@ from bia_integrator_tools.biostudies import (
     File,
     Submission,
     Section,
+    SubmissionIndex,
     attributes_to_dict,
     load_submission,
     file_uri,
@@ -26,35 +27,30 @@ def is_image(file: File) -> bool:
     return file.path.suffix.lower() in IMAGE_EXTS
 
 
-def author_section_to_author(author_section: Section) -> Author:
-    attributes_dict = attributes_to_dict(author_section.attributes)
+def author_section_to_author(author_section: Section, index: SubmissionIndex) -> Author:
+    attributes_dict = index.attributes(author_section)
     
     return Author(name=attributes_dict['Name'])
 
 
-def find_authors_in_submission(submission: Submission):
+def find_authors_in_submission(index: SubmissionIndex):
     
-    authors = []
-    for section in submission.section.subsections:
-        if section.type == 'Author' or section.type == 'author':
-            authors.append(author_section_to_author(section))
-            
-    return authors
+    return [
+        author_section_to_author(section, index)
+        for section in index.subsections_of_type('Author', 'author')
+    ]
 
 
 def bst_submission_to_bia_study(submission: Submission) -> BIAStudy:
     
-    submission_attr_dict = attributes_to_dict(submission.attributes)
-    study_section_attr_dict = attributes_to_dict(submission.section.attributes)
+    index = SubmissionIndex(submission)
+    submission_attr_dict = index.submission_attributes
+    study_section_attr_dict = index.study_attributes
     
-    study_components = [
-        section
-        for section in submission.section.subsections
-        if section.type == 'Study Component'
-    ]
+    study_components = index.subsections_of_type('Study Component')
 
     if len(study_components):
-        study_component_attr_dict = attributes_to_dict(study_components[0].attributes)
+        study_component_attr_dict = index.attributes(study_components[0])
         imaging_method = study_component_attr_dict.get('Imaging Method', "Unknown")
     else:
         imaging_method = "Unknown"
@@ -107,7 +103,7 @@ def bst_submission_to_bia_study(submission: Submission) -> BIAStudy:
     bia_study = BIAStudy(
         accession_id=accession_id,
         title=study_title,
-        authors=find_authors_in_submission(submission),
+        authors=find_authors_in_submission(index),
         release_date=submission_attr_dict['ReleaseDate'],
         description=study_section_attr_dict['Description'],
         organism=study_section_attr_dict.get('Organism', "Unknown"),
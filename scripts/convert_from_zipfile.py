@@ -1,8 +1,5 @@
-import hashlib
 import logging
-from zipfile import ZipFile
 from pathlib import Path
-from urllib.parse import urlparse
 
 import click
 from bia_integrator_core.models import BIAImageRepresentation
@@ -10,7 +7,9 @@ from bia_integrator_core.interface import persist_image_representation
 from bia_integrator_core.integrator import load_and_annotate_study
 
 from bia_integrator_tools.conversion import run_zarr_conversion
-from bia_integrator_tools.io import copy_uri_to_local, copy_local_zarr_to_s3
+from bia_integrator_tools.io import copy_local_zarr_to_s3, copy_local_sharded_zarr_to_s3
+from bia_integrator_tools.sharding import shard_zarr
+from bia_integrator_tools.zipindex import fetch_zip_member, member_local_fpath
 
 
 logger = logging.getLogger(__file__)
@@ -25,7 +24,8 @@ def rep_by_type(image, rep_type):
 @click.command()
 @click.argument("accession_id")
 @click.argument("image_id")
-def main(accession_id, image_id):
+@click.option("--shard", is_flag=True, default=False, help="Rewrite as sharded Zarr v3 before uploading")
+def main(accession_id, image_id, shard):
 
     logging.basicConfig(level=logging.INFO)
 
@@ -37,34 +37,33 @@ def main(accession_id, image_id):
 
     zipfile_rep = rep_by_type(image, "zipfile")
 
-    prefix = hashlib.md5(zipfile_rep.uri.encode()).hexdigest()
-    suffix = Path(urlparse(zipfile_rep.uri).path).suffix
-    dst_fname = prefix+suffix
-    dst_fpath = cache_dirpath/dst_fname
+    # Fetch only the member we need, using the archive's cached central directory
+    zip_filename = zipfile_rep.attributes["zip_filename"]
+    image_local_fpath = member_local_fpath(cache_dirpath/accession_id, zip_filename)
 
-    if not dst_fpath.exists():
-        copy_uri_to_local(zipfile_rep.uri, dst_fpath)
-        logger.info(f"Downloading zipfile to {dst_fpath}")
+    if not image_local_fpath.exists():
+        fetch_zip_member(zipfile_rep.uri, zip_filename, image_local_fpath)
     else:
-        logger.info(f"Zipfile exists at {dst_fpath}")
-
-    zipfile_fpath = dst_fpath
-
-    with ZipFile(zipfile_fpath) as zipfile:
-        image_local_fpath = zipfile.extract(zipfile_rep.attributes["zip_filename"], cache_dirpath/accession_id)
+        logger.info(f"Zip member exists at {image_local_fpath}")
 
     output_zarr_dirpath = cache_dirpath/accession_id/f"{image_id}.zarr"
 
     run_zarr_conversion(image_local_fpath, output_zarr_dirpath)
-    zarr_image_uri = copy_local_zarr_to_s3(output_zarr_dirpath, accession_id, image_id)
+    if shard:
+        sharded_zarr_dirpath = cache_dirpath/accession_id/f"{image_id}.sharded.zarr"
+        shard_zarr(output_zarr_dirpath, sharded_zarr_dirpath)
+        zarr_image_uri = copy_local_sharded_zarr_to_s3(sharded_zarr_dirpath, accession_id, image_id)
+    else:
+        zarr_image_uri = copy_local_zarr_to_s3(output_zarr_dirpath, accession_id, image_id)
 
     representation = BIAImageRepresentation(
         accession_id=accession_id,
         image_id=image_id,
         size=0,
-        type="ome_ngff",
+        type="ome_ngff_sharded" if shard else "ome_ngff",
         uri=zarr_image_uri,
-        dimensions=None
+        dimensions=None,
+        attributes={"zarr_format": 3} if shard else {}
     )
 
     persist_image_representation(representation)
@@ -8,7 +8,8 @@ import requests
 from pydantic import BaseSettings
 
 
-from bia_integrator_tools.io import copy_local_zarr_to_s3
+from bia_integrator_tools.io import copy_local_zarr_to_s3, copy_local_sharded_zarr_to_s3
+from bia_integrator_tools.sharding import shard_zarr
 from bia_integrator_tools.conversion import run_zarr_conversion
 from bia_integrator_core.integrator import load_and_annotate_study
 from bia_integrator_core.models import BIAImageRepresentation
@@ -32,7 +33,8 @@ def copy_uri_to_local(src_uri: str, dst_fpath: Path):
 @click.argument("accession_id")
 @click.argument("image_id")
 @click.option("--save-to-file", is_flag=True, default=False, help="Save representation to file")
-def main(accession_id, image_id, save_to_file):
+@click.option("--shard", is_flag=True, default=False, help="Rewrite as sharded Zarr v3 before uploading")
+def main(accession_id, image_id, save_to_file, shard):
 
     logging.basicConfig(level=logging.INFO)
 
@@ -55,17 +57,23 @@ def main(accession_id, image_id, save_to_file):
     if not zarr_fpath.exists():
         run_zarr_conversion(dst_fpath, zarr_fpath)
 
-    zarr_image_uri = copy_local_zarr_to_s3(zarr_fpath, accession_id, image_id)
+    if shard:
+        sharded_zarr_fpath = dst_dir_basepath/f"{image_id}.sharded.zarr"
+        if not sharded_zarr_fpath.exists():
+            shard_zarr(zarr_fpath, sharded_zarr_fpath)
+        zarr_image_uri = copy_local_sharded_zarr_to_s3(sharded_zarr_fpath, accession_id, image_id)
+    else:
+        zarr_image_uri = copy_local_zarr_to_s3(zarr_fpath, accession_id, image_id)
 
     representation = BIAImageRepresentation(
         accession_id=accession_id,
         image_id=image_id,
         size=0,
-        type="ome_ngff",
+        type="ome_ngff_sharded" if shard else "ome_ngff",
         uri=zarr_image_uri,
         dimensions=None,
         rendering=None,
-        attributes={}
+        attributes={"zarr_format": 3} if shard else {}
     )
 
     if not save_to_file:
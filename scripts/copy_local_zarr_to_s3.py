@@ -3,7 +3,8 @@ from pathlib import Path
 
 import click
 
-from bia_integrator_tools.io import upload_dirpath_as_zarr_image_rep
+from bia_integrator_tools.io import upload_dirpath_as_zarr_image_rep, upload_dirpath_as_sharded_zarr_image_rep
+from bia_integrator_tools.sharding import shard_zarr
 
 
 logging.getLogger(__file__)
@@ -13,11 +14,18 @@ logging.getLogger(__file__)
 @click.argument("zarr_fpath")
 @click.argument("accession_id")
 @click.argument("image_id")
-def main(zarr_fpath, accession_id, image_id):
+@click.option("--shard", is_flag=True, default=False, help="Rewrite as sharded Zarr v3 before uploading")
+def main(zarr_fpath, accession_id, image_id, shard):
 
     logging.basicConfig(level=logging.INFO)
 
-    zarr_uri = upload_dirpath_as_zarr_image_rep(zarr_fpath, accession_id, image_id)
+    if shard:
+        zarr_fpath = Path(zarr_fpath)
+        sharded_zarr_fpath = zarr_fpath.with_name(f"{zarr_fpath.stem}.sharded.zarr")
+        shard_zarr(zarr_fpath, sharded_zarr_fpath)
+        zarr_uri = upload_dirpath_as_sharded_zarr_image_rep(sharded_zarr_fpath, accession_id, image_id)
+    else:
+        zarr_uri = upload_dirpath_as_zarr_image_rep(zarr_fpath, accession_id, image_id)
 
     print(f"Uploaded, URI: {zarr_uri}")
 
@@ -7,6 +7,8 @@ from ome_zarr.io import parse_url
 from ome_zarr.reader import Multiscales, Node, Reader
 from bia_integrator_core.interface import get_image, persist_image_annotation
 from bia_integrator_core.models import ImageAnnotation, BIAImageRepresentation
+from bia_integrator_tools.zipped_zarr import multiscale_arrays_from_zarr_uri, zipped_zarr_rep_uri
+from bia_integrator_tools.zarr_metadata import fetch_consolidated_metadata, multiscale_image_metadata, multiscale_shapes
 
 
 logger = logging.getLogger(__file__)
@@ -18,13 +20,29 @@ def zarr_rep_to_dimension_annotation(zarr_rep: BIAImageRepresentation) -> ImageA
 
     logger.info(f"Loading from {zarr_rep.uri}")
 
-    zarr = parse_url(zarr_rep.uri)
-    reader = Reader(zarr)
+    image_metadata = None
+    if zarr_rep.type != "zipped_zarr":
+        consolidated_metadata = fetch_consolidated_metadata(zarr_rep.uri)
+        if consolidated_metadata is not None:
+            # The URI may be a bioformats2raw root, with the image at 0/
+            image_metadata = multiscale_image_metadata(consolidated_metadata)
+
+    if zarr_rep.type == "zipped_zarr":
+        # Read in place from the archive, without downloading it
+        multiscale_arrays = multiscale_arrays_from_zarr_uri(zipped_zarr_rep_uri(zarr_rep))
+        shapes = [array.shape for array in multiscale_arrays]
+    elif image_metadata is not None:
+        # Shapes are all in the consolidated metadata, so nothing else is fetched
+        shapes = [tuple(shape) for shape in multiscale_shapes(image_metadata)]
+    else:
+        zarr = parse_url(zarr_rep.uri)
+        reader = Reader(zarr)
+
+        nodes = [node for node in reader()]
+        assert len(nodes) == 1, "Zarr contains multiple images"
+        multiscale_arrays = nodes[0].data
+        shapes = [array.shape for array in multiscale_arrays]
 
-    nodes = [node for node in reader()]
-    assert len(nodes) == 1, "Zarr contains multiple images"
-
-    shapes = [array.shape for array in nodes[0].data]
     original_image_dim = shapes[0]
 
     annotation = ImageAnnotation(
@@ -50,7 +68,8 @@ def main(accession_id, image_id):
         for rep in image.representations
     }
 
-    annotation = zarr_rep_to_dimension_annotation(reps_by_type["ome_ngff"])
+    zarr_rep = reps_by_type.get("ome_ngff") or reps_by_type["zipped_zarr"]
+    annotation = zarr_rep_to_dimension_annotation(zarr_rep)
     persist_image_annotation(annotation)
 
 
@@ -5,12 +5,16 @@ from typing import List, Optional
 from urllib.parse import urlparse
 
 import click
-import requests
 from pydantic import BaseModel
 from bia_integrator_core.integrator import load_and_annotate_study
 
 from bia_integrator_tools.io import put_string_to_s3, get_s3_key_prefix, c2zsettings
 from bia_integrator_tools.utils import get_ome_ngff_rep
+from bia_integrator_tools.zarr_metadata import (
+    fetch_group_attributes,
+    resolve_multiscale_image_uri,
+    updated_consolidated_metadata
+)
 
 
 class RDefs(BaseModel):
@@ -65,28 +69,33 @@ class ZMeta(BaseModel):
     multiscales: List[MultiScaleImage]
 
 
-def replace_first_channel_color(image):
+def uri_to_s3_key(uri: str) -> str:
 
-    ngff_rep = get_ome_ngff_rep(image)
+    return str(Path(urlparse(uri).path).relative_to(f"/{c2zsettings.bucket_name}"))
 
-    zattrs_uri = f"{ngff_rep.uri}/.zattrs"
 
-    r = requests.get(zattrs_uri)
-    # print(r.content.decode())
+def write_back_zattrs(zarr_uri: str, zattrs: dict):
+    """Write the attributes of the group at zarr_uri back to S3, along with any
+    consolidated metadata holding them, so that it does not go stale."""
 
-    # zmeta = ZMeta.parse_raw(r.content)
+    put_string_to_s3(json.dumps(zattrs, indent=2), uri_to_s3_key(f"{zarr_uri}/.zattrs"))
 
-    # print(zmeta)
+    for zmetadata_uri, zmetadata in updated_consolidated_metadata(zarr_uri, zattrs).items():
+        put_string_to_s3(zmetadata, uri_to_s3_key(zmetadata_uri))
 
-    zobj = json.loads(r.content.decode())
 
-    zobj["omero"]["channels"][0]["color"] = "FFFFFF"
+def replace_first_channel_color(image):
 
-    as_indented_str = json.dumps(zobj, indent=2)
+    ngff_rep = get_ome_ngff_rep(image)
+
+    # The rep may point at a bioformats2raw root rather than the image group
+    zarr_uri = resolve_multiscale_image_uri(ngff_rep.uri)
+    # From consolidated metadata where there is some
+    zobj = fetch_group_attributes(zarr_uri)
 
-    dst_key_as_path = Path(urlparse(zattrs_uri).path).relative_to(f"/{c2zsettings.bucket_name}")
+    zobj["omero"]["channels"][0]["color"] = "FFFFFF"
 
-    put_string_to_s3(as_indented_str, str(dst_key_as_path))
+    write_back_zattrs(zarr_uri, zobj)
 
 
 def write_back_zmeta(accession_id: str, image_id: str, zmeta: ZMeta):
@@ -117,23 +126,22 @@ def main(accession_id, image_id):
     image = bia_study.images[image_id]
 
     ngff_rep = get_ome_ngff_rep(image)
-    zattrs_uri = f"{ngff_rep.uri}/.zattrs"
 
-    r = requests.get(zattrs_uri)
-    zmeta = ZMeta.parse_raw(r.content)
+    zarr_uri = resolve_multiscale_image_uri(ngff_rep.uri)
+    zattrs = fetch_group_attributes(zarr_uri)
+    zmeta = ZMeta.parse_obj(zattrs)
 
     # Write a backup
     with open(f"{accession_id}.backup.zattrs", "w") as fh:
-        fh.write(r.content.decode())
+        fh.write(json.dumps(zattrs, indent=2))
 
     if len(zmeta.omero.channels) == 1:
         zmeta.omero.channels[0].color = "FFFFFF"
     else:
         set_multichannel_rendering(zmeta)
 
-    # Get key and write back to S3
-    dst_key_as_path = Path(urlparse(zattrs_uri).path).relative_to(f"/{c2zsettings.bucket_name}")
-    put_string_to_s3(zmeta.json(indent=2), str(dst_key_as_path))
+    # Write back to S3, keeping consolidated metadata in step
+    write_back_zattrs(zarr_uri, json.loads(zmeta.json()))
 
 
 if __name__ == "__main__":
@@ -2,9 +2,8 @@ import logging
 
 from PIL import Image, ImageOps
 import numpy as np
-from ome_zarr.io import parse_url
-from ome_zarr.reader import Reader
 from bia_integrator_tools.utils import get_ome_ngff_rep
+from bia_integrator_tools.zipped_zarr import multiscale_arrays_from_zarr_uri
 from bia_integrator_core.integrator import load_and_annotate_study
 from microfilm.colorify import multichannel_to_rgb
 from matplotlib.colors import LinearSegmentedColormap
@@ -36,15 +35,8 @@ def scale_to_uint8(array):
 
 def highest_res_image_from_zarr_uri(zarr_uri):
 
-    # store = parse_url(zarr_uri, mode="r").store
-
-    reader = Reader(parse_url(zarr_uri))
-    # nodes may include images, labels etc
-    nodes = list(reader())
-    # first node will be the image pixel data
-    image_node = nodes[0]
-
-    highest_res = image_node.data[0]
+    # Uses consolidated metadata where the Zarr has it
+    highest_res = multiscale_arrays_from_zarr_uri(zarr_uri)[0]
     
     return highest_res
 
@@ -53,13 +45,10 @@ def min_dim_array_from_zarr_uri(zarr_uri, dimensions):
 
     min_x, min_y = dimensions
 
-    reader = Reader(parse_url(zarr_uri))
-    # nodes may include images, labels etc
-    nodes = list(reader())
-    # first node will be the image pixel data
-    image_node = nodes[0]
+    # Also handles zipped Zarr (<archive>.zip/<path in zarr>), read in place
+    multiscale_arrays = multiscale_arrays_from_zarr_uri(zarr_uri)
 
-    for array in reversed(image_node.data):
+    for array in reversed(multiscale_arrays):
 
         if len(array.shape) == 5:
             size_t, size_c, size_z, size_y, size_x = array.shape
@@ -69,7 +58,7 @@ def min_dim_array_from_zarr_uri(zarr_uri, dimensions):
         if (size_x >= min_x) and (size_y >= min_y):
             return array
         
-    return image_node.data[0]
+    return multiscale_arrays[0]
         
 
 from matplotlib.colors import LinearSegmentedColormap
@@ -0,0 +1,189 @@
+"""Local stand-in HTTP servers, used by the benchmark scripts in place of remote
+services."""
+
+import time
+import hashlib
+import bisect
+import threading
+from typing import Dict, List, Tuple
+from xml.sax.saxutils import escape
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, body: bytes, status: int = 200, content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_in_thread(handler_cls):
+    """Start a server for handler_cls on a free local port, returning the server and
+    its base URL. Call server.shutdown() when finished."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    return server, base_url
+
+
+def list_objects_v2_body(
+        bucket_name: str,
+        query: Dict[str, str],
+        keys: List[str],
+        objects: Dict[str, Tuple[int, str]],
+        max_keys: int = 1000
+    ) -> bytes:
+    """ListObjectsV2 response for the given query over keys (sorted), with the size
+    and ETag of each object in objects."""
+
+    prefix = query.get("prefix", "")
+    delimiter = query.get("delimiter", "")
+    start_after = query.get("continuation-token", "")
+    page_size = min(int(query.get("max-keys", max_keys)), max_keys)
+
+    contents, common_prefixes = [], []
+    next_token = None
+    n = bisect.bisect_right(keys, start_after) if start_after else bisect.bisect_left(keys, prefix)
+    while n < len(keys) and keys[n].startswith(prefix):
+        if len(contents) + len(common_prefixes) == page_size:
+            next_token = marker
+            break
+        key = keys[n]
+        if delimiter and delimiter in key[len(prefix):]:
+            common_prefix = key[:key.index(delimiter, len(prefix)) + len(delimiter)]
+            common_prefixes.append(common_prefix)
+            marker = common_prefix + "\uffff"
+            n = bisect.bisect_right(keys, marker)
+            continue
+        contents.append(key)
+        marker = key
+        n += 1
+
+    body = ['<?xml version="1.0" encoding="UTF-8"?>', '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">']
+    body.append(f"<Name>{escape(bucket_name)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(contents) + len(common_prefixes)}</KeyCount>")
+    body.append(f"<MaxKeys>{page_size}</MaxKeys><IsTruncated>{'true' if next_token else 'false'}</IsTruncated>")
+    if next_token:
+        body.append(f"<NextContinuationToken>{escape(next_token)}</NextContinuationToken>")
+    for key in contents:
+        size, etag = objects[key]
+        body.append(f"<Contents><Key>{escape(key)}</Key><Size>{size}</Size><ETag>&quot;{etag}&quot;</ETag><StorageClass>STANDARD</StorageClass></Contents>")
+    for common_prefix in common_prefixes:
+        body.append(f"<CommonPrefixes><Prefix>{escape(common_prefix)}</Prefix></CommonPrefixes>")
+    body.append("</ListBucketResult>")
+
+    return "".join(body).encode("utf-8")
+
+
+def _bucket_and_query(path: str) -> Tuple[str, Dict[str, str]]:
+
+    parsed = urlparse(path)
+    bucket_name = parsed.path.strip("/").split("/")[0]
+    query = {name: values[0] for name, values in parse_qs(parsed.query).items()}
+
+    return bucket_name, query
+
+
+def make_s3_listing_handler(objects: Dict[str, int], latency: float = 0.0, max_keys: int = 1000):
+    """Handler for a minimal, anonymous S3 ListObjectsV2 endpoint serving the given
+    object keys and sizes (in any bucket), with latency seconds of delay per
+    request."""
+
+    keys = sorted(objects)
+    objects_with_etags = {key: (size, "0") for key, size in objects.items()}
+
+    class S3ListingHandler(QuietHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            bucket_name, query = _bucket_and_query(self.path)
+            body = list_objects_v2_body(bucket_name, query, keys, objects_with_etags, max_keys)
+            self.send_body(body, content_type="application/xml")
+
+    return S3ListingHandler
+
+
+def make_range_handler(data: bytes, latency: float = 0.0):
+    """Handler serving data at any path, with support for HEAD and single Range
+    requests (including suffix ranges). The number of requests and body bytes
+    sent are counted in the handler's stats dict."""
+
+    stats = {"requests": 0, "bytes": 0}
+
+    class RangeHandler(QuietHandler):
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            time.sleep(latency)
+            stats["requests"] += 1
+            range_header = self.headers.get("Range")
+            if not range_header:
+                body = data if self.command == "GET" else b""
+                stats["bytes"] += len(body)
+                self.send_body(data, content_type="application/octet-stream", headers={"Accept-Ranges": "bytes"})
+                return
+
+            first, last = range_header[len("bytes="):].split("-")
+            if not first:
+                start, end = max(0, len(data) - int(last)), len(data) - 1
+            else:
+                start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+
+            body = data[start:end + 1]
+            stats["bytes"] += len(body)
+            self.send_body(
+                body,
+                status=206,
+                content_type="application/octet-stream",
+                headers={"Content-Range": f"bytes {start}-{end}/{len(data)}", "Accept-Ranges": "bytes"}
+            )
+
+    RangeHandler.stats = stats
+
+    return RangeHandler
+
+
+def make_s3_put_handler(latency: float = 0.0):
+    """Handler for a minimal S3 endpoint accepting PUT (single part uploads only) and
+    ListObjectsV2, with latency seconds of delay per request. Uploaded objects are
+    kept in the handler's objects dict, by bucket and key path."""
+
+    objects: Dict[str, bytes] = {}
+
+    class S3PutHandler(QuietHandler):
+        def do_PUT(self):
+            time.sleep(latency)
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            objects[urlparse(self.path).path] = body
+            self.send_body(b"", content_type="application/xml", headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        def do_GET(self):
+            time.sleep(latency)
+            bucket_name, query = _bucket_and_query(self.path)
+            bucket_path = f"/{bucket_name}/"
+            bucket_objects = {
+                path[len(bucket_path):]: (len(body), hashlib.md5(body).hexdigest())
+                for path, body in list(objects.items())
+                if path.startswith(bucket_path)
+            }
+            body = list_objects_v2_body(bucket_name, query, sorted(bucket_objects), bucket_objects)
+            self.send_body(body, content_type="application/xml")
+
+    S3PutHandler.objects = objects
+
+    return S3PutHandler
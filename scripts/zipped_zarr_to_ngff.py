@@ -1,37 +1,16 @@
 import logging
-import pathlib
-import tempfile
-import subprocess
-from zipfile import ZipFile
 
 import click
 
 from bia_integrator_core.models import BIAImageRepresentation
 from bia_integrator_core.integrator import load_and_annotate_study
 from bia_integrator_core.interface import persist_image_representation
-from bia_integrator_tools.io import (
-    stage_fileref_and_get_fpath, c2zsettings, upload_dirpath_as_zarr_image_rep
-)
+from bia_integrator_tools.io import upload_zipped_zarr_as_zarr_image_rep
+from bia_integrator_tools.utils import get_image_rep_by_type
 
 logger = logging.getLogger(__file__)
 
 
-def unzip_and_get_path_of_contents(zip_fpath, td):
-    zf = ZipFile(zip_fpath)
-    dirpath = pathlib.Path(td)
-    logger.info(f"Unzipping to {dirpath}")
-    zf.extractall(path=dirpath)
-
-    dirpath_list = list(dirpath.glob("*"))
-    assert len(dirpath_list) == 1
-    src_dirpath = dirpath_list[0]
-
-    return src_dirpath
-
-
-
-
-
 @click.command()
 @click.argument("accession_id")
 @click.argument("image_id")
@@ -45,13 +24,9 @@ def main(accession_id, image_id):
 
     path_in_zarr = zipped_zarr_rep.attributes.get("path_in_zarr", "")
 
-    zip_fpath = stage_fileref_and_get_fpath(accession_id, fileref)
-
-    with tempfile.TemporaryDirectory() as td:
-        src_dirpath = unzip_and_get_path_of_contents(zip_fpath, td)
-
-        uri = upload_dirpath_as_zarr_image_rep(src_dirpath, accession_id, image_id)
-        uri += path_in_zarr
+    # Members are streamed from the remote archive straight to S3
+    uri = upload_zipped_zarr_as_zarr_image_rep(fileref.uri, accession_id, image_id)
+    uri += path_in_zarr
 
     rep = BIAImageRepresentation(
         accession_id=accession_id,